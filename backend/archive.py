@@ -0,0 +1,321 @@
+"""
+Cold storage for inactive chats.
+Moves the messages of chats that have not been active for a while into a single
+compressed blob per chat, and restores them when the chat is accessed again.
+"""
+import json
+import threading
+import zlib
+from importlib.util import find_spec
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+from models import db, Chat, Message, ChatArchive, GenerationContext
+
+# zstd is optional; zlib from the standard library is always available. zstandard is only
+# looked up at startup and imported when an archive is first written or read.
+DEFAULT_CODEC = 'zstd' if find_spec('zstandard') else 'zlib'
+
+
+def _zstandard(error: str):
+    try:
+        import zstandard
+    except ImportError:
+        raise RuntimeError(error) from None
+    return zstandard
+
+
+def compress(data: bytes, codec: str = DEFAULT_CODEC) -> bytes:
+    """Compress bytes with the given codec."""
+    if codec == 'zstd':
+        zstandard = _zstandard('zstd codec requested but the zstandard package is not installed')
+        return zstandard.ZstdCompressor(level=10).compress(data)
+    if codec == 'zlib':
+        return zlib.compress(data, 9)
+    raise ValueError(f'Unknown archive codec: {codec}')
+
+
+def decompress(data: bytes, codec: str) -> bytes:
+    """Decompress bytes written by compress()."""
+    if codec == 'zstd':
+        zstandard = _zstandard('Archive uses zstd but the zstandard package is not installed')
+        return zstandard.ZstdDecompressor().decompress(data)
+    if codec == 'zlib':
+        return zlib.decompress(data)
+    raise ValueError(f'Unknown archive codec: {codec}')
+
+
+# Message columns beyond the API fields that must survive a round trip through the archive
+_EXTRA_COLUMNS = (
+    'model', 'prompt_eval_count', 'eval_count', 'prompt_eval_duration',
+    'eval_duration', 'load_duration', 'total_duration', 'usage_rolled_up', 'update_seq'
+)
+
+
+def _serialize_messages(messages: List[Message]) -> bytes:
+    rows = []
+    for msg in messages:
+        row = [msg.id, msg.role, msg.content, msg.sequence_order, msg.created_at.isoformat()]
+        extra = {column: getattr(msg, column) for column in _EXTRA_COLUMNS if getattr(msg, column)}
+        # Always written, so archives from before branching can be told apart
+        extra['parent_id'] = msg.parent_id
+        row.append(extra)
+        rows.append(row)
+    return json.dumps(rows, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def _deserialize_messages(archive: ChatArchive) -> List[Tuple[Dict, Dict]]:
+    # Returns (message dict as in Message.to_dict, extra column values) pairs
+    rows = json.loads(decompress(archive.data, archive.codec).decode('utf-8'))
+    result = []
+    for row in rows:
+        extra = row[5] if len(row) > 5 else {}
+        result.append((
+            {
+                'id': row[0],
+                'chat_id': archive.chat_id,
+                'role': row[1],
+                'content': row[2],
+                'sequence_order': row[3],
+                'created_at': row[4],
+                'model': extra.get('model'),
+                'parent_id': extra.get('parent_id')
+            },
+            extra
+        ))
+    if result and not any('parent_id' in extra for _, extra in result):
+        _link_legacy_rows(result)
+    return result
+
+
+def _link_legacy_rows(rows: List[Tuple[Dict, Dict]]):
+    # Archives written before branching hold a flat history: chain it the way the branching
+    # migration chained live messages (runs of assistant replies become siblings)
+    tip = None
+    previous = None
+    for row, extra in rows:
+        if previous is None:
+            parent_id = None
+        elif row['role'] == 'assistant' and previous['role'] == 'assistant':
+            parent_id = previous['parent_id']
+        else:
+            parent_id = tip
+        row['parent_id'] = extra['parent_id'] = parent_id
+        if parent_id is None or parent_id == tip:
+            tip = row['id']
+        previous = row
+
+
+def _default_leaf(rows: List[Tuple[Dict, Dict]]) -> int:
+    # For chats archived before they had an active leaf: the first of the newest message's
+    # siblings, which is the branch the flat history continued
+    last = rows[-1][0]
+    return next(row['id'] for row, _ in rows if row['parent_id'] == last['parent_id'])
+
+
+def _set_archived_at(chat_id: str, value: Optional[datetime], touch: bool = False, **values):
+    # Keep updated_at as is: archiving is not activity and must not change the chat's ETag.
+    # touch moves it on anyway, for when the messages a client may have cached did change.
+    Chat.query.filter_by(id=chat_id).update(
+        {Chat.archived_at: value, Chat.updated_at: datetime.utcnow() if touch else Chat.updated_at, **values},
+        synchronize_session='fetch'
+    )
+
+
+def archive_chat(chat_id: str, codec: str = DEFAULT_CODEC) -> bool:
+    """Move a chat's messages into a compressed archive row. Returns False if there was nothing to archive."""
+    chat = Chat.query.get(chat_id)
+    if not chat or chat.archived_at is not None:
+        return False
+    messages = Message.query.filter_by(chat_id=chat_id).order_by(Message.sequence_order).all()
+    if not messages:
+        return False
+
+    raw = _serialize_messages(messages)
+    data = compress(raw, codec)
+    raw_size = sum(len(msg.content.encode('utf-8')) for msg in messages)
+
+    db.session.add(ChatArchive(
+        chat_id=chat_id,
+        codec=codec,
+        data=data,
+        message_count=len(messages),
+        raw_size=raw_size,
+        compressed_size=len(data)
+    ))
+    Message.query.filter_by(chat_id=chat_id).delete(synchronize_session=False)
+    # A cold chat won't be continued soon, so its saved Ollama context isn't worth keeping
+    GenerationContext.query.filter_by(chat_id=chat_id).delete(synchronize_session=False)
+    _set_archived_at(chat_id, datetime.utcnow())
+    db.session.commit()
+    db.session.expire(chat, ['messages'])
+    return True
+
+
+def load_archived_messages(chat: Chat) -> List[Dict]:
+    """Decode an archived chat's messages without restoring them to the messages table."""
+    if chat.archived_at is None or chat.archive is None:
+        return []
+    return [message for message, _ in _deserialize_messages(chat.archive)]
+
+
+def rehydrate_chat(chat_id: str) -> bool:
+    """Restore an archived chat's messages to the messages table. Returns False if the chat wasn't archived."""
+    chat = Chat.query.get(chat_id)
+    if not chat or chat.archived_at is None:
+        return False
+    archive = chat.archive
+    if archive is None:
+        _set_archived_at(chat_id, None)
+        db.session.commit()
+        return False
+
+    rows = _deserialize_messages(archive)
+    # Keep the original ids unless SQLite has handed them out again in the meantime
+    taken = {
+        message_id for (message_id,) in db.session.query(Message.id).filter(
+            Message.id.in_([row['id'] for row, _ in rows])
+        )
+    }
+    # Renumber taken ids above both the live and the archived ones, and point children at them
+    new_ids = {}
+    if taken:
+        next_id = max(db.session.query(db.func.max(Message.id)).scalar() or 0, max(row['id'] for row, _ in rows)) + 1
+        for row, _ in rows:
+            if row['id'] in taken:
+                new_ids[row['id']] = next_id
+                next_id += 1
+    for row, extra in rows:
+        extra = dict(extra)
+        parent_id = extra.pop('parent_id', None)
+        db.session.add(Message(
+            id=new_ids.get(row['id'], row['id']),
+            chat_id=chat_id,
+            parent_id=new_ids.get(parent_id, parent_id),
+            role=row['role'],
+            content=row['content'],
+            sequence_order=row['sequence_order'],
+            created_at=datetime.fromisoformat(row['created_at']),
+            **extra
+        ))
+    leaf_id = chat.active_leaf_id if chat.active_leaf_id is not None else _default_leaf(rows)
+    db.session.delete(archive)
+    # Renumbered messages invalidate the ids clients fetched while the chat was archived,
+    # so their If-None-Match must not get a 304
+    _set_archived_at(chat_id, None, touch=bool(new_ids), active_leaf_id=new_ids.get(leaf_id, leaf_id))
+    db.session.commit()
+    db.session.expire(chat, ['messages'])
+    return True
+
+
+def archive_inactive_chats(max_age_days: int, codec: str = DEFAULT_CODEC, limit: Optional[int] = None) -> int:
+    """Archive every chat in the current shard inactive for longer than max_age_days. Returns the number archived."""
+    cutoff = datetime.utcnow() - timedelta(days=max_age_days)
+    query = db.session.query(Chat.id).filter(
+        Chat.archived_at.is_(None),
+        Chat.message_count > 0,
+        Chat.updated_at < cutoff
+    ).order_by(Chat.updated_at)
+    if limit:
+        query = query.limit(limit)
+
+    archived = 0
+    for (chat_id,) in query.all():
+        if archive_chat(chat_id, codec):
+            archived += 1
+    return archived
+
+
+def _archive_engine():
+    # The database file holding chat_archives for the currently selected shard
+    return db.session.get_bind(mapper=ChatArchive)
+
+
+def get_archive_stats() -> Dict:
+    """
+    Summarize the archive tier. content_bytes_saved compares message text with its compressed
+    blobs; the database file only shrinks once freed pages (free_bytes) are vacuumed.
+    """
+    chats, messages, raw_size, compressed_size = db.session.query(
+        db.func.count(ChatArchive.chat_id),
+        db.func.coalesce(db.func.sum(ChatArchive.message_count), 0),
+        db.func.coalesce(db.func.sum(ChatArchive.raw_size), 0),
+        db.func.coalesce(db.func.sum(ChatArchive.compressed_size), 0)
+    ).one()
+    with _archive_engine().connect() as connection:
+        page_size = connection.exec_driver_sql('PRAGMA page_size').scalar()
+        page_count = connection.exec_driver_sql('PRAGMA page_count').scalar()
+        freelist_count = connection.exec_driver_sql('PRAGMA freelist_count').scalar()
+    return {
+        'archived_chats': chats,
+        'archived_messages': messages,
+        'raw_bytes': raw_size,
+        'compressed_bytes': compressed_size,
+        'content_bytes_saved': raw_size - compressed_size,
+        'compression_ratio': round(raw_size / compressed_size, 2) if compressed_size else None,
+        'database_bytes': page_count * page_size,
+        'free_pages': freelist_count,
+        'free_bytes': freelist_count * page_size
+    }
+
+
+def _database_bytes(engine) -> int:
+    with engine.connect() as connection:
+        page_size = connection.exec_driver_sql('PRAGMA page_size').scalar()
+        return connection.exec_driver_sql('PRAGMA page_count').scalar() * page_size
+
+
+def incremental_vacuum(pages: int = 1000) -> Optional[int]:
+    """
+    Return up to `pages` free pages to the filesystem. Returns the number of bytes the database
+    file shrank by, measured before and after, or None unless auto_vacuum is INCREMENTAL.
+    """
+    engine = _archive_engine()
+    # auto_vacuum: 0 = NONE, 1 = FULL, 2 = INCREMENTAL
+    with engine.connect() as connection:
+        if connection.exec_driver_sql('PRAGMA auto_vacuum').scalar() != 2:
+            return None
+    size_before = _database_bytes(engine)
+    # Each step of the pragma frees one page; executescript steps it to completion
+    connection = engine.raw_connection()
+    try:
+        connection.driver_connection.executescript(f'PRAGMA incremental_vacuum({int(pages)});')
+    finally:
+        connection.close()
+    return size_before - _database_bytes(engine)
+
+
+def enable_incremental_vacuum():
+    """Switch the database to auto_vacuum=INCREMENTAL. Requires a full VACUUM, so run it offline."""
+    with _archive_engine().connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+        connection.exec_driver_sql('PRAGMA auto_vacuum = INCREMENTAL')
+        connection.exec_driver_sql('VACUUM')
+
+
+def start_archiver(app, max_age_days: int, interval_seconds: int, vacuum_pages: int = 1000) -> threading.Thread:
+    """Start a daemon thread that periodically archives inactive chats and vacuums freed pages."""
+    from database import each_shard
+    stop_event = threading.Event()
+
+    def run():
+        while not stop_event.wait(interval_seconds):
+            with app.app_context():
+                try:
+                    for shard in each_shard():
+                        archived = archive_inactive_chats(max_age_days)
+                        if archived:
+                            print(f"Archived {archived} inactive chats" + (f" in shard {shard}" if shard is not None else ""))
+                        reclaimed = incremental_vacuum(vacuum_pages)
+                        if reclaimed:
+                            print(f"Vacuum reclaimed {reclaimed} bytes" + (f" in shard {shard}" if shard is not None else ""))
+                except Exception as e:
+                    import traceback
+                    print(f"ERROR: Archive job failed: {e}")
+                    print(traceback.format_exc())
+                    db.session.rollback()
+                finally:
+                    db.session.remove()
+
+    thread = threading.Thread(target=run, daemon=True, name='chat-archiver')
+    thread.stop_event = stop_event
+    thread.start()
+    return thread
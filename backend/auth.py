@@ -0,0 +1,169 @@
+"""
+Google ID token verification with certificate caching.
+Google's signing certificates are fetched over a pooled HTTP session and kept
+for as long as their Cache-Control headers allow; verified tokens are
+memoized until they expire, so repeated logins don't touch the network.
+google-auth and requests are imported on the first login, not at startup.
+"""
+import hashlib
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Optional, Tuple
+
+GOOGLE_CERTS_URL = 'https://www.googleapis.com/oauth2/v1/certs'
+GOOGLE_ISSUERS = ('accounts.google.com', 'https://accounts.google.com')
+
+_MAX_AGE_RE = re.compile(r'max-age=(\d+)')
+
+
+class GoogleTokenVerifier:
+    """Verifies Google OAuth2 ID tokens against cached signing certificates."""
+
+    def __init__(self, client_id: str, certs: Optional[Dict[str, str]] = None,
+                 certs_url: str = GOOGLE_CERTS_URL, default_certs_ttl: int = 3600,
+                 max_cached_tokens: int = 1024, clock_skew_in_seconds: int = 10,
+                 forced_refresh_interval: int = 60,
+                 fetch_certs: Optional[Callable[[], Tuple[Dict[str, str], float]]] = None):
+        """
+        Args:
+            client_id: The OAuth client ID tokens must be issued for.
+            certs: Fixed {key id: x509 certificate} mapping. When given, the network is never used.
+            certs_url: Endpoint returning Google's current signing certificates.
+            default_certs_ttl: Seconds to keep certificates if the response has no max-age.
+            max_cached_tokens: Number of verified tokens to remember.
+            clock_skew_in_seconds: Allowed clock skew for iat/exp checks.
+            forced_refresh_interval: Minimum seconds between refreshes triggered by an unknown key id.
+            fetch_certs: Called instead of downloading certs_url; returns ({key id: certificate},
+                seconds to keep them). For tests and deployments with their own copy of the keys.
+        """
+        self.client_id = client_id
+        self.certs_url = certs_url
+        self.default_certs_ttl = default_certs_ttl
+        self.max_cached_tokens = max_cached_tokens
+        self.clock_skew_in_seconds = clock_skew_in_seconds
+        self.forced_refresh_interval = forced_refresh_interval
+        self.fetch_certs = fetch_certs
+        self._static_certs = certs is not None
+        self._certs = certs or {}
+        self._certs_expire_at = float('inf') if certs is not None else 0.0
+        self._tokens = OrderedDict()  # sha256(token) -> (exp, idinfo)
+        self._last_forced_refresh = float('-inf')
+        self._lock = threading.Lock()  # Guards the certificates and the token cache
+        self._fetch_lock = threading.Lock()  # Held while fetching, so only one request goes to Google
+        self._request = None
+
+    def _get_request(self):
+        # One requests.Session, so TLS connections to Google are pooled across logins
+        if self._request is None:
+            import requests as http_requests
+            from google.auth.transport import requests
+            self._request = requests.Request(session=http_requests.Session())
+        return self._request
+
+    def _fetch_certs(self):
+        """Download the certificates. Returns ({key id: certificate}, expiry timestamp)."""
+        if self.fetch_certs is not None:
+            certs, ttl = self.fetch_certs()
+            return certs, time.time() + max(ttl, 0)
+
+        from google.auth import exceptions
+        response = self._get_request()(self.certs_url, method='GET')
+        if response.status != 200:
+            raise exceptions.TransportError(f'Could not fetch certificates at {self.certs_url}')
+
+        ttl = self.default_certs_ttl
+        match = _MAX_AGE_RE.search(response.headers.get('cache-control', ''))
+        if match:
+            ttl = int(match.group(1)) - int(response.headers.get('age', 0) or 0)
+        return json.loads(response.data.decode('utf-8')), time.time() + max(ttl, 0)
+
+    def get_certs(self, force_refresh: bool = False) -> Dict[str, str]:
+        """
+        Return the signing certificates, refreshing them when the cached copy has expired.
+        force_refresh fetches them even if it hasn't, at most once per forced_refresh_interval,
+        so tokens with made-up key ids can't make every login wait on Google.
+        """
+        from google.auth import exceptions
+        if self._static_certs:
+            return self._certs
+
+        with self._fetch_lock:
+            # Re-checked under the fetch lock: another thread may just have refreshed them
+            with self._lock:
+                now = time.time()
+                if force_refresh and now - self._last_forced_refresh < self.forced_refresh_interval:
+                    force_refresh = False
+                if not force_refresh and now < self._certs_expire_at:
+                    return self._certs
+                if force_refresh:
+                    self._last_forced_refresh = now
+
+            # Not under self._lock, so cached tokens are still served while Google is slow
+            try:
+                certs, expire_at = self._fetch_certs()
+            except exceptions.TransportError:
+                # Keep serving stale certificates while Google is unreachable
+                if not self._certs:
+                    raise
+                print("WARNING: Could not refresh Google certificates, using cached copy")
+                return self._certs
+
+            with self._lock:
+                self._certs, self._certs_expire_at = certs, expire_at
+            return certs
+
+    def verify(self, token: str) -> Dict:
+        """Verify an ID token and return its claims. Raises ValueError if it is invalid."""
+        from google.auth import jwt
+        if isinstance(token, str):
+            token = token.encode('utf-8')
+        key = hashlib.sha256(token).digest()
+        now = time.time()
+
+        with self._lock:
+            cached = self._tokens.get(key)
+            if cached and cached[0] > now:
+                self._tokens.move_to_end(key)
+                return dict(cached[1])
+
+        certs = self.get_certs()
+        # Google rotates keys; a token signed with a key we haven't seen means our copy is stale
+        if jwt.decode_header(token).get('kid') not in certs:
+            certs = self.get_certs(force_refresh=True)
+
+        idinfo = jwt.decode(
+            token,
+            certs=certs,
+            audience=self.client_id,
+            clock_skew_in_seconds=self.clock_skew_in_seconds
+        )
+        if idinfo.get('iss') not in GOOGLE_ISSUERS:
+            raise ValueError('Wrong issuer.')
+
+        with self._lock:
+            self._tokens[key] = (idinfo['exp'], idinfo)
+            self._tokens.move_to_end(key)
+            while len(self._tokens) > self.max_cached_tokens:
+                self._tokens.popitem(last=False)
+        return dict(idinfo)
+
+
+def create_verifier(app) -> GoogleTokenVerifier:
+    """
+    Create the verifier from the GOOGLE_* settings. Certificates come from GOOGLE_CERTS (a dict)
+    or the JSON file GOOGLE_CERTS_FILE, which turn off fetching; from GOOGLE_CERTS_FETCHER (see
+    GoogleTokenVerifier's fetch_certs); or else from GOOGLE_CERTS_URL.
+    """
+    certs = app.config.get('GOOGLE_CERTS')
+    if certs is None and app.config.get('GOOGLE_CERTS_FILE'):
+        with open(app.config['GOOGLE_CERTS_FILE'], encoding='utf-8') as f:
+            certs = json.load(f)
+    return GoogleTokenVerifier(
+        app.config['GOOGLE_CLIENT_ID'],
+        certs=certs,
+        certs_url=app.config.get('GOOGLE_CERTS_URL') or GOOGLE_CERTS_URL,
+        fetch_certs=app.config.get('GOOGLE_CERTS_FETCHER')
+    )
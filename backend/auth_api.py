@@ -0,0 +1,109 @@
+"""
+Auth API blueprint: logging in with a Google ID token, logging out and the current user.
+"""
+from flask import Blueprint, current_app, request, jsonify
+from flask_login import LoginManager, login_user, logout_user, login_required, current_user
+from models import User
+from database import get_or_create_user
+
+bp = Blueprint('auth', __name__)
+
+login_manager = LoginManager()
+login_manager.login_view = None  # We handle login via API, not Flask views
+
+@login_manager.user_loader
+def load_user(user_id):
+    return User.query.get(user_id)
+
+@bp.route('/api/auth/login', methods=['POST', 'OPTIONS'])
+def login():
+    """Authenticate user with Google OAuth token."""
+    if request.method == 'OPTIONS':
+        response = jsonify({})
+        response.headers.add('Access-Control-Allow-Origin', 'http://localhost:3000')
+        response.headers.add('Access-Control-Allow-Methods', 'POST, OPTIONS')
+        response.headers.add('Access-Control-Allow-Headers', 'Content-Type')
+        response.headers.add('Access-Control-Allow-Credentials', 'true')
+        return response
+    
+    try:
+        data = request.json
+        token = data.get('token')
+        
+        if not token:
+            return jsonify({'error': 'Token is required'}), 400
+        
+        # Verify the token with Google
+        try:
+            # Also verifies the issuer
+            idinfo = current_app.extensions['token_verifier'].verify(token)
+            
+            # Get user info
+            google_id = idinfo['sub']
+            email = idinfo['email']
+            name = idinfo.get('name', '')
+            picture = idinfo.get('picture', '')
+            
+            # Get or create user
+            user = get_or_create_user(google_id, email, name, picture)
+            
+            # Log the user in
+            login_user(user, remember=True)
+            
+            response = jsonify({
+                'success': True,
+                'user': user.to_dict()
+            })
+            response.headers.add('Access-Control-Allow-Origin', 'http://localhost:3000')
+            response.headers.add('Access-Control-Allow-Credentials', 'true')
+            return response
+        except ValueError as e:
+            response = jsonify({'error': f'Invalid token: {str(e)}'})
+            response.headers.add('Access-Control-Allow-Origin', 'http://localhost:3000')
+            response.headers.add('Access-Control-Allow-Credentials', 'true')
+            return response, 401
+    except Exception as e:
+        response = jsonify({'error': str(e)})
+        response.headers.add('Access-Control-Allow-Origin', 'http://localhost:3000')
+        response.headers.add('Access-Control-Allow-Credentials', 'true')
+        return response, 500
+
+@bp.route('/api/auth/logout', methods=['POST', 'OPTIONS'])
+@login_required
+def logout():
+    """Logout the current user."""
+    if request.method == 'OPTIONS':
+        response = jsonify({})
+        response.headers.add('Access-Control-Allow-Origin', 'http://localhost:3000')
+        response.headers.add('Access-Control-Allow-Methods', 'POST, OPTIONS')
+        response.headers.add('Access-Control-Allow-Headers', 'Content-Type')
+        response.headers.add('Access-Control-Allow-Credentials', 'true')
+        return response
+    
+    logout_user()
+    response = jsonify({'success': True})
+    response.headers.add('Access-Control-Allow-Origin', 'http://localhost:3000')
+    response.headers.add('Access-Control-Allow-Credentials', 'true')
+    return response
+
+@bp.route('/api/auth/me', methods=['GET', 'OPTIONS'])
+def get_current_user():
+    """Get the current authenticated user."""
+    if request.method == 'OPTIONS':
+        response = jsonify({})
+        response.headers.add('Access-Control-Allow-Origin', 'http://localhost:3000')
+        response.headers.add('Access-Control-Allow-Methods', 'GET, OPTIONS')
+        response.headers.add('Access-Control-Allow-Headers', 'Content-Type')
+        response.headers.add('Access-Control-Allow-Credentials', 'true')
+        return response
+    
+    if current_user.is_authenticated:
+        response = jsonify({'user': current_user.to_dict()})
+        response.headers.add('Access-Control-Allow-Origin', 'http://localhost:3000')
+        response.headers.add('Access-Control-Allow-Credentials', 'true')
+        return response
+    else:
+        response = jsonify({'user': None})
+        response.headers.add('Access-Control-Allow-Origin', 'http://localhost:3000')
+        response.headers.add('Access-Control-Allow-Credentials', 'true')
+        return response, 401
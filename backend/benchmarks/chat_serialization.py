@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Benchmark serializing a long chat: ORM objects + to_dict + jsonify versus the
+row-tuple read path in database.get_chat with each available JSON encoder.
+
+Builds a throwaway SQLite database with one chat of --messages messages, checks
+that every variant produces the same bytes, then times --repeat requests' worth
+of work for each (fresh session per request, like the app).
+
+Usage (from backend/):
+    python benchmarks/chat_serialization.py --messages 2000 --repeat 50
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from flask import Flask, jsonify
+from models import db, User, Chat, Message
+from database import get_chat, get_path, _branch_dicts
+from serialization import ENCODERS
+
+
+def create_app(path):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{path}'
+    db.init_app(app)
+    return app
+
+
+def populate(message_count, content_length, ascii_only=False):
+    """Create one chat with a linear history of message_count messages. Returns the chat id."""
+    db.create_all()
+    user = User(google_id='bench', email='bench@example.com')
+    db.session.add(user)
+    db.session.flush()
+    chat = Chat(user_id=user.id, title='Benchmark')
+    db.session.add(chat)
+    db.session.flush()
+    parent_id = None
+    sentence = 'Lorem ipsum dolor sit amet, cafe. ' if ascii_only else 'Lorem ipsum dolor sit amet, café ☕ '
+    text = (sentence * (content_length // 35 + 1))[:content_length]
+    for i in range(message_count):
+        message = Message(
+            chat_id=chat.id, parent_id=parent_id, role='user' if i % 2 == 0 else 'assistant',
+            content=f'{i}: {text}', sequence_order=i, model=None if i % 2 == 0 else 'gemma3:1b'
+        )
+        db.session.add(message)
+        db.session.flush()
+        parent_id = message.id
+    chat.message_count = message_count
+    chat.active_leaf_id = parent_id
+    db.session.commit()
+    return chat.id
+
+
+def orm_response(chat_id):
+    """The path before the row-tuple read path: ORM objects, to_dict and jsonify."""
+    chat = Chat.query.get(chat_id)
+    messages = Message.query.filter_by(chat_id=chat_id).order_by(Message.sequence_order).all()
+    dicts = []
+    for msg in messages:
+        msg_dict = msg.to_dict()
+        msg_dict['sibling_ids'] = [msg.id]
+        dicts.append(msg_dict)
+    return jsonify(chat.to_dict(messages=dicts)).get_data()
+
+
+def timed(func, repeat):
+    """Run func repeat times, each with a fresh session, and return (seconds per call, last result)."""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = func()
+        db.session.remove()
+    return (time.perf_counter() - start) / repeat, result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=2000)
+    parser.add_argument('--content-length', type=int, default=400)
+    parser.add_argument('--repeat', type=int, default=50)
+    parser.add_argument('--ascii', action='store_true', help='ASCII-only content (orjson output needs no re-encoding)')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        app = create_app(os.path.join(tmp, 'bench.db'))
+        with app.app_context():
+            chat_id = populate(args.messages, args.content_length, args.ascii)
+            leaf_id = Chat.query.get(chat_id).active_leaf_id
+
+            variants = {'orm + to_dict + jsonify': lambda: orm_response(chat_id)}
+            variants['rows + dicts (no encoding)'] = lambda: get_chat(chat_id)
+            for name, encode in ENCODERS.items():
+                variants[f'rows + {name}'] = lambda encode=encode: encode(get_chat(chat_id)) + b'\n'
+            # Path queries alone, to show how much of the time is SQLite
+            variants['path query only'] = lambda: _branch_dicts(chat_id, get_path(chat_id, leaf_id))
+
+            results = {name: timed(func, args.repeat) for name, func in variants.items()}
+
+            expected = results['orm + to_dict + jsonify'][1]
+            for name in variants:
+                if name.startswith('rows + ') and name != 'rows + dicts (no encoding)':
+                    assert results[name][1] == expected, f'{name} output differs from jsonify'
+
+            print(f"{args.messages} messages of ~{args.content_length} chars, {len(expected) / 1024:.0f} KiB of JSON")
+            baseline = results['orm + to_dict + jsonify'][0]
+            for name, (seconds, _) in results.items():
+                print(f"{name:<28} {seconds * 1000:>8.2f}ms  {baseline / seconds:>5.1f}x")
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Check how long it takes a fresh interpreter to import app.py and call create_app(),
+which is what every gunicorn worker and `flask` command pays before doing anything.
+
+Runs the import --repeat times in new processes and takes the fastest. Fails (exit
+status 1) if that is over --budget-ms, or if a dependency that should only be loaded
+on first use (ollama, google-auth, alembic, orjson, ...) was imported. With --verbose, lists
+the slowest top-level imports from python -X importtime.
+
+Usage (from backend/):
+    python benchmarks/import_time.py --budget-ms 800
+
+tests/test_startup.py runs the same check with a looser budget as part of the test suite.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Only needed by some code paths; importing them at startup is a regression
+LAZY_MODULES = (
+    'ollama', 'httpx', 'google.auth', 'google.oauth2', 'requests', 'flask_migrate', 'alembic', 'orjson', 'zstandard'
+)
+
+PROBE = f'''
+import json, sys, time
+start = time.perf_counter()
+import app
+app.create_app()
+elapsed = time.perf_counter() - start
+print(json.dumps({{'seconds': elapsed, 'loaded': [m for m in {LAZY_MODULES!r} if m in sys.modules]}}))
+'''
+
+
+def measure():
+    """Import and create the app in a new interpreter. Returns (seconds, eagerly loaded lazy modules)."""
+    result = subprocess.run(
+        [sys.executable, '-c', PROBE], cwd=BACKEND_DIR, capture_output=True, text=True, check=True
+    )
+    # create_app() prints a line too; the measurement is the last one
+    data = json.loads(result.stdout.strip().splitlines()[-1])
+    return data['seconds'], data['loaded']
+
+
+def slowest_imports(count):
+    """Return the count slowest top-level imports of app as (cumulative microseconds, module)."""
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import app; app.create_app()'],
+        cwd=BACKEND_DIR, capture_output=True, text=True, check=True
+    )
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        # A module is listed after its imports, one level less indented
+        if not name.startswith('  '):
+            if name.strip() == 'app':
+                break
+            rows = []  # Imported by the interpreter or -c before app, not by app
+        elif not name.startswith('    '):
+            rows.append((int(cumulative), name.strip()))
+    return sorted(rows, reverse=True)[:count]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--budget-ms', type=float, default=800)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--verbose', action='store_true', help='List the slowest imports')
+    args = parser.parse_args()
+
+    runs = [measure() for _ in range(args.repeat)]
+    best = min(seconds for seconds, _ in runs) * 1000
+    loaded = runs[0][1]
+
+    print(f"import app + create_app(): {best:.0f}ms (best of {args.repeat}), budget {args.budget_ms:.0f}ms")
+    if args.verbose:
+        for cumulative, name in slowest_imports(10):
+            print(f"  {cumulative / 1000:>7.1f}ms  {name}")
+
+    failed = False
+    if loaded:
+        print(f"FAIL: imported at startup instead of on first use: {', '.join(loaded)}")
+        failed = True
+    if best > args.budget_ms:
+        print("FAIL: over budget")
+        failed = True
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+Benchmark time-to-first-token across a long chat, with and without context reuse.
+
+Runs the same conversation twice through generation.stream_reply: once resending
+the full transcript every turn, once continuing from the context Ollama returned
+for the previous turn. With reuse, TTFT should stay flat as the chat grows.
+
+Usage (from backend/, with Ollama running or OLLAMA_HOST pointing elsewhere):
+    python benchmarks/ttft_context_reuse.py --turns 20 --model gemma3:1b
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from generation import stream_reply
+
+
+def run_conversation(model, turns, prompt, reuse_context):
+    """Run `turns` user turns and return the TTFT of each one in seconds."""
+    messages = []
+    context = None
+    ttfts = []
+    for turn in range(turns):
+        messages.append({'role': 'user', 'content': f"{prompt} (turn {turn + 1})"})
+        start = time.perf_counter()
+        first_token_at = None
+        reply = ''
+        final = {}
+        for chunk_type, chunk_data in stream_reply(model, messages, context=context, reuse_context=reuse_context):
+            if chunk_type == 'content':
+                if first_token_at is None:
+                    first_token_at = time.perf_counter()
+                reply += chunk_data
+            else:
+                final = chunk_data
+        ttfts.append((first_token_at or time.perf_counter()) - start)
+        messages.append({'role': 'assistant', 'content': reply})
+        context = final.get('context') if reuse_context else None
+    return ttfts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--model', default='gemma3:1b')
+    parser.add_argument('--turns', type=int, default=10)
+    parser.add_argument('--prompt', default='Write a paragraph about the history of Tilburg.')
+    args = parser.parse_args()
+
+    full = run_conversation(args.model, args.turns, args.prompt, reuse_context=False)
+    reused = run_conversation(args.model, args.turns, args.prompt, reuse_context=True)
+
+    print(f"{'turn':>4}  {'full transcript':>16}  {'context reuse':>14}")
+    for turn, (a, b) in enumerate(zip(full, reused), 1):
+        print(f"{turn:>4}  {a * 1000:>14.1f}ms  {b * 1000:>12.1f}ms")
+    print(f"TTFT growth first->last turn: full {(full[-1] - full[0]) * 1000:+.1f}ms, "
+          f"reuse {(reused[-1] - reused[0]) * 1000:+.1f}ms")
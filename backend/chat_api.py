@@ -0,0 +1,929 @@
+"""
+Chat API blueprint: sending messages and streaming the replies, the chat list and its
+change feed, single chats and their branches, in-flight generations and token usage.
+"""
+import json
+import threading
+import contextvars
+import time
+from datetime import datetime, timedelta
+from flask import Blueprint, current_app, request, jsonify, Response, stream_with_context
+from flask_login import login_required, current_user
+from generation import stream_reply, stream_replies
+from jobs import enqueue
+from limits import limits_notice
+from archive import rehydrate_chat
+from serialization import json_response
+from models import db, Chat
+from database import (
+        create_chat, get_chat, get_all_chats, get_messages_after, get_update_seq,
+        add_message, add_sibling_messages, delete_message,
+        update_message_content, update_messages_content, update_chat_title, delete_chat, find_empty_chat,
+        get_setting, get_message, get_path, set_active_leaf,
+        get_generation_context, save_generation_context,
+        record_message_usage, get_usage,
+        get_chat_version, get_chat_events, get_chat_events_floor, wait_for_chat_events
+    )
+
+bp = Blueprint('chat', __name__)
+
+def chat_etag(chat_obj):
+    """Build an ETag for a chat from its id and updated_at timestamp."""
+    return f"{chat_obj.id}-{chat_obj.updated_at.strftime('%Y%m%d%H%M%S%f')}"
+
+def is_not_modified(etag, last_modified):
+    """Check the request's conditional headers against a chat's ETag and Last-Modified."""
+    # If-None-Match takes precedence over If-Modified-Since (RFC 9110)
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    if request.if_modified_since and last_modified:
+        # HTTP dates have second precision
+        return last_modified.replace(microsecond=0) <= request.if_modified_since.replace(tzinfo=None)
+    return False
+
+def set_cache_validators(response, etag, last_modified):
+    """Attach ETag and Last-Modified headers so clients can revalidate instead of refetching."""
+    # Weak, since the body may be gzipped differently per request
+    response.set_etag(etag, weak=True)
+    response.last_modified = last_modified
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.headers['Access-Control-Expose-Headers'] = 'ETag'
+    return response
+
+def not_modified_response(etag, last_modified):
+    """Return an empty 304 response carrying the chat's validators."""
+    response = set_cache_validators(Response(status=304), etag, last_modified)
+    response.headers.add('Access-Control-Allow-Origin', 'http://localhost:3000')
+    response.headers.add('Access-Control-Allow-Credentials', 'true')
+    return response
+
+def requested_models(data, default_model):
+    """Return the models named by a request's 'models' (or 'model') field. Raises ValueError if invalid."""
+    models = data.get('models') or [data.get('model') or default_model]
+    if not isinstance(models, list) or not all(isinstance(name, str) and name for name in models):
+        raise ValueError('models must be a list of model names')
+    models = list(dict.fromkeys(models))
+    if len(models) > current_app.config['FANOUT_MAX_MODELS']:
+        raise ValueError(f"At most {current_app.config['FANOUT_MAX_MODELS']} models can answer at once")
+    return models
+
+def finish_generation(generation_broker, generation_id, chat_id, cancelled=False):
+    """Publish the final event of a generation and mark it finished."""
+    event = {'done': True, 'chat_id': chat_id}
+    if cancelled:
+        event['cancelled'] = True
+    generation_broker.publish(generation_id, event)
+    generation_broker.finish(generation_id, 'cancelled' if cancelled else 'done')
+
+def stream_generation(generation_broker, generation_id, after=0):
+    """Yield a generation's events after number after as Server-Sent Events, until it ends."""
+    ended = False
+    while True:
+        events, finished = generation_broker.read(generation_id, after, timeout=15)
+        for seq, event in events:
+            yield f"id: {seq}\ndata: {json.dumps(event)}\n\n"
+            after = seq
+            # Per-model events carry 'model'; the last event of a generation doesn't
+            ended = ended or ('model' not in event and ('done' in event or 'error' in event))
+        if finished:
+            break
+        if not events:
+            yield ": keepalive\n\n"
+    if not ended:
+        # The process running it stopped, or it was purged before finishing
+        yield f"data: {json.dumps({'error': 'Generation was interrupted'})}\n\n"
+
+def stream_reply_response(chat_id, user_id, parent_id, models, initial_title=None):
+    """
+    Stream the reply (or, with several models, the sibling replies) to the user message parent_id
+    as Server-Sent Events, saving it to the database in a background thread.
+    With initial_title, the chat's title is rewritten by the model afterwards (see AUTO_TITLES).
+    """
+    # The background threads outlive the request, so they hold on to the app itself
+    app = current_app._get_current_object()
+    generation_broker = app.extensions['generation_broker']
+    load_policy = app.extensions['load_policy']
+    model = models[0]
+    try:
+        # Get conversation history for context: the branch leading up to the user message
+        conversation_history = [
+            {'role': msg.role, 'content': msg.content}
+            for msg in get_path(chat_id, parent_id)
+        ]
+        
+        # Get custom instructions from database (or use empty string if not set)
+        custom_instructions = get_setting(user_id, 'custom_instructions', '')
+        
+        # Build system prompt with custom instructions
+        if custom_instructions:
+            messages_with_system = [
+                {'role': 'system', 'content': custom_instructions}
+            ] + conversation_history
+        else:
+            # No custom instructions, use conversation history only
+            messages_with_system = conversation_history
+        
+        # Saved context is only valid if the user message directly follows the reply it was saved after
+        saved_context = None
+        if app.config['OLLAMA_CONTEXT_REUSE'] and len(models) == 1:
+            saved_context = get_generation_context(chat_id, model, custom_instructions, parent_id)
+        
+        # Under load, replies get a smaller context window and a token limit (see limits.py)
+        level, options = load_policy.limits(models, current_user.tier) if load_policy else ('normal', {})
+        reuse_context = app.config['OLLAMA_CONTEXT_REUSE']
+        if options.get(model, {}).get('num_ctx'):
+            # A saved context may not fit the smaller window, and one started in it would be cut
+            # short; /api/chat truncates the transcript by message instead
+            saved_context = None
+            reuse_context = False
+        
+        # The background thread publishes the SSE events; any process can stream or cancel them
+        generation_id = generation_broker.start(chat_id, user_id, models)
+        notice = limits_notice(level, options)
+        if notice:
+            print(f"Limiting reply for chat {chat_id} ({level}): {options}")
+            generation_broker.publish(generation_id, notice)
+        
+        def generate_in_background():
+            """Background thread function that generates response and saves to DB."""
+            assistant_content = ''
+            last_save_length = 0
+            save_interval = 100  # Save to DB every 100 characters
+            message_id = None  # Track the message ID for updates
+            final_chunk = {}  # Last chunk from Ollama, carries the new context
+            cancelled = False
+            
+            try:
+                stream = stream_reply(
+                    model,
+                    messages_with_system,
+                    context=saved_context,
+                    reuse_context=reuse_context,
+                    options=options.get(model),
+                )
+                
+                for chunk_type, chunk_data in stream:
+                    # Stop early when cancelled (possibly from another process); the partial reply is kept
+                    if generation_broker.is_cancelled(generation_id):
+                        cancelled = True
+                        stream.close()
+                        break
+                    if chunk_type == 'done':
+                        final_chunk = chunk_data
+                    elif chunk_type == 'content':
+                        content = chunk_data
+                        assistant_content += content
+                        
+                        generation_broker.publish(generation_id, {'content': content})
+                        
+                        # Create message in DB on first content
+                        if message_id is None and assistant_content.strip():
+                            with app.app_context():
+                                try:
+                                    message_id = add_message(chat_id, 'assistant', assistant_content, parent_id=parent_id)
+                                    last_save_length = len(assistant_content)
+                                    print(f"Created assistant message {message_id} for chat {chat_id} (initial length: {len(assistant_content)})")
+                                except Exception as db_error:
+                                    import traceback
+                                    print(f"ERROR: Failed to create assistant message for chat {chat_id}: {db_error}")
+                                    print(traceback.format_exc())
+                        
+                        # Periodically update message in DB (every save_interval characters)
+                        elif message_id and len(assistant_content) - last_save_length >= save_interval:
+                            with app.app_context():
+                                try:
+                                    if update_message_content(message_id, assistant_content, final=False):
+                                        print(f"Updated assistant message {message_id} for chat {chat_id} (length: {len(assistant_content)})")
+                                        last_save_length = len(assistant_content)
+                                except Exception as db_error:
+                                    import traceback
+                                    print(f"ERROR: Failed to update assistant message for chat {chat_id}: {db_error}")
+                                    print(traceback.format_exc())
+                
+                # Final save of complete message
+                if assistant_content and assistant_content.strip():
+                    with app.app_context():
+                        try:
+                            if message_id:
+                                # Update existing message with final content
+                                if update_message_content(message_id, assistant_content):
+                                    print(f"Final update: assistant message {message_id} for chat {chat_id} (final length: {len(assistant_content)})")
+                                else:
+                                    # Message was deleted? Create new one
+                                    message_id = add_message(chat_id, 'assistant', assistant_content, parent_id=parent_id)
+                                    print(f"Final save (recreated): assistant message {message_id} for chat {chat_id} (final length: {len(assistant_content)})")
+                            else:
+                                # Create new message if it doesn't exist
+                                message_id = add_message(chat_id, 'assistant', assistant_content, parent_id=parent_id)
+                                print(f"Final save: assistant message {message_id} for chat {chat_id} (final length: {len(assistant_content)})")
+                            
+                            # Remember Ollama's context so the next turn can skip re-evaluating the history
+                            if final_chunk.get('context'):
+                                save_generation_context(chat_id, model, custom_instructions, message_id, final_chunk['context'])
+                            
+                            # Token counts and timings from Ollama's final chunk; the per-user
+                            # rollup runs in the job queue and covers every reply of the next
+                            # USAGE_ROLLUP_DELAY seconds in one go
+                            if final_chunk:
+                                record_message_usage(message_id, model, final_chunk)
+                                enqueue(
+                                    'usage.rollup',
+                                    {'user_id': user_id},
+                                    user_id=user_id,
+                                    priority=-1,
+                                    dedupe_key=f'usage:{user_id}',
+                                    delay_seconds=app.config['USAGE_ROLLUP_DELAY']
+                                )
+                            
+                            # Anything else happens off the streaming path, in the job queue
+                            if initial_title and app.config['AUTO_TITLES']:
+                                enqueue(
+                                    'chat.generate_title',
+                                    {'chat_id': chat_id, 'model': model, 'initial_title': initial_title},
+                                    user_id=user_id,
+                                    dedupe_key=f'title:{chat_id}'
+                                )
+                        except Exception as db_error:
+                            import traceback
+                            print(f"ERROR: Failed to final save assistant message for chat {chat_id}: {db_error}")
+                            print(traceback.format_exc())
+                else:
+                    print(f"WARNING: No assistant content to save for chat {chat_id}")
+                
+                # Signal completion
+                finish_generation(generation_broker, generation_id, chat_id, cancelled)
+                
+            except Exception as e:
+                generation_broker.publish(generation_id, {'error': str(e)})
+                generation_broker.finish(generation_id, 'error')
+        
+        def fan_out_in_background():
+            """Background thread function that streams every model's reply and saves them as sibling messages."""
+            replies = {name: '' for name in models}
+            saved_lengths = {name: 0 for name in models}
+            final_chunks = {}
+            save_interval = 100  # Save to DB once any reply has grown by 100 characters
+            cancelled = False
+            
+            try:
+                # Reserve the sibling messages up front, in the order the models were requested
+                with app.app_context():
+                    message_ids = dict(zip(models, add_sibling_messages(chat_id, 'assistant', models, parent_id)))
+                
+                stream = stream_replies(
+                    {name: messages_with_system for name in models},
+                    app.config['FANOUT_CONCURRENCY'],
+                    options
+                )
+                for reply_model, chunk_type, chunk_data in stream:
+                    if generation_broker.is_cancelled(generation_id):
+                        # Closing the merged stream stops every model still generating
+                        cancelled = True
+                        stream.close()
+                        break
+                    if chunk_type == 'content':
+                        replies[reply_model] += chunk_data
+                        generation_broker.publish(generation_id, {'model': reply_model, 'content': chunk_data})
+                        
+                        # Save every reply that changed in one transaction rather than one per model
+                        if len(replies[reply_model]) - saved_lengths[reply_model] >= save_interval:
+                            changed = {
+                                message_ids[name]: replies[name]
+                                for name in models if len(replies[name]) != saved_lengths[name]
+                            }
+                            with app.app_context():
+                                try:
+                                    update_messages_content(changed, final=False)
+                                    saved_lengths = {name: len(replies[name]) for name in models}
+                                except Exception as db_error:
+                                    import traceback
+                                    print(f"ERROR: Failed to update assistant messages for chat {chat_id}: {db_error}")
+                                    print(traceback.format_exc())
+                    elif chunk_type == 'done':
+                        final_chunks[reply_model] = chunk_data
+                        generation_broker.publish(generation_id, {
+                            'model': reply_model,
+                            'done': True,
+                            'message_id': message_ids[reply_model] if replies[reply_model].strip() else None
+                        })
+                    elif chunk_type == 'error':
+                        print(f"ERROR: Model {reply_model} failed for chat {chat_id}: {chunk_data}")
+                        generation_broker.publish(generation_id, {'model': reply_model, 'error': chunk_data})
+                
+                # Final save of all replies; siblings that got no content are removed again
+                with app.app_context():
+                    try:
+                        answered = [name for name in models if replies[name].strip()]
+                        update_messages_content({message_ids[name]: replies[name] for name in answered})
+                        for name in models:
+                            if name not in answered:
+                                delete_message(message_ids[name])
+                            elif final_chunks.get(name):
+                                record_message_usage(message_ids[name], name, final_chunks[name])
+                        print(f"Final save: {len(answered)} of {len(models)} replies for chat {chat_id}")
+                        # The first model that answered continues the chat; the others are alternative branches
+                        if answered:
+                            set_active_leaf(chat_id, message_ids[answered[0]])
+                        
+                        if any(final_chunks.get(name) for name in answered):
+                            enqueue(
+                                'usage.rollup',
+                                {'user_id': user_id},
+                                user_id=user_id,
+                                priority=-1,
+                                dedupe_key=f'usage:{user_id}',
+                                delay_seconds=app.config['USAGE_ROLLUP_DELAY']
+                            )
+                        if answered and initial_title and app.config['AUTO_TITLES']:
+                            enqueue(
+                                'chat.generate_title',
+                                {'chat_id': chat_id, 'model': answered[0], 'initial_title': initial_title},
+                                user_id=user_id,
+                                dedupe_key=f'title:{chat_id}'
+                            )
+                    except Exception as db_error:
+                        import traceback
+                        print(f"ERROR: Failed to final save assistant messages for chat {chat_id}: {db_error}")
+                        print(traceback.format_exc())
+                
+                # Signal completion
+                finish_generation(generation_broker, generation_id, chat_id, cancelled)
+                
+            except Exception as e:
+                generation_broker.publish(generation_id, {'error': str(e)})
+                generation_broker.finish(generation_id, 'error')
+        
+        # Start background generation thread
+        # Run in a copy of the request's context so the thread stays on the user's shard
+        target = fan_out_in_background if len(models) > 1 else generate_in_background
+        bg_thread = threading.Thread(target=contextvars.copy_context().run, args=(target,), daemon=True)
+        bg_thread.start()
+        
+        # Return the streaming response
+        return Response(
+            stream_generation(generation_broker, generation_id),
+            mimetype='text/event-stream',
+            headers={
+                'Cache-Control': 'no-cache',
+                'X-Accel-Buffering': 'no',
+                'X-Generation-Id': generation_id,
+                'Access-Control-Expose-Headers': 'X-Generation-Id',
+                'Access-Control-Allow-Origin': 'http://localhost:3000',
+                'Access-Control-Allow-Methods': 'POST, OPTIONS',
+                'Access-Control-Allow-Headers': 'Content-Type',
+                'Access-Control-Allow-Credentials': 'true'
+            }
+        )
+    except Exception as e:
+        response = jsonify({'error': str(e)})
+        response.headers.add('Access-Control-Allow-Origin', 'http://localhost:3000')
+        response.headers.add('Access-Control-Allow-Credentials', 'true')
+        return response, 500
+
+@bp.route('/api/chat', methods=['POST', 'OPTIONS'])
+@login_required
+def chat():
+    """
+    Stream chat responses from Ollama and save to database.
+    Expects JSON: {'message': 'user message', 'model': 'gemma3:1b', 'chat_id': <id>}
+    If chat_id is not provided, creates a new chat.
+    With 'models': [...] instead of 'model', every model answers concurrently; their tokens
+    are streamed tagged with the model name and each reply is saved as a sibling message.
+    """
+    # Handle preflight OPTIONS request
+    if request.method == 'OPTIONS':
+        response = jsonify({})
+        response.headers.add('Access-Control-Allow-Origin', 'http://localhost:3000')
+        response.headers.add('Access-Control-Allow-Methods', 'POST, OPTIONS')
+        response.headers.add('Access-Control-Allow-Headers', 'Content-Type')
+        response.headers.add('Access-Control-Allow-Credentials', 'true')
+        return response
+    try:
+        data = request.json
+        user_message = data.get('message', '')
+        chat_id = data.get('chat_id')
+        
+        if not user_message:
+            response = jsonify({'error': 'Message is required'})
+            response.headers.add('Access-Control-Allow-Origin', 'http://localhost:3000')
+            response.headers.add('Access-Control-Allow-Credentials', 'true')
+            return response, 400
+        
+        try:
+            models = requested_models(data, 'gemma3:1b')
+        except ValueError as e:
+            response = jsonify({'error': str(e)})
+            response.headers.add('Access-Control-Allow-Origin', 'http://localhost:3000')
+            response.headers.add('Access-Control-Allow-Credentials', 'true')
+            return response, 400
+        model = models[0]
+        
+        # Check authentication
+        if not current_user.is_authenticated:
+            response = jsonify({'error': 'Authentication required'})
+            response.headers.add('Access-Control-Allow-Origin', 'http://localhost:3000')
+            response.headers.add('Access-Control-Allow-Credentials', 'true')
+            return response, 401
+        
+        user_id = current_user.get_id()
+        
+        # Use existing empty chat or create new chat if chat_id not provided
+        if not chat_id:
+            # Check if there's an existing empty chat
+            empty_chat_id = find_empty_chat(user_id)
+            if empty_chat_id:
+                chat_id = empty_chat_id
+            else:
+                # Generate title from first 50 chars of message
+                title = user_message[:50] + ('...' if len(user_message) > 50 else '')
+                chat_id = create_chat(user_id, title, model)
+        
+        # Check if this is the first message in the chat and update title
+        chat_obj = Chat.query.get(chat_id)
+        is_first_turn = bool(chat_obj and chat_obj.message_count == 0)
+        if is_first_turn:
+            # This is the first message, update the title
+            title = user_message[:50] + ('...' if len(user_message) > 50 else '')
+            update_chat_title(chat_id, title)
+        
+        # Save user message to database
+        user_message_id = add_message(chat_id, 'user', user_message)
+        
+        return stream_reply_response(chat_id, user_id, user_message_id, models, title if is_first_turn else None)
+    
+    except Exception as e:
+        response = jsonify({'error': str(e)})
+        response.headers.add('Access-Control-Allow-Origin', 'http://localhost:3000')
+        response.headers.add('Access-Control-Allow-Credentials', 'true')
+        return response, 500
+
+@bp.route('/api/chats', methods=['GET', 'OPTIONS'])
+@login_required
+def get_chats():
+    """Get all chats for the current user."""
+    if request.method == 'OPTIONS':
+        response = jsonify({})
+        response.headers.add('Access-Control-Allow-Origin', 'http://localhost:3000')
+        response.headers.add('Access-Control-Allow-Methods', 'GET, OPTIONS')
+        response.headers.add('Access-Control-Allow-Headers', 'Content-Type')
+        response.headers.add('Access-Control-Allow-Credentials', 'true')
+        return response
+    
+    try:
+        user_id = current_user.get_id()
+        # Read the version first: a change committed in between is sent again by the feed, not lost
+        version = get_chat_version(user_id)
+        chats = get_all_chats(user_id)
+        response = json_response(chats)
+        # Where to start /api/chats/events from
+        response.headers['X-Chat-Version'] = str(version)
+        response.headers.add('Access-Control-Expose-Headers', 'X-Chat-Version')
+        return response
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@bp.route('/api/chats/events', methods=['GET', 'OPTIONS'])
+@login_required
+def chat_events():
+    """
+    Stream changes to the current user's chat list as Server-Sent Events.
+    Starts after the Last-Event-ID that EventSource sends when it reconnects, or else after
+    version ?since=N; without either, only changes from now on are sent. The version to start
+    from after loading the list is in GET /api/chats's X-Chat-Version header.
+    """
+    if request.method == 'OPTIONS':
+        response = jsonify({})
+        response.headers.add('Access-Control-Allow-Origin', 'http://localhost:3000')
+        response.headers.add('Access-Control-Allow-Methods', 'GET, OPTIONS')
+        response.headers.add('Access-Control-Allow-Headers', 'Content-Type')
+        response.headers.add('Access-Control-Allow-Credentials', 'true')
+        return response
+    
+    user_id = current_user.get_id()
+    since = request.headers.get('Last-Event-ID') or request.args.get('since')
+    try:
+        since = int(since) if since else None
+    except ValueError:
+        response = jsonify({'error': 'since must be an integer'})
+        response.headers.add('Access-Control-Allow-Origin', 'http://localhost:3000')
+        response.headers.add('Access-Control-Allow-Credentials', 'true')
+        return response, 400
+    
+    poll_seconds = current_app.config['CHAT_EVENTS_POLL_SECONDS']
+    heartbeat_seconds = current_app.config['CHAT_EVENTS_HEARTBEAT_SECONDS']
+    deadline = time.monotonic() + current_app.config['CHAT_EVENTS_MAX_SECONDS']
+    
+    def generate():
+        seen = wait_for_chat_events(None, 0)
+        version = get_chat_version(user_id)
+        cursor = version if since is None else since
+        if cursor > version or cursor < get_chat_events_floor(user_id):
+            # A version this database never handed out, or one from before `flask shards import`
+            yield f"id: {version}\ndata: {json.dumps({'type': 'reset', 'version': version})}\n\n"
+            cursor = version
+        last_sent = time.monotonic()
+        while True:
+            events = get_chat_events(user_id, cursor, limit=100)
+            # End the read transaction, or SQLite keeps showing this snapshot to the next poll
+            db.session.commit()
+            for item in events:
+                yield f"id: {item['version']}\ndata: {json.dumps(item)}\n\n"
+                cursor = item['version']
+                last_sent = time.monotonic()
+            if len(events) == 100:
+                continue  # More are waiting
+            now = time.monotonic()
+            if now >= deadline:
+                break
+            if now - last_sent >= heartbeat_seconds:
+                yield ": keepalive\n\n"
+                last_sent = now
+            # Woken right away by commits in this process; others are seen at the next poll
+            seen = wait_for_chat_events(seen, min(poll_seconds, heartbeat_seconds, deadline - now))
+    
+    # stream_with_context keeps the app context and the user's shard for the whole stream
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no',
+            'Access-Control-Allow-Origin': 'http://localhost:3000',
+            'Access-Control-Allow-Methods': 'GET, OPTIONS',
+            'Access-Control-Allow-Headers': 'Content-Type',
+            'Access-Control-Allow-Credentials': 'true'
+        }
+    )
+
+@bp.route('/api/chats', methods=['POST', 'OPTIONS'])
+@login_required
+def create_new_chat():
+    """Create a new chat or return existing empty chat."""
+    if request.method == 'OPTIONS':
+        response = jsonify({})
+        response.headers.add('Access-Control-Allow-Origin', 'http://localhost:3000')
+        response.headers.add('Access-Control-Allow-Methods', 'POST, OPTIONS')
+        response.headers.add('Access-Control-Allow-Headers', 'Content-Type')
+        response.headers.add('Access-Control-Allow-Credentials', 'true')
+        return response
+    
+    try:
+        user_id = current_user.get_id()
+        data = request.json or {}
+        title = data.get('title', 'New Chat')
+        model = data.get('model', 'gemma3:1b')
+        
+        # Check if there's an existing empty chat
+        empty_chat_id = find_empty_chat(user_id)
+        if empty_chat_id:
+            chat = get_chat(empty_chat_id)
+            return jsonify(chat), 200
+        
+        # Create new chat if no empty chat exists
+        chat_id = create_chat(user_id, title, model)
+        chat = get_chat(chat_id)
+        return jsonify(chat), 201
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@bp.route('/api/chats/<chat_id>', methods=['GET', 'PUT', 'DELETE', 'OPTIONS'])
+@login_required
+def handle_chat_by_id(chat_id):
+    """Handle GET, PUT, and DELETE operations for a specific chat."""
+    # Handle preflight OPTIONS request
+    if request.method == 'OPTIONS':
+        response = jsonify({})
+        response.headers.add('Access-Control-Allow-Origin', 'http://localhost:3000')
+        response.headers.add('Access-Control-Allow-Methods', 'GET, PUT, DELETE, OPTIONS')
+        response.headers.add('Access-Control-Allow-Headers', 'Content-Type, If-None-Match')
+        response.headers.add('Access-Control-Allow-Credentials', 'true')
+        response.headers.add('Access-Control-Max-Age', '3600')
+        return response
+    
+    try:
+        user_id = current_user.get_id()
+        
+        if request.method == 'GET':
+            # Get a specific chat with its messages
+            chat_obj = Chat.query.get(chat_id)
+            if not chat_obj:
+                response = jsonify({'error': 'Chat not found'})
+                response.headers.add('Access-Control-Allow-Origin', 'http://localhost:3000')
+                response.headers.add('Access-Control-Allow-Credentials', 'true')
+                return response, 404
+            # Verify chat belongs to user
+            if chat_obj.user_id != user_id:
+                response = jsonify({'error': 'Unauthorized'})
+                response.headers.add('Access-Control-Allow-Origin', 'http://localhost:3000')
+                response.headers.add('Access-Control-Allow-Credentials', 'true')
+                return response, 403
+            # Restore an archived chat before comparing ETags: if its message ids change, so does the ETag
+            if chat_obj.archived_at is not None and rehydrate_chat(chat_id):
+                db.session.refresh(chat_obj)
+            # Skip serializing the messages when the client's copy is current
+            etag = chat_etag(chat_obj)
+            if is_not_modified(etag, chat_obj.updated_at):
+                return not_modified_response(etag, chat_obj.updated_at)
+            response = set_cache_validators(json_response(get_chat(chat_id)), etag, chat_obj.updated_at)
+            response.headers.add('Access-Control-Allow-Origin', 'http://localhost:3000')
+            response.headers.add('Access-Control-Allow-Credentials', 'true')
+            return response
+        
+        elif request.method == 'PUT':
+            # Update a chat (e.g., title or active branch)
+            chat_obj = Chat.query.get(chat_id)
+            if not chat_obj:
+                response = jsonify({'error': 'Chat not found'})
+                response.headers.add('Access-Control-Allow-Origin', 'http://localhost:3000')
+                response.headers.add('Access-Control-Allow-Credentials', 'true')
+                return response, 404
+            if chat_obj.user_id != user_id:
+                response = jsonify({'error': 'Unauthorized'})
+                response.headers.add('Access-Control-Allow-Origin', 'http://localhost:3000')
+                response.headers.add('Access-Control-Allow-Credentials', 'true')
+                return response, 403
+            data = request.json or {}
+            if 'title' in data:
+                update_chat_title(chat_id, data['title'])
+            # Switch to another branch, continuing down to its newest message
+            if 'active_message_id' in data and not set_active_leaf(chat_id, data['active_message_id']):
+                response = jsonify({'error': 'Message not found'})
+                response.headers.add('Access-Control-Allow-Origin', 'http://localhost:3000')
+                response.headers.add('Access-Control-Allow-Credentials', 'true')
+                return response, 404
+            chat = get_chat(chat_id)
+            response = jsonify(chat)
+            response.headers.add('Access-Control-Allow-Origin', 'http://localhost:3000')
+            response.headers.add('Access-Control-Allow-Credentials', 'true')
+            return response
+        
+        elif request.method == 'DELETE':
+            # Delete a chat
+            chat_obj = Chat.query.get(chat_id)
+            if not chat_obj:
+                response = jsonify({'error': 'Chat not found'})
+                response.headers.add('Access-Control-Allow-Origin', 'http://localhost:3000')
+                response.headers.add('Access-Control-Allow-Credentials', 'true')
+                return response, 404
+            if chat_obj.user_id != user_id:
+                response = jsonify({'error': 'Unauthorized'})
+                response.headers.add('Access-Control-Allow-Origin', 'http://localhost:3000')
+                response.headers.add('Access-Control-Allow-Credentials', 'true')
+                return response, 403
+            delete_chat(chat_id)
+            response = jsonify({'success': True})
+            response.headers.add('Access-Control-Allow-Origin', 'http://localhost:3000')
+            response.headers.add('Access-Control-Allow-Credentials', 'true')
+            return response, 200
+            
+    except Exception as e:
+        response = jsonify({'error': str(e)})
+        response.headers.add('Access-Control-Allow-Origin', 'http://localhost:3000')
+        response.headers.add('Access-Control-Allow-Credentials', 'true')
+        return response, 500
+
+@bp.route('/api/chats/<chat_id>/messages', methods=['GET', 'OPTIONS'])
+@login_required
+def get_chat_messages(chat_id):
+    """
+    Get the messages of a chat after a given sequence number.
+    Query param after_seq (default -1) returns only messages with a greater sequence_order;
+    updated_after also returns those changed since that update_seq.
+    """
+    if request.method == 'OPTIONS':
+        response = jsonify({})
+        response.headers.add('Access-Control-Allow-Origin', 'http://localhost:3000')
+        response.headers.add('Access-Control-Allow-Methods', 'GET, OPTIONS')
+        response.headers.add('Access-Control-Allow-Headers', 'Content-Type, If-None-Match')
+        response.headers.add('Access-Control-Allow-Credentials', 'true')
+        return response
+    
+    try:
+        user_id = current_user.get_id()
+        after_seq = request.args.get('after_seq', -1, type=int)
+        updated_after = request.args.get('updated_after', None, type=int)
+        
+        chat_obj = Chat.query.get(chat_id)
+        if not chat_obj:
+            response = jsonify({'error': 'Chat not found'})
+            response.headers.add('Access-Control-Allow-Origin', 'http://localhost:3000')
+            response.headers.add('Access-Control-Allow-Credentials', 'true')
+            return response, 404
+        if chat_obj.user_id != user_id:
+            response = jsonify({'error': 'Unauthorized'})
+            response.headers.add('Access-Control-Allow-Origin', 'http://localhost:3000')
+            response.headers.add('Access-Control-Allow-Credentials', 'true')
+            return response, 403
+        
+        if chat_obj.archived_at is not None and rehydrate_chat(chat_id):
+            db.session.refresh(chat_obj)
+        etag = chat_etag(chat_obj)
+        if is_not_modified(etag, chat_obj.updated_at):
+            return not_modified_response(etag, chat_obj.updated_at)
+        
+        # Read before the messages, so a change made in between is returned again next time, not skipped
+        update_seq = get_update_seq(chat_id)
+        messages = get_messages_after(chat_id, after_seq, updated_after)
+        response = json_response({
+            'chat_id': chat_id,
+            'updated_at': chat_obj.updated_at.isoformat(),
+            # Lets clients notice the active branch changed and refetch from the start
+            'active_leaf_id': chat_obj.active_leaf_id,
+            # Send back as updated_after to also get messages changed in place since this response
+            'update_seq': update_seq,
+            'messages': messages
+        })
+        response = set_cache_validators(response, etag, chat_obj.updated_at)
+        response.headers.add('Access-Control-Allow-Origin', 'http://localhost:3000')
+        response.headers.add('Access-Control-Allow-Credentials', 'true')
+        return response
+    except Exception as e:
+        response = jsonify({'error': str(e)})
+        response.headers.add('Access-Control-Allow-Origin', 'http://localhost:3000')
+        response.headers.add('Access-Control-Allow-Credentials', 'true')
+        return response, 500
+
+@bp.route('/api/chats/<chat_id>/messages/<int:message_id>/<any(regenerate, edit):action>', methods=['POST', 'OPTIONS'])
+@login_required
+def branch_message(chat_id, message_id, action):
+    """
+    Branch off an existing message, keeping the original branch.
+    regenerate: stream a new reply to a user message, or a new sibling of an assistant message.
+        Optional JSON: {'model': ...} or {'models': [...]}; defaults to the replaced reply's model.
+    edit: add a sibling with new content. Expects JSON: {'content': '...'}. For a user
+        message the reply is streamed as with regenerate; an assistant message is returned as JSON.
+    """
+    if request.method == 'OPTIONS':
+        response = jsonify({})
+        response.headers.add('Access-Control-Allow-Origin', 'http://localhost:3000')
+        response.headers.add('Access-Control-Allow-Methods', 'POST, OPTIONS')
+        response.headers.add('Access-Control-Allow-Headers', 'Content-Type')
+        response.headers.add('Access-Control-Allow-Credentials', 'true')
+        return response
+    
+    try:
+        user_id = current_user.get_id()
+        data = request.get_json(silent=True) or {}
+        
+        chat_obj = Chat.query.get(chat_id)
+        if not chat_obj:
+            response = jsonify({'error': 'Chat not found'})
+            response.headers.add('Access-Control-Allow-Origin', 'http://localhost:3000')
+            response.headers.add('Access-Control-Allow-Credentials', 'true')
+            return response, 404
+        # Check ownership before touching the messages: get_message restores archived chats
+        if chat_obj.user_id != user_id:
+            response = jsonify({'error': 'Unauthorized'})
+            response.headers.add('Access-Control-Allow-Origin', 'http://localhost:3000')
+            response.headers.add('Access-Control-Allow-Credentials', 'true')
+            return response, 403
+        message = get_message(chat_id, message_id)
+        if not message:
+            response = jsonify({'error': 'Message not found'})
+            response.headers.add('Access-Control-Allow-Origin', 'http://localhost:3000')
+            response.headers.add('Access-Control-Allow-Credentials', 'true')
+            return response, 404
+
+        content = data.get('content', '')
+        if action == 'edit' and not content:
+            response = jsonify({'error': 'Content is required'})
+            response.headers.add('Access-Control-Allow-Origin', 'http://localhost:3000')
+            response.headers.add('Access-Control-Allow-Credentials', 'true')
+            return response, 400
+        if action == 'regenerate' and message['role'] == 'assistant' and message['parent_id'] is None:
+            response = jsonify({'error': 'Message has no user message to reply to'})
+            response.headers.add('Access-Control-Allow-Origin', 'http://localhost:3000')
+            response.headers.add('Access-Control-Allow-Credentials', 'true')
+            return response, 400
+        try:
+            models = requested_models(data, message['model'] or chat_obj.model)
+        except ValueError as e:
+            response = jsonify({'error': str(e)})
+            response.headers.add('Access-Control-Allow-Origin', 'http://localhost:3000')
+            response.headers.add('Access-Control-Allow-Credentials', 'true')
+            return response, 400
+        
+        # Only the new messages are stored; the branches share everything before them
+        if action == 'edit':
+            new_id = add_message(chat_id, message['role'], content, parent_id=message['parent_id'])
+            if message['role'] == 'assistant':
+                response = jsonify(get_message(chat_id, new_id))
+                response.headers.add('Access-Control-Allow-Origin', 'http://localhost:3000')
+                response.headers.add('Access-Control-Allow-Credentials', 'true')
+                return response, 201
+            return stream_reply_response(chat_id, user_id, new_id, models)
+        
+        user_message_id = message['id'] if message['role'] == 'user' else message['parent_id']
+        return stream_reply_response(chat_id, user_id, user_message_id, models)
+    except Exception as e:
+        response = jsonify({'error': str(e)})
+        response.headers.add('Access-Control-Allow-Origin', 'http://localhost:3000')
+        response.headers.add('Access-Control-Allow-Credentials', 'true')
+        return response, 500
+
+@bp.route('/api/chats/<chat_id>/generation', methods=['GET', 'DELETE', 'OPTIONS'])
+@login_required
+def chat_generation(chat_id):
+    """
+    Follow or stop the chat's latest generation, from whichever backend process receives the request.
+    GET streams its events as Server-Sent Events, after event ?after=N (or Last-Event-ID), e.g. to
+        pick a reply back up after a reload. Finished generations are replayed for a while.
+    DELETE cancels it; what was generated so far is kept.
+    """
+    if request.method == 'OPTIONS':
+        response = jsonify({})
+        response.headers.add('Access-Control-Allow-Origin', 'http://localhost:3000')
+        response.headers.add('Access-Control-Allow-Methods', 'GET, DELETE, OPTIONS')
+        response.headers.add('Access-Control-Allow-Headers', 'Content-Type')
+        response.headers.add('Access-Control-Allow-Credentials', 'true')
+        return response
+    
+    generation_broker = current_app.extensions['generation_broker']
+    try:
+        generation = generation_broker.latest_for_chat(chat_id)
+        if not generation or generation['user_id'] != current_user.get_id():
+            response = jsonify({'error': 'No generation for this chat'})
+            response.headers.add('Access-Control-Allow-Origin', 'http://localhost:3000')
+            response.headers.add('Access-Control-Allow-Credentials', 'true')
+            return response, 404
+        
+        if request.method == 'DELETE':
+            if not generation_broker.cancel(generation['id']):
+                response = jsonify({'error': 'Generation is not running'})
+                response.headers.add('Access-Control-Allow-Origin', 'http://localhost:3000')
+                response.headers.add('Access-Control-Allow-Credentials', 'true')
+                return response, 409
+            response = jsonify({'success': True, 'generation_id': generation['id']})
+            response.headers.add('Access-Control-Allow-Origin', 'http://localhost:3000')
+            response.headers.add('Access-Control-Allow-Credentials', 'true')
+            return response
+        
+        try:
+            after = int(request.headers.get('Last-Event-ID') or request.args.get('after', 0))
+        except ValueError:
+            response = jsonify({'error': 'after must be an integer'})
+            response.headers.add('Access-Control-Allow-Origin', 'http://localhost:3000')
+            response.headers.add('Access-Control-Allow-Credentials', 'true')
+            return response, 400
+        return Response(
+            stream_generation(generation_broker, generation['id'], after),
+            mimetype='text/event-stream',
+            headers={
+                'Cache-Control': 'no-cache',
+                'X-Accel-Buffering': 'no',
+                'X-Generation-Id': generation['id'],
+                'Access-Control-Expose-Headers': 'X-Generation-Id',
+                'Access-Control-Allow-Origin': 'http://localhost:3000',
+                'Access-Control-Allow-Methods': 'GET, DELETE, OPTIONS',
+                'Access-Control-Allow-Headers': 'Content-Type',
+                'Access-Control-Allow-Credentials': 'true'
+            }
+        )
+    except Exception as e:
+        response = jsonify({'error': str(e)})
+        response.headers.add('Access-Control-Allow-Origin', 'http://localhost:3000')
+        response.headers.add('Access-Control-Allow-Credentials', 'true')
+        return response, 500
+
+@bp.route('/api/usage', methods=['GET', 'OPTIONS'])
+@login_required
+def usage():
+    """
+    Get the current user's token usage in time buckets.
+    Query params: bucket (hour, day, month; default day), group_by (model, chat),
+    since and until (ISO dates; default the last 30 days).
+    """
+    if request.method == 'OPTIONS':
+        response = jsonify({})
+        response.headers.add('Access-Control-Allow-Origin', 'http://localhost:3000')
+        response.headers.add('Access-Control-Allow-Methods', 'GET, OPTIONS')
+        response.headers.add('Access-Control-Allow-Headers', 'Content-Type')
+        response.headers.add('Access-Control-Allow-Credentials', 'true')
+        return response
+    
+    bucket = request.args.get('bucket', 'day')
+    group_by = request.args.get('group_by') or None
+    if bucket not in ('hour', 'day', 'month') or group_by not in (None, 'model', 'chat'):
+        response = jsonify({'error': 'bucket must be hour, day or month; group_by must be model or chat'})
+        response.headers.add('Access-Control-Allow-Origin', 'http://localhost:3000')
+        response.headers.add('Access-Control-Allow-Credentials', 'true')
+        return response, 400
+    try:
+        since = datetime.fromisoformat(request.args['since']) if request.args.get('since') else datetime.utcnow() - timedelta(days=30)
+        until = datetime.fromisoformat(request.args['until']) if request.args.get('until') else None
+    except ValueError as e:
+        response = jsonify({'error': f'Invalid date: {str(e)}'})
+        response.headers.add('Access-Control-Allow-Origin', 'http://localhost:3000')
+        response.headers.add('Access-Control-Allow-Credentials', 'true')
+        return response, 400
+    
+    try:
+        response = jsonify(get_usage(current_user.get_id(), bucket, group_by, since, until))
+        response.headers.add('Access-Control-Allow-Origin', 'http://localhost:3000')
+        response.headers.add('Access-Control-Allow-Credentials', 'true')
+        return response
+    except Exception as e:
+        response = jsonify({'error': str(e)})
+        response.headers.add('Access-Control-Allow-Origin', 'http://localhost:3000')
+        response.headers.add('Access-Control-Allow-Credentials', 'true')
+        return response, 500
@@ -0,0 +1,101 @@
+"""
+Flask CLI commands: archiving, job workers, shards and users.
+Registered on the app by create_app (see app.py).
+"""
+import threading
+import click
+from flask import current_app
+from flask.cli import AppGroup, with_appcontext
+from jobs import JobWorkerPool
+from models import db, User
+from archive import archive_inactive_chats, get_archive_stats, incremental_vacuum, enable_incremental_vacuum
+from database import each_shard, import_into_shards
+
+@click.group(cls=AppGroup)
+def archive():
+    """Manage compressed cold storage of inactive chats."""
+
+@archive.command('run')
+@click.option('--max-age-days', type=int, default=None, help='Archive chats inactive for longer than this.')
+@click.option('--limit', type=int, default=None, help='Archive at most this many chats.')
+def archive_run(max_age_days, limit):
+    """Archive inactive chats once and vacuum the freed pages."""
+    if max_age_days is None:
+        max_age_days = current_app.config['ARCHIVE_MAX_AGE_DAYS']
+    for shard in each_shard():
+        label = f" in shard {shard}" if shard is not None else ""
+        archived = archive_inactive_chats(max_age_days, limit=limit)
+        click.echo(f"Archived {archived} chats inactive for more than {max_age_days} days{label}")
+        reclaimed = incremental_vacuum(current_app.config['ARCHIVE_VACUUM_PAGES'])
+        if reclaimed is None:
+            click.echo(f"Incremental vacuum is not enabled{label}; run 'flask archive enable-vacuum' to reclaim space")
+        else:
+            click.echo(f"Vacuum reclaimed {reclaimed} bytes{label}")
+
+@archive.command('stats')
+def archive_stats():
+    """Show how much space the archive saves."""
+    for shard in each_shard():
+        if shard is not None:
+            click.echo(f"[shard {shard}]")
+        for key, value in get_archive_stats().items():
+            click.echo(f"{key}: {value}")
+
+@archive.command('enable-vacuum')
+def archive_enable_vacuum():
+    """Switch the database to incremental auto-vacuum (runs a full VACUUM once)."""
+    for shard in each_shard():
+        enable_incremental_vacuum()
+    click.echo("auto_vacuum set to INCREMENTAL")
+
+@click.command('worker')
+@with_appcontext
+@click.option('--size', type=int, default=None, help='Number of worker threads (default: JOB_WORKERS).')
+def worker(size):
+    """Run background job workers in the foreground."""
+    pool = JobWorkerPool(current_app._get_current_object(), size=size or current_app.config['JOB_WORKERS'] or 1)
+    pool.start()
+    click.echo(f"Running {pool.size} job workers, press Ctrl+C to stop")
+    try:
+        while True:
+            threading.Event().wait(3600)
+    except KeyboardInterrupt:
+        click.echo("Stopping workers after their current jobs...")
+        pool.stop(timeout=30)
+
+@click.group(cls=AppGroup)
+def shards():
+    """Manage per-user shard databases (SHARD_COUNT > 0)."""
+
+@shards.command('import')
+def shards_import():
+    """Move existing chats, messages, settings and usage from chats.db into the shard databases."""
+    if not current_app.config['SHARD_COUNT']:
+        raise click.ClickException('Sharding is disabled; set SHARD_COUNT first')
+    moved = import_into_shards()
+    click.echo(f"Moved data of {moved} users into {current_app.config['SHARD_COUNT']} shards")
+
+@click.group(cls=AppGroup)
+def users():
+    """Manage users."""
+
+@users.command('set-tier')
+@click.argument('email')
+@click.argument('tier')
+def users_set_tier(email, tier):
+    """Set a user's tier (e.g. 'priority'), which decides how soon their replies are limited under load."""
+    user = User.query.filter_by(email=email).first()
+    if user is None:
+        raise click.ClickException(f'No user with email {email}')
+    load_policy = current_app.extensions['load_policy']
+    if load_policy and tier not in load_policy.tiers:
+        raise click.ClickException(f"Unknown tier '{tier}'; add it to {current_app.config['GENERATION_LIMITS_FILE']} first")
+    user.tier = tier
+    db.session.commit()
+    click.echo(f"{email} is now on the {tier} tier")
+
+
+def register_commands(app):
+    """Add the commands to app.cli."""
+    for command in (archive, worker, shards, users):
+        app.cli.add_command(command)
@@ -0,0 +1,396 @@
+"""
+Generation state shared between backend processes.
+A generation is one streamed reply (or multi-model fan-out) to a user message. The
+process running it publishes its Server-Sent Events to a broker; any process can then
+stream them to a client (e.g. after a reload or a dropped connection) or cancel the
+generation. MemoryBroker keeps everything inside one process. SQLiteBroker shares it
+through the global database, so the backend can run as several processes.
+"""
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+from models import db, Generation, GenerationEvent
+
+_generations = Generation.__table__
+_events = GenerationEvent.__table__
+
+
+class GenerationBroker:
+    """
+    Interface of a generation broker. Events are numbered from 1 in the order they are
+    published, and readers pass the last number they have seen to continue after it.
+    A Redis backend would keep each registry entry in a hash, publish and read events
+    with XADD / XREAD BLOCK on a stream per generation, and cancel by setting a field
+    that the generating process checks.
+    """
+
+    def start(self, chat_id: str, user_id: str, models: List[str]) -> str:
+        """Register a new running generation and return its ID."""
+        raise NotImplementedError
+
+    def publish(self, generation_id: str, event: Dict) -> int:
+        """Append an event (a JSON-serializable dict) to a generation and return its number."""
+        raise NotImplementedError
+
+    def finish(self, generation_id: str, status: str = 'done'):
+        """Mark a generation as finished ('done', 'error' or 'cancelled'). No events may follow."""
+        raise NotImplementedError
+
+    def read(self, generation_id: str, after: int, timeout: float) -> Tuple[List[Tuple[int, Dict]], bool]:
+        """
+        Return ([(number, event), ...] after number after, finished), waiting up to timeout
+        seconds while there are none. finished is True once the events returned end the
+        generation, or when the generation is unknown.
+        """
+        raise NotImplementedError
+
+    def get(self, generation_id: str) -> Optional[Dict]:
+        """Return a generation's registry entry, or None if it is unknown or was purged."""
+        raise NotImplementedError
+
+    def latest_for_chat(self, chat_id: str) -> Optional[Dict]:
+        """Return the registry entry of a chat's most recent generation, or None."""
+        raise NotImplementedError
+
+    def cancel(self, generation_id: str) -> bool:
+        """Ask a running generation to stop. Returns False if it isn't running."""
+        raise NotImplementedError
+
+    def is_cancelled(self, generation_id: str) -> bool:
+        """Whether a generation running in this process should stop. Cheap enough to call for every token."""
+        raise NotImplementedError
+
+    def running_models(self) -> List[str]:
+        """Return the model of every reply being generated, by any process (one entry per model of a fan-out)."""
+        raise NotImplementedError
+
+
+class _LocalGeneration:
+    """A generation running in this process, or finished by it recently."""
+
+    def __init__(self, generation_id: str, chat_id: str, user_id: str, models: List[str]):
+        self.entry = {
+            'id': generation_id,
+            'chat_id': chat_id,
+            'user_id': user_id,
+            'models': list(models),
+            'status': 'running',
+            'cancel_requested': False,
+            'event_count': 0,
+            'started_at': datetime.utcnow().isoformat(),
+            'finished_at': None
+        }
+        self.events: List[Dict] = []
+        self.changed = threading.Condition()
+        self.finished_at: Optional[float] = None  # time.monotonic(), for retention
+
+
+class MemoryBroker(GenerationBroker):
+    """Broker for a single process: generations live in a dict and readers wait on a condition."""
+
+    def __init__(self, retention_seconds: float = 300):
+        self.retention_seconds = retention_seconds
+        self._generations: Dict[str, _LocalGeneration] = {}
+        self._lock = threading.Lock()
+
+    def start(self, chat_id, user_id, models):
+        generation = _LocalGeneration(str(uuid.uuid4()), chat_id, user_id, models)
+        with self._lock:
+            # Finished generations are kept for a while so clients can still replay them
+            cutoff = time.monotonic() - self.retention_seconds
+            for generation_id, old in list(self._generations.items()):
+                if old.finished_at is not None and old.finished_at < cutoff:
+                    del self._generations[generation_id]
+            self._generations[generation.entry['id']] = generation
+        return generation.entry['id']
+
+    def publish(self, generation_id, event):
+        generation = self._generations[generation_id]
+        with generation.changed:
+            generation.events.append(event)
+            generation.entry['event_count'] = len(generation.events)
+            generation.changed.notify_all()
+            return len(generation.events)
+
+    def finish(self, generation_id, status='done'):
+        generation = self._generations[generation_id]
+        with generation.changed:
+            generation.entry['status'] = status
+            generation.entry['finished_at'] = datetime.utcnow().isoformat()
+            generation.finished_at = time.monotonic()
+            generation.changed.notify_all()
+
+    def read(self, generation_id, after, timeout):
+        generation = self._generations.get(generation_id)
+        if generation is None:
+            return [], True
+        with generation.changed:
+            if len(generation.events) <= after and generation.entry['status'] == 'running':
+                generation.changed.wait(timeout)
+            events = list(enumerate(generation.events[after:], after + 1))
+            return events, generation.entry['status'] != 'running'
+
+    def get(self, generation_id):
+        generation = self._generations.get(generation_id)
+        return dict(generation.entry) if generation else None
+
+    def latest_for_chat(self, chat_id):
+        with self._lock:
+            # Insertion order is start order
+            matches = [generation for generation in self._generations.values() if generation.entry['chat_id'] == chat_id]
+        return dict(matches[-1].entry) if matches else None
+
+    def cancel(self, generation_id):
+        generation = self._generations.get(generation_id)
+        if generation is None or generation.entry['status'] != 'running':
+            return False
+        generation.entry['cancel_requested'] = True
+        return True
+
+    def is_cancelled(self, generation_id):
+        generation = self._generations.get(generation_id)
+        return bool(generation and generation.entry['cancel_requested'])
+
+    def running_models(self):
+        with self._lock:
+            generations = list(self._generations.values())
+        return [model for generation in generations if generation.entry['status'] == 'running'
+                for model in generation.entry['models']]
+
+
+def _row_entry(row, stale_before: datetime) -> Dict:
+    # A generation whose process stopped sending heartbeats is reported as failed
+    status = row.status
+    if status == 'running' and row.heartbeat_at < stale_before:
+        status = 'error'
+    return {
+        'id': row.id,
+        'chat_id': row.chat_id,
+        'user_id': row.user_id,
+        'models': json.loads(row.models),
+        'status': status,
+        'cancel_requested': row.cancel_requested,
+        'event_count': row.event_count,
+        'started_at': row.started_at.isoformat(),
+        'finished_at': row.finished_at.isoformat() if row.finished_at else None
+    }
+
+
+class SQLiteBroker(MemoryBroker):
+    """
+    Broker shared by all processes using the same database.
+
+    Generations running in this process are served from memory, as with MemoryBroker.
+    A flusher thread writes their events to generation_events every poll_interval
+    seconds, in one transaction per batch rather than one per token. The same thread
+    picks up cancellations requested by other processes and keeps a heartbeat, so the
+    generations of a process that died show up as failed after stale_seconds. Other
+    processes read the table, polling every poll_interval seconds.
+    """
+
+    def __init__(self, app, retention_seconds: float = 300, poll_interval: float = 0.1,
+                 stale_seconds: float = 30, heartbeat_seconds: float = 5, wal: bool = True):
+        super().__init__(retention_seconds)
+        self.poll_interval = poll_interval
+        self.wal = wal
+        self.stale_seconds = stale_seconds
+        self.heartbeat_seconds = heartbeat_seconds
+        with app.app_context():
+            # The global database, like the job queue, so no shard has to be selected
+            self._engine = db.engine
+        self._pending: Dict[str, List[Tuple[int, Dict]]] = {}
+        self._finishing: Dict[str, str] = {}
+        self._flush_lock = threading.Lock()
+        self._flusher_pid = None
+        self._last_heartbeat = 0.0
+        self._last_purge = 0.0
+
+    def _ensure_flusher(self):
+        # Started on first use rather than at import, so that it runs in the worker process after a fork
+        with self._lock:
+            if self._flusher_pid == os.getpid():
+                return
+            self._flusher_pid = os.getpid()
+        if self.wal:
+            # Readers in other processes must not block the flushes. Once per process, and only for
+            # this broker; the mode persists in the database file (see "Multiple Processes" in README.md)
+            with self._engine.connect() as connection:
+                connection.exec_driver_sql('PRAGMA journal_mode=WAL')
+        threading.Thread(target=self._flush_loop, daemon=True, name='generation-flusher').start()
+
+    def start(self, chat_id, user_id, models):
+        self._ensure_flusher()
+        generation_id = super().start(chat_id, user_id, models)
+        now = datetime.utcnow()
+        with self._engine.begin() as connection:
+            connection.execute(db.insert(_generations).values(
+                id=generation_id, chat_id=chat_id, user_id=user_id, models=json.dumps(list(models)),
+                status='running', worker=f'{socket.gethostname()}:{os.getpid()}',
+                cancel_requested=False, event_count=0, started_at=now, heartbeat_at=now
+            ))
+        return generation_id
+
+    def publish(self, generation_id, event):
+        seq = super().publish(generation_id, event)
+        with self._lock:
+            self._pending.setdefault(generation_id, []).append((seq, event))
+        return seq
+
+    def finish(self, generation_id, status='done'):
+        super().finish(generation_id, status)
+        with self._lock:
+            self._finishing[generation_id] = status
+        # Write the end right away so other processes don't wait for the next flush
+        self.flush()
+
+    def flush(self):
+        """Write pending events, finished generations and heartbeats, and pick up remote cancellations."""
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+                finishing, self._finishing = self._finishing, {}
+                running = [
+                    generation_id for generation_id, generation in self._generations.items()
+                    if generation.entry['status'] == 'running'
+                ]
+            heartbeat = time.monotonic() - self._last_heartbeat >= self.heartbeat_seconds
+            now = datetime.utcnow()
+            try:
+                with self._engine.begin() as connection:
+                    rows = [
+                        {'generation_id': generation_id, 'seq': seq, 'data': json.dumps(event)}
+                        for generation_id, events in pending.items() for seq, event in events
+                    ]
+                    if rows:
+                        connection.execute(db.insert(_events), rows)
+                    for generation_id in set(pending) | set(finishing) | (set(running) if heartbeat else set()):
+                        values = {'heartbeat_at': now}
+                        if generation_id in pending:
+                            values['event_count'] = max(seq for seq, _ in pending[generation_id])
+                        if generation_id in finishing:
+                            values['status'] = finishing[generation_id]
+                            values['finished_at'] = now
+                        connection.execute(db.update(_generations).where(_generations.c.id == generation_id).values(**values))
+                    cancelled = connection.execute(db.select(_generations.c.id).where(
+                        _generations.c.id.in_(running),
+                        _generations.c.cancel_requested.is_(True)
+                    )).scalars().all() if running else []
+            except Exception as e:
+                # Keep everything for the next attempt (e.g. the database was locked)
+                with self._lock:
+                    for generation_id, events in pending.items():
+                        self._pending[generation_id] = events + self._pending.get(generation_id, [])
+                    self._finishing = {**finishing, **self._finishing}
+                print(f"ERROR: Failed to write generation events: {e}")
+                return
+            if heartbeat:
+                self._last_heartbeat = time.monotonic()
+            for generation_id in cancelled:
+                super().cancel(generation_id)
+
+    def purge(self) -> int:
+        """Delete generations finished more than retention_seconds ago and mark dead ones failed. Returns deleted."""
+        now = datetime.utcnow()
+        finished_before = now - timedelta(seconds=self.retention_seconds)
+        with self._engine.begin() as connection:
+            connection.execute(db.update(_generations).where(
+                _generations.c.status == 'running',
+                _generations.c.heartbeat_at < now - timedelta(seconds=self.stale_seconds)
+            ).values(status='error', finished_at=now))
+            old = db.select(_generations.c.id).where(
+                _generations.c.status != 'running',
+                _generations.c.finished_at < finished_before
+            )
+            # SQLite only enforces ON DELETE CASCADE with foreign_keys on, so delete the events explicitly
+            connection.execute(db.delete(_events).where(_events.c.generation_id.in_(old)))
+            return connection.execute(db.delete(_generations).where(_generations.c.id.in_(old))).rowcount
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.poll_interval)
+            self.flush()
+            if time.monotonic() - self._last_purge >= 60:
+                self._last_purge = time.monotonic()
+                try:
+                    self.purge()
+                except Exception as e:
+                    print(f"ERROR: Failed to purge generations: {e}")
+
+    def _stale_before(self) -> datetime:
+        return datetime.utcnow() - timedelta(seconds=self.stale_seconds)
+
+    def read(self, generation_id, after, timeout):
+        if generation_id in self._generations:
+            return super().read(generation_id, after, timeout)
+        deadline = time.monotonic() + timeout
+        while True:
+            # One read transaction, so the status and the events are from the same snapshot
+            with self._engine.connect() as connection:
+                row = connection.execute(db.select(_generations).where(_generations.c.id == generation_id)).first()
+                if row is None:
+                    return [], True
+                rows = connection.execute(
+                    db.select(_events.c.seq, _events.c.data).where(
+                        _events.c.generation_id == generation_id,
+                        _events.c.seq > after
+                    ).order_by(_events.c.seq).limit(500)
+                ).all()
+            running = _row_entry(row, self._stale_before())['status'] == 'running'
+            if rows or not running or time.monotonic() >= deadline:
+                return [(seq, json.loads(data)) for seq, data in rows], not running and len(rows) < 500
+            time.sleep(min(self.poll_interval, max(0.0, deadline - time.monotonic())))
+
+    def get(self, generation_id):
+        local = super().get(generation_id)
+        if local is not None:
+            return local
+        with self._engine.connect() as connection:
+            row = connection.execute(db.select(_generations).where(_generations.c.id == generation_id)).first()
+        return _row_entry(row, self._stale_before()) if row else None
+
+    def latest_for_chat(self, chat_id):
+        with self._engine.connect() as connection:
+            row = connection.execute(
+                db.select(_generations).where(_generations.c.chat_id == chat_id)
+                .order_by(_generations.c.started_at.desc()).limit(1)
+            ).first()
+        if row is None:
+            return None
+        # Generations of this process are fresher in memory
+        return super().get(row.id) or _row_entry(row, self._stale_before())
+
+    def running_models(self):
+        with self._engine.connect() as connection:
+            rows = connection.execute(db.select(_generations.c.models).where(
+                _generations.c.status == 'running',
+                _generations.c.heartbeat_at >= self._stale_before()
+            )).scalars().all()
+        return [model for models in rows for model in json.loads(models)]
+
+    def cancel(self, generation_id):
+        cancelled = super().cancel(generation_id)
+        with self._engine.begin() as connection:
+            result = connection.execute(db.update(_generations).where(
+                _generations.c.id == generation_id,
+                _generations.c.status == 'running'
+            ).values(cancel_requested=True))
+        return cancelled or bool(result.rowcount)
+
+
+def create_broker(app) -> GenerationBroker:
+    """Create the broker named by GENERATION_BROKER: 'memory' (one process) or 'sqlite' (several)."""
+    name = app.config.get('GENERATION_BROKER', 'memory')
+    retention_seconds = app.config.get('GENERATION_RETENTION_SECONDS', 300)
+    if name == 'memory':
+        return MemoryBroker(retention_seconds)
+    if name == 'sqlite':
+        return SQLiteBroker(
+            app, retention_seconds, app.config.get('GENERATION_POLL_SECONDS', 0.1),
+            wal=app.config.get('GENERATION_BROKER_WAL', True)
+        )
+    raise ValueError(f'Unknown generation broker: {name}')
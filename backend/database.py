@@ -2,13 +2,155 @@
 Database module using SQLAlchemy ORM.
 Provides functions for chat and message operations.
 """
-from models import db, Chat, Message, UserSettings, User
+from models import (
+        db, Chat, Message, UserSettings, User, ChatArchive, ShardAssignment,
+        GenerationContext, UsageRollup, ChatEvent, current_shard
+    )
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from archive import load_archived_messages, rehydrate_chat
+from serialization import message_dict, chat_dict, chat_summary
+from flask import current_app
+from contextlib import contextmanager
 from typing import List, Dict, Optional
 from datetime import datetime
+from array import array
+import hashlib
+import json
+import threading
 
 
 # init_db is no longer needed as Flask-Migrate handles migrations
-# Database initialization happens in app.py with db.create_all()
+# Database initialization happens with `flask db upgrade` (or create_tables() for scratch databases)
+
+
+# Shard assignments never change once made, so they are cached per process
+_shard_cache: Dict[str, int] = {}
+
+
+def get_user_shard(user_id: str) -> Optional[int]:
+    """Return the shard index holding a user's data, or None when sharding is disabled."""
+    shard_count = current_app.config.get('SHARD_COUNT', 0)
+    if not shard_count:
+        return None
+    if user_id in _shard_cache:
+        return _shard_cache[user_id]
+    
+    # The shard map is authoritative, so changing SHARD_COUNT only affects new users
+    assignment = ShardAssignment.query.get(user_id)
+    if not assignment:
+        digest = hashlib.sha1(user_id.encode('utf-8')).digest()
+        assignment = ShardAssignment(user_id=user_id, shard=int.from_bytes(digest[:8], 'big') % shard_count)
+        db.session.add(assignment)
+        db.session.commit()
+    _shard_cache[user_id] = assignment.shard
+    return assignment.shard
+
+
+def enter_user_shard(user_id: str):
+    """Route queries on sharded tables to the user's shard. Returns a token for leave_shard()."""
+    return current_shard.set(get_user_shard(user_id))
+
+
+def leave_shard(token):
+    """Undo enter_user_shard()."""
+    current_shard.reset(token)
+
+
+@contextmanager
+def use_shard(user_id: str):
+    """Context manager routing queries on sharded tables to the user's shard."""
+    token = enter_user_shard(user_id)
+    try:
+        yield
+    finally:
+        leave_shard(token)
+
+
+def each_shard():
+    """Iterate over every shard (or just the global DB when sharding is disabled), selecting it in turn."""
+    shard_count = current_app.config.get('SHARD_COUNT', 0)
+    for shard in (range(shard_count) if shard_count else [None]):
+        token = current_shard.set(shard)
+        try:
+            yield shard
+        finally:
+            # Message ids are only unique within a shard, so don't share an identity map
+            db.session.commit()
+            db.session.expunge_all()
+            current_shard.reset(token)
+
+
+def create_tables():
+    """
+    Create every table in chats.db and in each shard database, without migrations (tests and
+    scratch databases; deployments use `flask db upgrade`). db.create_all() alone only covers
+    chats.db, since the models don't name a bind and are routed to shards per query.
+    """
+    db.create_all()
+    for key, engine in db.engines.items():
+        if key is not None and key.startswith('shard'):
+            db.metadata.create_all(engine)
+
+
+def import_into_shards() -> int:
+    """
+    Move chats, messages, archives, saved generation contexts, settings and usage rollups
+    from the global DB into the users' shards. Returns users moved.
+    """
+    source = db.engines[None]
+    # (table, condition for a user's rows given (user_id, chat_ids)), parents before children
+    tables = [
+        (Chat.__table__, lambda user_id, ids: Chat.__table__.c.id.in_(ids)),
+        (Message.__table__, lambda user_id, ids: Message.__table__.c.chat_id.in_(ids)),
+        (ChatArchive.__table__, lambda user_id, ids: ChatArchive.__table__.c.chat_id.in_(ids)),
+        (GenerationContext.__table__, lambda user_id, ids: GenerationContext.__table__.c.chat_id.in_(ids)),
+        (UserSettings.__table__, lambda user_id, ids: UserSettings.__table__.c.user_id == user_id),
+        # By user, not chat: rollups outlive deleted chats
+        (UsageRollup.__table__, lambda user_id, ids: UsageRollup.__table__.c.user_id == user_id),
+    ]
+    moved = 0
+    
+    for (user_id,) in db.session.query(User.id).all():
+        engine = db.engines[f'shard{get_user_shard(user_id)}']
+        with source.begin() as src, engine.begin() as dst:
+            chat_ids = [row.id for row in src.execute(
+                db.select(Chat.__table__.c.id).where(Chat.__table__.c.user_id == user_id)
+            )]
+            # Copy everything first, then delete from the global DB
+            copied = 0
+            for table, where in tables:
+                rows = src.execute(db.select(table).where(where(user_id, chat_ids))).mappings().all()
+                if rows:
+                    dst.execute(db.insert(table), [dict(row) for row in rows])
+                    copied += len(rows)
+            if not copied:
+                continue
+            for table, where in reversed(tables):
+                src.execute(db.delete(table).where(where(user_id, chat_ids)))
+            src.execute(db.delete(ChatEvent.__table__).where(ChatEvent.__table__.c.user_id == user_id))
+            # Versions handed out by chats.db mean nothing in the shard. The reset marker gets an id
+            # above every version of both, so older cursors fall below it and are told to refetch.
+            last_id = max(_last_chat_event_id(src), _last_chat_event_id(dst))
+            _add_reset_marker(dst, user_id, last_id + 1)
+        moved += 1
+    return moved
+
+
+def _last_chat_event_id(connection) -> int:
+    # AUTOINCREMENT's high-water mark, which also counts ids of compacted events
+    return connection.exec_driver_sql(
+        "SELECT seq FROM sqlite_sequence WHERE name = 'chat_events'"
+    ).scalar() or 0
+
+
+def _add_reset_marker(connection, user_id: str, event_id: int):
+    events = ChatEvent.__table__
+    connection.execute(db.delete(events).where(events.c.user_id == user_id, events.c.event_type == 'reset'))
+    connection.execute(db.insert(events).values(
+        id=event_id, user_id=user_id, chat_id='', event_type='reset', data='{}', created_at=datetime.utcnow()
+    ))
 
 
 def get_or_create_user(google_id: str, email: str, name: str = None, picture: str = None) -> User:
@@ -37,35 +179,232 @@ def create_chat(user_id: str, title: str, model: str = 'gemma3:1b') -> str:
     """Create a new chat and return its UUID."""
     chat = Chat(user_id=user_id, title=title, model=model)
     db.session.add(chat)
+    db.session.flush()
+    record_chat_event(user_id, chat.id, 'created')
     db.session.commit()
     return chat.id
 
 
+# Default for add_message's parent_id: continue the chat's active branch
+ACTIVE_LEAF = object()
+
+
+# Columns read by the fast path below, in the order serialization.message_dict/chat_dict
+# expect. DateTimes are read as the strings SQLite stores instead of parsing them.
+_messages = Message.__table__
+_chats = Chat.__table__
+MESSAGE_COLUMNS = (
+    _messages.c.id, _messages.c.chat_id, _messages.c.parent_id, _messages.c.role, _messages.c.content,
+    _messages.c.sequence_order, db.type_coerce(_messages.c.created_at, db.String).label('created_at'),
+    _messages.c.model
+)
+CHAT_COLUMNS = (
+    _chats.c.id, _chats.c.title, _chats.c.model,
+    db.type_coerce(_chats.c.created_at, db.String).label('created_at'),
+    db.type_coerce(_chats.c.updated_at, db.String).label('updated_at'),
+    _chats.c.message_count,
+    db.type_coerce(_chats.c.last_message_at, db.String).label('last_message_at'),
+    _chats.c.active_leaf_id, _chats.c.archived_at
+)
+
+
+def _rows(statement, mapper) -> list:
+    # Plain row tuples from the connection holding mapper's table: no ORM objects, no identity map
+    return db.session.connection(bind_arguments={'mapper': mapper}).execute(statement).all()
+
+
+def _leaf_id(chat_id: str, active_leaf_id: Optional[int]) -> Optional[int]:
+    # Chats from before branching may lack an active leaf; fall back to the newest message
+    if active_leaf_id is not None:
+        return active_leaf_id
+    rows = _rows(
+        db.select(_messages.c.id).where(_messages.c.chat_id == chat_id)
+        .order_by(_messages.c.sequence_order.desc()).limit(1),
+        Message
+    )
+    return rows[0][0] if rows else None
+
+
+def get_path(chat_id: str, leaf_id: Optional[int]) -> list:
+    """Get the messages (rows of MESSAGE_COLUMNS) from the root of a chat's message tree down to leaf_id."""
+    if leaf_id is None:
+        return []
+    # Walk the parent pointers up from the leaf in one recursive query, so loading a branch
+    # costs its own length no matter how many alternatives the chat has
+    path = db.select(_messages.c.id, _messages.c.parent_id).where(
+        _messages.c.id == leaf_id,
+        _messages.c.chat_id == chat_id
+    ).cte('path', recursive=True)
+    path = path.union_all(
+        db.select(_messages.c.id, _messages.c.parent_id).join(path, _messages.c.id == path.c.parent_id)
+    )
+    return _rows(
+        db.select(*MESSAGE_COLUMNS).where(_messages.c.id.in_(db.select(path.c.id)))
+        .order_by(_messages.c.sequence_order),
+        Message
+    )
+
+
+def path_to(messages: List[Dict], leaf_id: Optional[int]) -> List[Dict]:
+    """Pick the path from the root to leaf_id out of already loaded message dicts."""
+    by_id = {msg['id']: msg for msg in messages}
+    if leaf_id not in by_id:
+        leaf_id = messages[-1]['id'] if messages else None
+    path = []
+    while leaf_id is not None and leaf_id in by_id:
+        path.append(by_id[leaf_id])
+        leaf_id = by_id[leaf_id].get('parent_id')
+    return path[::-1]
+
+
+def _branch_dicts(chat_id: str, path: list) -> List[Dict]:
+    # Every message on the path lists its siblings (itself included), so clients can switch branches
+    # Scanning the chat's (id, parent_id) pairs is much cheaper than binding every path id
+    children = {}
+    siblings = _rows(
+        db.select(_messages.c.id, _messages.c.parent_id).where(
+            _messages.c.chat_id == chat_id
+        ).order_by(_messages.c.sequence_order),
+        Message
+    )
+    for message_id, parent_id in siblings:
+        children.setdefault(parent_id, []).append(message_id)
+    result = []
+    for row in path:
+        msg_dict = message_dict(row)
+        msg_dict['sibling_ids'] = children.get(row.parent_id, [row.id])
+        result.append(msg_dict)
+    return result
+
+
+def _chat_row(chat_id: str):
+    rows = _rows(db.select(*CHAT_COLUMNS).where(_chats.c.id == chat_id), Chat)
+    return rows[0] if rows else None
+
+
 def get_chat(chat_id: str) -> Optional[Dict]:
-    """Get a chat with its messages."""
-    chat = Chat.query.get(chat_id)
-    if not chat:
+    """Get a chat with the messages of its active branch."""
+    row = _chat_row(chat_id)
+    if row is None:
         return None
-    return chat.to_dict()
+    # Archived chats are restored from cold storage on first access
+    if row.archived_at is not None:
+        rehydrate_chat(chat_id)
+        row = _chat_row(chat_id)
+    path = get_path(chat_id, _leaf_id(chat_id, row.active_leaf_id))
+    return chat_dict(row, _branch_dicts(chat_id, path))
+
+
+def get_message(chat_id: str, message_id: int) -> Optional[Dict]:
+    """Get a single message of a chat."""
+    rehydrate_chat(chat_id)
+    message = Message.query.filter_by(id=message_id, chat_id=chat_id).first()
+    return message.to_dict() if message else None
+
+
+def get_messages_after(chat_id: str, after_seq: int, updated_after: Optional[int] = None) -> List[Dict]:
+    """
+    Get the messages of a chat's active branch whose sequence_order is greater than after_seq,
+    plus, with updated_after, those added or changed since that update_seq (see get_update_seq),
+    such as a reply that was still streaming when the client last fetched.
+    """
+    rehydrate_chat(chat_id)
+    row = _chat_row(chat_id)
+    if row is None:
+        return []
+    path = get_path(chat_id, _leaf_id(chat_id, row.active_leaf_id))
+    changed = set()
+    if updated_after is not None:
+        changed = {message_id for (message_id,) in _rows(
+            db.select(_messages.c.id).where(_messages.c.chat_id == chat_id, _messages.c.update_seq > updated_after),
+            Message
+        )}
+    return _branch_dicts(chat_id, [msg for msg in path if msg.sequence_order > after_seq or msg.id in changed])
+
+
+def get_update_seq(chat_id: str) -> int:
+    """The highest update_seq of a chat's messages: pass it as updated_after to fetch only later changes."""
+    rows = _rows(db.select(db.func.coalesce(db.func.max(_messages.c.update_seq), 0)).where(_messages.c.chat_id == chat_id), Message)
+    return rows[0][0]
+
+
+def _next_update_seq(chat_id: str) -> int:
+    # Flushed first, so SQLite's write lock is held and no other writer can take the same number
+    db.session.flush()
+    return (db.session.query(db.func.max(Message.update_seq)).filter(Message.chat_id == chat_id).scalar() or 0) + 1
 
 
 def get_all_chats(user_id: str) -> List[Dict]:
-    """Get all chats for a user, ordered by most recently updated."""
-    chats = Chat.query.filter_by(user_id=user_id).order_by(Chat.updated_at.desc()).all()
-    return [chat.to_dict() for chat in chats]
+    """Get all chats for a user with their active branches, ordered by most recently updated."""
+    chats = _rows(
+        db.select(*CHAT_COLUMNS).where(_chats.c.user_id == user_id).order_by(_chats.c.updated_at.desc()),
+        Chat
+    )
+    # All live messages in one query rather than one per chat
+    messages_by_chat = {}
+    for row in _rows(
+        db.select(*MESSAGE_COLUMNS).join(_chats, _chats.c.id == _messages.c.chat_id)
+        .where(_chats.c.user_id == user_id, _chats.c.archived_at.is_(None))
+        .order_by(_messages.c.chat_id, _messages.c.sequence_order),
+        Message
+    ):
+        messages_by_chat.setdefault(row.chat_id, []).append(message_dict(row))
+    
+    result = []
+    for row in chats:
+        # Listing doesn't count as access, so read archived messages without restoring them
+        if row.archived_at is not None:
+            messages = load_archived_messages(Chat.query.get(row.id))
+        else:
+            messages = messages_by_chat.get(row.id, [])
+        result.append(chat_dict(row, path_to(messages, row.active_leaf_id)))
+    return result
+
+
+def set_active_leaf(chat_id: str, message_id: int) -> bool:
+    """
+    Switch a chat to the branch through message_id, continuing down to its newest descendant.
+    Returns False if the message doesn't belong to the chat.
+    """
+    rehydrate_chat(chat_id)
+    chat = Chat.query.get(chat_id)
+    if not chat or not Message.query.filter_by(id=message_id, chat_id=chat_id).count():
+        return False
+    # Children are always newer than their parents, so the newest descendant is a leaf
+    subtree = db.select(Message.id).where(Message.id == message_id).cte('subtree', recursive=True)
+    subtree = subtree.union_all(db.select(Message.id).join(subtree, Message.parent_id == subtree.c.id))
+    leaf_id = db.session.query(Message.id).filter(
+        Message.id.in_(db.select(subtree.c.id))
+    ).order_by(Message.sequence_order.desc()).limit(1).scalar()
+    if chat.active_leaf_id != leaf_id:
+        chat.active_leaf_id = leaf_id
+        chat.updated_at = datetime.utcnow()
+        record_chat_event(chat.user_id, chat_id, 'updated')
+    db.session.commit()
+    return True
 
 
 def find_empty_chat(user_id: str) -> Optional[str]:
     """Find the most recently created chat with no messages for a user. Returns chat_id or None."""
-    # Find chats with no messages, ordered by most recently created
-    # Use left join to find chats without messages
-    from sqlalchemy.orm import outerjoin
-    chat = Chat.query.filter_by(user_id=user_id).outerjoin(Message, Chat.id == Message.chat_id).filter(Message.id == None).order_by(Chat.created_at.desc()).first()
-    return chat.id if chat else None
+    # Compare against a literal 0 so SQLite can match the partial index ix_chats_user_empty
+    chat_id = db.session.query(Chat.id).filter(
+        Chat.user_id == user_id,
+        Chat.message_count == db.literal_column('0')
+    ).order_by(Chat.created_at.desc()).limit(1).scalar()
+    return chat_id
 
 
-def add_message(chat_id: str, role: str, content: str) -> int:
-    """Add a message to a chat and return message ID."""
+def add_message(chat_id: str, role: str, content: str, parent_id=ACTIVE_LEAF) -> int:
+    """
+    Add a message to a chat and return message ID.
+    The message follows the chat's active branch unless parent_id is given (None starts
+    a new branch at the root), and becomes the chat's active leaf.
+    """
+    rehydrate_chat(chat_id)
+    chat = Chat.query.get(chat_id)
+    if parent_id is ACTIVE_LEAF:
+        parent_id = _leaf_id(chat_id, chat.active_leaf_id) if chat else None
+    
     # Get next sequence order
     last_message = Message.query.filter_by(chat_id=chat_id).order_by(Message.sequence_order.desc()).first()
     sequence_order = (last_message.sequence_order + 1) if last_message else 0
@@ -73,19 +412,309 @@ def add_message(chat_id: str, role: str, content: str) -> int:
     # Create message
     message = Message(
         chat_id=chat_id,
+        parent_id=parent_id,
         role=role,
         content=content,
         sequence_order=sequence_order
     )
     db.session.add(message)
+    message.update_seq = _next_update_seq(chat_id)
+    
+    # Update chat's counters, active branch and updated_at timestamp in the same transaction
+    if chat:
+        now = datetime.utcnow()
+        chat.message_count = Chat.message_count + 1
+        chat.last_message_at = now
+        chat.updated_at = now
+        chat.active_leaf_id = message.id
+        record_chat_event(chat.user_id, chat_id, 'updated')
     
-    # Update chat's updated_at timestamp
+    db.session.commit()
+    return message.id
+
+
+def delete_message(message_id: int) -> bool:
+    """Delete a message with all replies branching off it and update its chat. Returns False if not found."""
+    message = Message.query.get(message_id)
+    if not message:
+        return False
+    chat_id = message.chat_id
+    parent_id = message.parent_id
+    subtree = db.select(Message.id).where(Message.id == message_id).cte('subtree', recursive=True)
+    subtree = subtree.union_all(db.select(Message.id).join(subtree, Message.parent_id == subtree.c.id))
+    deleted_ids = [
+        row_id for (row_id,) in db.session.query(Message.id).filter(Message.id.in_(db.select(subtree.c.id)))
+    ]
+    Message.query.filter(Message.id.in_(deleted_ids)).delete(synchronize_session='fetch')
+    
+    invalidate_generation_context(chat_id)
     chat = Chat.query.get(chat_id)
     if chat:
+        # Fall back to the parent when the active branch went away
+        if chat.active_leaf_id in deleted_ids:
+            chat.active_leaf_id = parent_id
+        chat.message_count = Chat.message_count - len(deleted_ids)
+        chat.last_message_at = db.session.query(db.func.max(Message.created_at)).filter(
+            Message.chat_id == chat_id
+        ).scalar()
         chat.updated_at = datetime.utcnow()
+        record_chat_event(chat.user_id, chat_id, 'updated')
     
     db.session.commit()
-    return message.id
+    return True
+
+
+def update_message_content(message_id: int, content: str, final: bool = True) -> bool:
+    """
+    Update a message's content and touch its chat. Returns False if the message no longer exists.
+    Pass final=False for the periodic saves while a reply streams, which don't go to the change feed.
+    """
+    message = Message.query.get(message_id)
+    if not message:
+        return False
+    message.content = content
+    message.update_seq = _next_update_seq(message.chat_id)
+    
+    # Bump the chat's updated_at so cached copies of the chat are invalidated
+    chat = Chat.query.get(message.chat_id)
+    if chat:
+        chat.updated_at = datetime.utcnow()
+        if final:
+            record_chat_event(chat.user_id, chat.id, 'updated')
+    
+    db.session.commit()
+    return True
+
+
+def add_sibling_messages(chat_id: str, role: str, models: List[str], parent_id: Optional[int]) -> List[int]:
+    """
+    Add one empty message per model under parent_id and return their IDs, in order.
+    Used when several models answer the same user message; the content is filled in as it
+    streams. The active branch is left alone until set_active_leaf picks one of them.
+    """
+    rehydrate_chat(chat_id)
+
+    last_sequence = db.session.query(db.func.max(Message.sequence_order)).filter(
+        Message.chat_id == chat_id
+    ).scalar()
+    first_sequence = (last_sequence + 1) if last_sequence is not None else 0
+    messages = [
+        Message(chat_id=chat_id, parent_id=parent_id, role=role, content='', sequence_order=first_sequence + i, model=model)
+        for i, model in enumerate(models)
+    ]
+    db.session.add_all(messages)
+    update_seq = _next_update_seq(chat_id)
+    for message in messages:
+        message.update_seq = update_seq
+
+    # A saved context continues a single linear transcript, which siblings break
+    invalidate_generation_context(chat_id)
+    chat = Chat.query.get(chat_id)
+    if chat:
+        now = datetime.utcnow()
+        chat.message_count = Chat.message_count + len(messages)
+        chat.last_message_at = now
+        chat.updated_at = now
+        record_chat_event(chat.user_id, chat_id, 'updated')
+
+    db.session.commit()
+    return [message.id for message in messages]
+
+
+def update_messages_content(contents: Dict[int, str], final: bool = True) -> List[int]:
+    """
+    Update several messages' content in one transaction and touch their chats.
+    Returns the IDs of the messages that still exist. As with update_message_content,
+    only final saves add change-feed events.
+    """
+    if not contents:
+        return []
+    messages = Message.query.filter(Message.id.in_(list(contents))).all()
+    for message in messages:
+        message.content = contents[message.id]
+    update_seqs = {chat_id: _next_update_seq(chat_id) for chat_id in {message.chat_id for message in messages}}
+    for message in messages:
+        message.update_seq = update_seqs[message.chat_id]
+
+    now = datetime.utcnow()
+    for chat_id in {message.chat_id for message in messages}:
+        chat = Chat.query.get(chat_id)
+        if chat:
+            chat.updated_at = now
+            if final:
+                record_chat_event(chat.user_id, chat_id, 'updated')
+
+    db.session.commit()
+    return [message.id for message in messages]
+
+
+def _system_hash(system_prompt: str) -> str:
+    return hashlib.sha256((system_prompt or '').encode('utf-8')).hexdigest()
+
+
+def get_generation_context(chat_id: str, model: str, system_prompt: str, user_message_id: int) -> Optional[List[int]]:
+    """
+    Get the saved Ollama context for replying to user_message_id.
+    Returns None (and drops the saved context) unless the user message directly follows the
+    reply the context was saved after, with the same model and system prompt.
+    """
+    saved = GenerationContext.query.get(chat_id)
+    if not saved:
+        return None
+    
+    user_message = Message.query.get(user_message_id)
+    valid = (
+        user_message is not None
+        and user_message.role == 'user'
+        and user_message.parent_id == saved.last_message_id
+        and saved.model == model
+        and saved.system_hash == _system_hash(system_prompt)
+    )
+    if not valid:
+        db.session.delete(saved)
+        db.session.commit()
+        return None
+    return array('i', saved.context).tolist()
+
+
+def save_generation_context(chat_id: str, model: str, system_prompt: str, message_id: int, context: List[int]):
+    """Save the Ollama context returned after the assistant message message_id."""
+    chat = Chat.query.get(chat_id)
+    if not chat:
+        return
+    saved = GenerationContext.query.get(chat_id) or GenerationContext(chat_id=chat_id)
+    saved.model = model
+    saved.system_hash = _system_hash(system_prompt)
+    saved.last_message_id = message_id
+    saved.message_count = chat.message_count
+    saved.context = array('i', context).tobytes()
+    db.session.add(saved)
+    db.session.commit()
+
+
+def invalidate_generation_context(chat_id: str):
+    """Drop a chat's saved Ollama context, e.g. after its history was edited. Committed by the caller."""
+    GenerationContext.query.filter_by(chat_id=chat_id).delete(synchronize_session=False)
+
+
+def record_message_usage(message_id: int, model: str, stats: Dict):
+    """Store token counts and durations from Ollama's final chunk on an assistant message."""
+    message = Message.query.get(message_id)
+    if not message:
+        return
+    message.model = model
+    message.prompt_eval_count = stats.get('prompt_eval_count')
+    message.eval_count = stats.get('eval_count')
+    message.prompt_eval_duration = stats.get('prompt_eval_duration')
+    message.eval_duration = stats.get('eval_duration')
+    message.load_duration = stats.get('load_duration')
+    message.total_duration = stats.get('total_duration')
+    db.session.commit()
+
+
+def rollup_usage(user_id: str, batch_size: int = 1000) -> int:
+    """Add a user's not yet counted message usage to the hourly rollups. Returns messages counted."""
+    messages = Message.query.join(Chat, Chat.id == Message.chat_id).filter(
+        Chat.user_id == user_id,
+        Message.usage_rolled_up == db.literal_column('0'),
+        Message.eval_count.isnot(None)
+    ).limit(batch_size).all()
+    if not messages:
+        return 0
+    
+    buckets = {}
+    for msg in messages:
+        key = (msg.chat_id, msg.model or '', msg.created_at.replace(minute=0, second=0, microsecond=0))
+        totals = buckets.setdefault(key, [0, 0, 0, 0, 0, 0])
+        totals[0] += 1
+        totals[1] += msg.prompt_eval_count or 0
+        totals[2] += msg.eval_count or 0
+        totals[3] += msg.prompt_eval_duration or 0
+        totals[4] += msg.eval_duration or 0
+        totals[5] += msg.total_duration or 0
+        msg.usage_rolled_up = True
+    
+    table = UsageRollup.__table__
+    counters = ('message_count', 'prompt_tokens', 'completion_tokens', 'prompt_eval_ns', 'eval_ns', 'total_ns')
+    for (chat_id, model, bucket_start), totals in buckets.items():
+        stmt = sqlite_insert(table).values(
+            user_id=user_id, chat_id=chat_id, model=model, bucket_start=bucket_start,
+            **dict(zip(counters, totals))
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['user_id', 'chat_id', 'model', 'bucket_start'],
+            set_={name: table.c[name] + stmt.excluded[name] for name in counters}
+        )
+        db.session.execute(stmt, bind_arguments={'mapper': UsageRollup})
+    
+    # Counters and flags are committed together, so a retry never double counts
+    db.session.commit()
+    return len(messages)
+
+
+def get_usage(user_id: str, bucket: str = 'day', group_by: Optional[str] = None,
+              since: Optional[datetime] = None, until: Optional[datetime] = None) -> Dict:
+    """
+    Get a user's token usage in time buckets.
+    bucket is 'hour', 'day' or 'month'; group_by is None, 'model' or 'chat'.
+    """
+    query = UsageRollup.query.filter(UsageRollup.user_id == user_id)
+    if since:
+        query = query.filter(UsageRollup.bucket_start >= since)
+    if until:
+        query = query.filter(UsageRollup.bucket_start < until)
+    
+    def bucket_of(start: datetime) -> datetime:
+        if bucket == 'month':
+            return start.replace(day=1, hour=0)
+        if bucket == 'day':
+            return start.replace(hour=0)
+        return start
+    
+    grouped = {}
+    for row in query.order_by(UsageRollup.bucket_start).all():
+        group = {'model': row.model, 'chat': row.chat_id}.get(group_by)
+        totals = grouped.setdefault((bucket_of(row.bucket_start), group), {
+            'messages': 0, 'prompt_tokens': 0, 'completion_tokens': 0,
+            'prompt_eval_ns': 0, 'eval_ns': 0, 'total_ns': 0
+        })
+        totals['messages'] += row.message_count
+        totals['prompt_tokens'] += row.prompt_tokens
+        totals['completion_tokens'] += row.completion_tokens
+        totals['prompt_eval_ns'] += row.prompt_eval_ns
+        totals['eval_ns'] += row.eval_ns
+        totals['total_ns'] += row.total_ns
+    
+    def summarize(totals: Dict) -> Dict:
+        return {
+            'messages': totals['messages'],
+            'prompt_tokens': totals['prompt_tokens'],
+            'completion_tokens': totals['completion_tokens'],
+            'total_tokens': totals['prompt_tokens'] + totals['completion_tokens'],
+            'tokens_per_second': round(totals['completion_tokens'] / (totals['eval_ns'] / 1e9), 2) if totals['eval_ns'] else None,
+            'prompt_tokens_per_second': round(totals['prompt_tokens'] / (totals['prompt_eval_ns'] / 1e9), 2) if totals['prompt_eval_ns'] else None,
+            'avg_latency_ms': round(totals['total_ns'] / totals['messages'] / 1e6, 1) if totals['messages'] else None
+        }
+    
+    buckets = []
+    overall = {'messages': 0, 'prompt_tokens': 0, 'completion_tokens': 0, 'prompt_eval_ns': 0, 'eval_ns': 0, 'total_ns': 0}
+    for (bucket_start, group), totals in grouped.items():
+        entry = {'bucket_start': bucket_start.isoformat()}
+        if group_by:
+            entry[group_by] = group
+        entry.update(summarize(totals))
+        buckets.append(entry)
+        for key in overall:
+            overall[key] += totals[key]
+    
+    return {
+        'bucket': bucket,
+        'group_by': group_by,
+        'since': since.isoformat() if since else None,
+        'until': until.isoformat() if until else None,
+        'buckets': buckets,
+        'totals': summarize(overall)
+    }
 
 
 def update_chat_title(chat_id: str, title: str):
@@ -94,6 +723,7 @@ def update_chat_title(chat_id: str, title: str):
     if chat:
         chat.title = title
         chat.updated_at = datetime.utcnow()
+        record_chat_event(chat.user_id, chat_id, 'title')
         db.session.commit()
 
 
@@ -102,9 +732,95 @@ def delete_chat(chat_id: str):
     chat = Chat.query.get(chat_id)
     if chat:
         db.session.delete(chat)
+        record_chat_event(chat.user_id, chat_id, 'deleted')
         db.session.commit()
 
 
+# Chat list change feed. Every mutation above records an event in its own transaction; the
+# event's id is the feed version. Only the newest event per chat is kept, so a client catching
+# up from an old version gets one event per changed chat, not the full history of changes.
+
+# Bumped after every commit that recorded events, so feed streams in this process wake up
+# immediately instead of at their next poll (other processes are picked up by polling)
+_chat_events_changed = threading.Condition()
+_chat_events_seq = 0
+
+
+@event.listens_for(Session, 'after_commit')
+def _notify_chat_events(session):
+    global _chat_events_seq
+    if session.info.pop('chat_events', False):
+        with _chat_events_changed:
+            _chat_events_seq += 1
+            _chat_events_changed.notify_all()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_chat_events(session):
+    session.info.pop('chat_events', None)
+
+
+def record_chat_event(user_id: str, chat_id: str, event_type: str):
+    """
+    Add a change-feed event ('created', 'updated', 'title' or 'deleted') for chat_id to the
+    current transaction, replacing the chat's older events. Call after changing the chat.
+    """
+    data = {}
+    if event_type != 'deleted':
+        db.session.flush()
+        row = _chat_row(chat_id)
+        if row is None:
+            return
+        data = chat_summary(row)
+    ChatEvent.query.filter_by(chat_id=chat_id).delete(synchronize_session=False)
+    db.session.add(ChatEvent(user_id=user_id, chat_id=chat_id, event_type=event_type, data=json.dumps(data)))
+    db.session.info['chat_events'] = True
+
+
+def get_chat_version(user_id: str) -> int:
+    """Current version of a user's chat list (0 before the first change)."""
+    return db.session.query(db.func.max(ChatEvent.id)).filter(ChatEvent.user_id == user_id).scalar() or 0
+
+
+def get_chat_events_floor(user_id: str) -> int:
+    """
+    Oldest version a client can catch up from: 0, or the user's reset marker (see
+    import_into_shards). Clients with an older version must reload the list.
+    """
+    return db.session.query(db.func.max(ChatEvent.id)).filter(
+        ChatEvent.user_id == user_id,
+        ChatEvent.event_type == 'reset'
+    ).scalar() or 0
+
+
+def get_chat_events(user_id: str, since: int, limit: int = 100) -> List[Dict]:
+    """Get a user's chat list events newer than version since, oldest first."""
+    events = ChatEvent.query.filter(
+        ChatEvent.user_id == user_id,
+        ChatEvent.id > since,
+        ChatEvent.event_type != 'reset'
+    ).order_by(ChatEvent.id).limit(limit).all()
+    result = []
+    for chat_event in events:
+        item = {'version': chat_event.id, 'type': chat_event.event_type, 'chat_id': chat_event.chat_id}
+        if chat_event.event_type != 'deleted':
+            item['chat'] = json.loads(chat_event.data)
+        result.append(item)
+    return result
+
+
+def wait_for_chat_events(seen: int, timeout: float) -> int:
+    """
+    Wait up to timeout seconds for a commit with chat events in this process, unless one happened
+    since wait_for_chat_events returned seen (pass None to return at once). Returns the value to
+    pass as seen next time.
+    """
+    with _chat_events_changed:
+        if _chat_events_seq == seen:
+            _chat_events_changed.wait(timeout)
+        return _chat_events_seq
+
+
 def get_setting(user_id: str, key: str, default: str = '') -> str:
     """Get a user setting by key. Returns default if not found."""
     setting = UserSettings.query.filter_by(user_id=user_id, key=key).first()
@@ -0,0 +1,143 @@
+"""
+Streaming generation against Ollama.
+Wraps ollama.chat/ollama.generate so a chat turn can reuse the evaluation
+context returned for the previous turn instead of resending the transcript.
+Also fans one conversation out to several models at once.
+ollama (and httpx under it) is imported on the first reply rather than at startup.
+"""
+import queue
+import threading
+from typing import Dict, Iterator, List, Optional, Tuple
+
+
+def _stream_chat(model: str, messages: List[Dict], options: Optional[Dict] = None) -> Iterator[Tuple[str, object]]:
+    import ollama
+    for chunk in ollama.chat(model=model, messages=messages, stream=True, options=options or None):
+        content = chunk.get('message', {}).get('content', '')
+        if content:
+            yield 'content', content
+        if chunk.get('done'):
+            yield 'done', chunk
+
+
+def _stream_generate(model: str, prompt: str, system: Optional[str],
+                     context: Optional[List[int]], options: Optional[Dict] = None) -> Iterator[Tuple[str, object]]:
+    import ollama
+    # The system prompt is already part of a saved context, so only send it on the first turn
+    for chunk in ollama.generate(
+        model=model,
+        prompt=prompt,
+        system='' if context else (system or ''),
+        context=context,
+        stream=True,
+        options=options or None,
+    ):
+        content = chunk.get('response', '')
+        if content:
+            yield 'content', content
+        if chunk.get('done'):
+            yield 'done', chunk
+
+
+def _transcript_prompt(turns: List[Dict]) -> str:
+    # /api/generate takes a single prompt, which Ollama wraps in the model's template as one
+    # user turn, so earlier turns are quoted in front of the message being answered
+    if len(turns) == 1:
+        return turns[0]['content']
+    history = '\n\n'.join(
+        f"{'User' if turn['role'] == 'user' else 'Assistant'}: {turn['content']}" for turn in turns[:-1]
+    )
+    return f"Conversation so far:\n\n{history}\n\nReply to the user's latest message:\n\n{turns[-1]['content']}"
+
+
+def stream_reply(model: str, messages: List[Dict], context: Optional[List[int]] = None,
+                 reuse_context: bool = True, options: Optional[Dict] = None) -> Iterator[Tuple[str, object]]:
+    """
+    Stream an assistant reply to the last message of a conversation.
+
+    With a saved context only the last message is sent through /api/generate, so Ollama
+    doesn't re-evaluate the history. Without one (first turn, or the context was dropped
+    after an edit, a model switch, ...) the whole transcript goes through /api/generate once,
+    so the final chunk carries a new context either way and later turns are cheap again.
+    With reuse_context off, or if /api/generate fails before any output, the transcript is
+    sent through /api/chat. options (e.g. num_ctx, num_predict) are passed to Ollama as they
+    are; without them the model's defaults apply.
+
+    Yields:
+        ('content', text) for each piece of the reply, then ('done', final_chunk)
+    """
+    import ollama
+    system = messages[0]['content'] if messages and messages[0]['role'] == 'system' else None
+    turns = messages[1:] if system is not None else messages
+
+    if reuse_context and turns and turns[-1]['role'] == 'user':
+        prompt = turns[-1]['content'] if context else _transcript_prompt(turns)
+        started = False
+        try:
+            for item in _stream_generate(model, prompt, system, context, options):
+                started = True
+                yield item
+            return
+        except ollama.ResponseError as e:
+            if started:
+                raise
+            print(f"WARNING: Context reuse failed for model {model}, resending full transcript: {e}")
+
+    yield from _stream_chat(model, messages, options)
+
+
+def stream_replies(conversations: Dict[str, List[Dict]], max_concurrency: int = 3,
+                   options: Optional[Dict[str, Dict]] = None) -> Iterator[Tuple[str, str, object]]:
+    """
+    Stream replies from several models concurrently and merge them as they arrive.
+
+    Each model runs in its own thread, at most max_concurrency at a time, so the
+    whole fan-out takes about as long as the slowest model rather than the sum.
+    Closing the returned generator stops the models that are still generating.
+
+    Args:
+        conversations: {model: messages} with the transcript to send to each model
+        options: {model: options} passed to Ollama for each model
+
+    Yields:
+        (model, 'content', text) for each piece of a reply, then for every model
+        either (model, 'done', final_chunk) or (model, 'error', message)
+    """
+    events = queue.Queue()
+    slots = threading.BoundedSemaphore(max(1, max_concurrency))
+    stop = threading.Event()
+
+    def run(model: str, messages: List[Dict]):
+        with slots:
+            if stop.is_set():
+                return
+            final_chunk = {}
+            stream = _stream_chat(model, messages, (options or {}).get(model))
+            try:
+                for chunk_type, chunk_data in stream:
+                    if stop.is_set():
+                        return
+                    if chunk_type == 'done':
+                        final_chunk = chunk_data
+                    else:
+                        events.put((model, chunk_type, chunk_data))
+            except Exception as e:
+                events.put((model, 'error', str(e)))
+                return
+            finally:
+                # Closes the HTTP response, so Ollama stops generating too
+                stream.close()
+            events.put((model, 'done', final_chunk))
+
+    for model, messages in conversations.items():
+        threading.Thread(target=run, args=(model, messages), daemon=True, name=f'fan-out-{model}').start()
+
+    remaining = len(conversations)
+    try:
+        while remaining:
+            event = events.get()
+            if event[1] in ('done', 'error'):
+                remaining -= 1
+            yield event
+    finally:
+        stop.set()
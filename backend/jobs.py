@@ -0,0 +1,279 @@
+"""
+Persistent background job queue stored in SQLite.
+Request handlers enqueue work that can happen after a reply (titles, rollups, ...)
+and a pool of worker threads runs it, either inside the backend process or via
+`flask worker`.
+"""
+import json
+import os
+import random
+import socket
+import threading
+import traceback
+import uuid
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Optional
+from sqlalchemy.exc import IntegrityError
+from models import db, Job
+
+# Registered job types: name -> {'func', 'concurrency', 'max_attempts'}
+_handlers: Dict[str, Dict] = {}
+
+# Lets enqueue() wake up in-process workers instead of waiting for the next poll
+_wakeup = threading.Event()
+
+
+def job_handler(job_type: str, concurrency: int = 1, max_attempts: int = 5):
+    """
+    Register a function as the handler for a job type.
+
+    Args:
+        job_type: Name used with enqueue()
+        concurrency: Maximum jobs of this type running at once, across all workers
+        max_attempts: Attempts before the job is marked failed
+    """
+    def decorator(func: Callable[[Dict], None]):
+        _handlers[job_type] = {'func': func, 'concurrency': concurrency, 'max_attempts': max_attempts}
+        return func
+    return decorator
+
+
+def enqueue(job_type: str, payload: Optional[Dict] = None, user_id: Optional[str] = None,
+            priority: int = 0, dedupe_key: Optional[str] = None, delay_seconds: float = 0) -> int:
+    """
+    Add a job to the queue and return its ID.
+
+    Jobs with a higher priority run first. If dedupe_key is given and a job with
+    the same key is still queued, that job's ID is returned instead. A running one
+    doesn't count: it may have started before whatever this job is for happened.
+    """
+    if job_type not in _handlers:
+        raise ValueError(f'No handler registered for job type: {job_type}')
+
+    if dedupe_key:
+        existing = _queued_job_id(dedupe_key)
+        if existing:
+            return existing
+
+    job = Job(
+        job_type=job_type,
+        payload=json.dumps(payload or {}),
+        user_id=user_id,
+        priority=priority,
+        dedupe_key=dedupe_key,
+        max_attempts=_handlers[job_type]['max_attempts'],
+        run_after=datetime.utcnow() + timedelta(seconds=delay_seconds)
+    )
+    db.session.add(job)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # Lost a race with another enqueue of the same dedupe_key
+        db.session.rollback()
+        return _queued_job_id(dedupe_key)
+    _wakeup.set()
+    return job.id
+
+
+def _queued_job_id(dedupe_key: str) -> Optional[int]:
+    return db.session.query(Job.id).filter(
+        Job.dedupe_key == dedupe_key,
+        Job.status == 'queued'
+    ).scalar()
+
+
+def _supersede(job: Job):
+    # Only one job per dedupe key may be queued; the one that is will do this job's work
+    job.status = 'failed'
+    job.finished_at = datetime.utcnow()
+    job.last_error = f'Superseded by a queued job with the same dedupe key\n{job.last_error or ""}'[:4000]
+
+
+def claim_job(worker_id: str) -> Optional[Job]:
+    """Atomically mark the most urgent runnable job as running and return it."""
+    if not _handlers:
+        return None
+    now = datetime.utcnow()
+    claim = f'{worker_id}:{uuid.uuid4().hex}'
+    running = db.aliased(Job)
+
+    # Per-type concurrency limit, checked inside the same UPDATE so it holds across processes
+    limit = db.case(
+        {job_type: handler['concurrency'] for job_type, handler in _handlers.items()},
+        value=Job.job_type
+    )
+    running_count = db.select(db.func.count(running.id)).where(
+        running.status == 'running',
+        running.job_type == Job.job_type
+    ).scalar_subquery()
+    next_job = db.select(Job.id).where(
+        Job.status == 'queued',
+        Job.run_after <= now,
+        Job.job_type.in_(list(_handlers)),
+        running_count < limit
+    ).order_by(Job.priority.desc(), Job.id).limit(1).scalar_subquery()
+
+    result = db.session.execute(
+        db.update(Job).where(Job.id == next_job).values(
+            status='running',
+            locked_by=claim,
+            locked_at=now,
+            attempts=Job.attempts + 1
+        ).execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    if not result.rowcount:
+        return None
+    return Job.query.filter_by(locked_by=claim).first()
+
+
+def _backoff_seconds(attempts: int, base: float = 5, cap: float = 3600) -> float:
+    # Exponential backoff with jitter: ~5s, 10s, 20s, ... capped at an hour
+    delay = min(cap, base * (2 ** (attempts - 1)))
+    return delay * random.uniform(0.8, 1.2)
+
+
+def run_job(job: Job):
+    """Run a claimed job and record its outcome, scheduling a retry on failure."""
+    from database import use_shard
+    handler = _handlers[job.job_type]
+    payload = json.loads(job.payload)
+    try:
+        if job.user_id:
+            with use_shard(job.user_id):
+                handler['func'](payload)
+        else:
+            handler['func'](payload)
+        job.status = 'done'
+        job.last_error = None
+        job.finished_at = datetime.utcnow()
+    except Exception as e:
+        db.session.rollback()
+        job.last_error = f'{e}\n{traceback.format_exc()}'[-4000:]
+        if job.attempts >= job.max_attempts:
+            job.status = 'failed'
+            job.finished_at = datetime.utcnow()
+            print(f"ERROR: Job {job.id} ({job.job_type}) failed permanently: {e}")
+        elif job.dedupe_key and _queued_job_id(job.dedupe_key):
+            _supersede(job)
+            print(f"WARNING: Job {job.id} ({job.job_type}) failed, a queued job with the same key will retry: {e}")
+        else:
+            job.status = 'queued'
+            job.run_after = datetime.utcnow() + timedelta(seconds=_backoff_seconds(job.attempts))
+            print(f"WARNING: Job {job.id} ({job.job_type}) failed, retrying at {job.run_after}: {e}")
+    job.locked_by = None
+    job.locked_at = None
+    last_error = job.last_error
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # A job with the same dedupe key was enqueued while the retry was being saved
+        db.session.rollback()
+        job.last_error = last_error
+        _supersede(job)
+        job.locked_by = None
+        job.locked_at = None
+        db.session.commit()
+
+
+def requeue_stale_jobs(lock_timeout_seconds: int) -> int:
+    """Put jobs back in the queue whose worker stopped without finishing them."""
+    cutoff = datetime.utcnow() - timedelta(seconds=lock_timeout_seconds)
+    # Jobs with a queued or newer running duplicate by now can't (all) be queued again;
+    # the duplicate replaces them
+    other = db.aliased(Job)
+    duplicate = db.select(other.id).where(
+        other.dedupe_key == Job.dedupe_key,
+        db.or_(other.status == 'queued', db.and_(other.status == 'running', other.id > Job.id))
+    ).exists()
+    db.session.execute(
+        db.update(Job).where(
+            Job.status == 'running',
+            Job.locked_at < cutoff,
+            Job.dedupe_key.isnot(None),
+            duplicate
+        ).values(
+            status='failed',
+            finished_at=datetime.utcnow(),
+            locked_by=None,
+            locked_at=None,
+            last_error='Superseded by a queued job with the same dedupe key'
+        ).execution_options(synchronize_session=False)
+    )
+    count = Job.query.filter(Job.status == 'running', Job.locked_at < cutoff).update(
+        {Job.status: 'queued', Job.locked_by: None, Job.locked_at: None},
+        synchronize_session=False
+    )
+    db.session.commit()
+    return count
+
+
+def purge_finished_jobs(older_than_seconds: int) -> int:
+    """Delete done jobs (failed ones are kept for inspection) finished before the cutoff."""
+    cutoff = datetime.utcnow() - timedelta(seconds=older_than_seconds)
+    count = Job.query.filter(Job.status == 'done', Job.finished_at < cutoff).delete(synchronize_session=False)
+    db.session.commit()
+    return count
+
+
+class JobWorkerPool:
+    """A pool of threads that claim and run queued jobs."""
+
+    def __init__(self, app, size: int = 2, poll_interval: float = 1.0,
+                 lock_timeout_seconds: int = 600, retention_seconds: int = 86400):
+        self.app = app
+        self.size = size
+        self.poll_interval = poll_interval
+        self.lock_timeout_seconds = lock_timeout_seconds
+        self.retention_seconds = retention_seconds
+        self.worker_id = f'{socket.gethostname()}:{os.getpid()}'
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        """Start the worker threads (and a housekeeping thread) as daemons."""
+        for i in range(self.size):
+            thread = threading.Thread(target=self._work, args=(f'{self.worker_id}:{i}',), daemon=True, name=f'job-worker-{i}')
+            thread.start()
+            self._threads.append(thread)
+        thread = threading.Thread(target=self._housekeeping, daemon=True, name='job-housekeeping')
+        thread.start()
+        self._threads.append(thread)
+        return self
+
+    def stop(self, timeout: Optional[float] = None):
+        """Ask the workers to stop after their current job and wait for them."""
+        self._stop.set()
+        _wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def _work(self, worker_id: str):
+        while not self._stop.is_set():
+            job = None
+            with self.app.app_context():
+                try:
+                    job = claim_job(worker_id)
+                    if job:
+                        run_job(job)
+                except Exception as e:
+                    print(f"ERROR: Job worker {worker_id}: {e}")
+                    print(traceback.format_exc())
+                    db.session.rollback()
+                finally:
+                    db.session.remove()
+            if job is None:
+                _wakeup.wait(self.poll_interval)
+                _wakeup.clear()
+
+    def _housekeeping(self):
+        while not self._stop.wait(60):
+            with self.app.app_context():
+                try:
+                    requeue_stale_jobs(self.lock_timeout_seconds)
+                    purge_finished_jobs(self.retention_seconds)
+                except Exception as e:
+                    print(f"ERROR: Job housekeeping: {e}")
+                    db.session.rollback()
+                finally:
+                    db.session.remove()
@@ -0,0 +1,134 @@
+"""
+Load-adaptive generation limits.
+Picks Ollama options (num_ctx, num_predict) for each reply from how many replies are
+being generated, the user's tier and the model's profile, so that under pressure long
+contexts and runaway answers can't starve everyone else. Limits shrink in steps
+(normal, busy, overloaded) and grow back once the load has stayed low for a while.
+"""
+import json
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+# Used when no limits file exists, and for models (and tiers) it doesn't name
+DEFAULT_LIMITS = {
+    'tiers': {'standard': 1.0, 'priority': 2.0},
+    'models': {
+        '*': {
+            'weight': 1.0,
+            'normal': {},
+            'busy': {'num_ctx': 4096, 'num_predict': 1024},
+            'overloaded': {'num_ctx': 2048, 'num_predict': 256}
+        }
+    }
+}
+
+
+def _merge(base: Dict, override: Dict) -> Dict:
+    # One level deep, so a profile can change a single limit of a level
+    return {**base, **{
+        key: {**base[key], **value} if isinstance(base.get(key), dict) else value
+        for key, value in override.items()
+    }}
+
+
+def load_limits_file(path: str) -> Dict:
+    """Read tier headroom and model profiles from a JSON file, on top of DEFAULT_LIMITS."""
+    try:
+        with open(path) as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        return DEFAULT_LIMITS
+    profiles = data.get('models', {})
+    default = _merge(DEFAULT_LIMITS['models']['*'], profiles.get('*', {}))
+    # Models only need to list what differs from the default profile
+    models = {name: _merge(default, profile) for name, profile in profiles.items()}
+    models['*'] = default
+    return {'tiers': {**DEFAULT_LIMITS['tiers'], **data.get('tiers', {})}, 'models': models}
+
+
+class LoadPolicy:
+    """
+    Decides the limits of new replies.
+
+    The load is the sum of the profile weights of every reply being generated (a fan-out
+    counts once per model), including the new ones. At busy_load it is 'busy', at
+    overloaded_load 'overloaded'; a tier's headroom multiplies both thresholds, so
+    'priority' users (2.0 by default) are limited later. The load used is the highest
+    seen in the last cooldown_seconds, so limits aren't restored (which makes Ollama
+    reload the model with the larger context) while the load is still going up and down.
+    """
+
+    def __init__(self, running_models: Callable[[], List[str]], limits: Dict,
+                 busy_load: float = 4, overloaded_load: float = 8, cooldown_seconds: float = 30):
+        self.running_models = running_models
+        self.tiers = limits['tiers']
+        self.profiles = limits['models']
+        self.busy_load = busy_load
+        self.overloaded_load = overloaded_load
+        self.cooldown_seconds = cooldown_seconds
+        self._peak = 0.0
+        self._peak_at = 0.0
+        self._lock = threading.Lock()
+
+    def profile(self, model: str) -> Dict:
+        """Return a model's profile: by full name, then by name without the tag, then the default."""
+        return self.profiles.get(model) or self.profiles.get(model.split(':')[0]) or self.profiles['*']
+
+    def current_load(self, models: List[str] = ()) -> float:
+        """Return the (held) load, counting models as if they had started too."""
+        load = sum(self.profile(model)['weight'] for model in list(self.running_models()) + list(models))
+        now = time.monotonic()
+        with self._lock:
+            if load >= self._peak or now - self._peak_at >= self.cooldown_seconds:
+                self._peak, self._peak_at = load, now
+            return self._peak
+
+    def level(self, load: float, tier: str) -> str:
+        """Return 'normal', 'busy' or 'overloaded' for a user of the given tier."""
+        headroom = self.tiers.get(tier, self.tiers['standard'])
+        if load >= self.overloaded_load * headroom:
+            return 'overloaded'
+        if load >= self.busy_load * headroom:
+            return 'busy'
+        return 'normal'
+
+    def limits(self, models: List[str], tier: str = 'standard') -> Tuple[str, Dict[str, Dict]]:
+        """
+        Return (level, {model: options}) for replies by models to a user of the given tier.
+        Options are empty at the normal level unless a profile sets them, so Ollama keeps
+        using the model's own defaults (and doesn't reload it) while there is no pressure.
+        """
+        level = self.level(self.current_load(models), tier)
+        return level, {model: dict(self.profile(model).get(level, {})) for model in models}
+
+
+def limits_notice(level: str, options: Dict[str, Dict]) -> Optional[Dict]:
+    """Return the SSE event telling the client its reply is limited, or None at the normal level."""
+    if level == 'normal':
+        return None
+    # With several models, describe the tightest limit
+    num_predict = min((o['num_predict'] for o in options.values() if o.get('num_predict', -1) > 0), default=None)
+    num_ctx = min((o['num_ctx'] for o in options.values() if o.get('num_ctx')), default=None)
+    details = []
+    if num_predict:
+        details.append(f"replies are limited to {num_predict} tokens")
+    if num_ctx:
+        details.append(f"only the last {num_ctx} tokens of the conversation are used")
+    message = 'The server is busy' if level == 'busy' else 'The server is overloaded'
+    if details:
+        message += ': ' + ' and '.join(details)
+    return {'notice': message + '.', 'level': level, 'limits': options}
+
+
+def create_policy(app, running_models: Callable[[], List[str]]) -> Optional[LoadPolicy]:
+    """Create the policy from the GENERATION_* settings, or None if ADAPTIVE_LIMITS is off."""
+    if not app.config.get('ADAPTIVE_LIMITS', True):
+        return None
+    return LoadPolicy(
+        running_models,
+        load_limits_file(app.config['GENERATION_LIMITS_FILE']),
+        busy_load=app.config.get('GENERATION_BUSY_LOAD', 4),
+        overloaded_load=app.config.get('GENERATION_OVERLOADED_LOAD', 8),
+        cooldown_seconds=app.config.get('GENERATION_LIMITS_COOLDOWN_SECONDS', 30)
+    )
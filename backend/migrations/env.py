@@ -94,17 +94,25 @@ def run_migrations_online():
     if conf_args.get("process_revision_directives") is None:
         conf_args["process_revision_directives"] = process_revision_directives
 
-    connectable = get_engine()
-
-    with connectable.connect() as connection:
-        context.configure(
-            connection=connection,
-            target_metadata=get_metadata(),
-            **conf_args
-        )
-
-        with context.begin_transaction():
-            context.run_migrations()
+    engines = [get_engine()]
+    # Shard databases (SHARD_COUNT > 0) share the schema, so every revision is
+    # applied to each of them too. Autogenerate only compares the main database.
+    if not getattr(config.cmd_opts, 'autogenerate', False):
+        engines += [
+            engine for key, engine in target_db.engines.items()
+            if key is not None and key.startswith('shard')
+        ]
+
+    for connectable in engines:
+        with connectable.connect() as connection:
+            context.configure(
+                connection=connection,
+                target_metadata=get_metadata(),
+                **conf_args
+            )
+
+            with context.begin_transaction():
+                context.run_migrations()
 
 
 if context.is_offline_mode():
@@ -0,0 +1,40 @@
+"""Add message_count and last_message_at to chats
+
+Revision ID: 3f9a1c7d2b84
+Revises: 56c2991ef1c5
+Create Date: 2025-11-20 10:02:31.418207
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f9a1c7d2b84'
+down_revision = '56c2991ef1c5'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('chats', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('message_count', sa.Integer(), server_default='0', nullable=False))
+        batch_op.add_column(sa.Column('last_message_at', sa.DateTime(), nullable=True))
+
+    # Backfill the counters from the existing messages
+    op.execute("""
+        UPDATE chats SET
+            message_count = (SELECT COUNT(*) FROM messages WHERE messages.chat_id = chats.id),
+            last_message_at = (SELECT MAX(created_at) FROM messages WHERE messages.chat_id = chats.id)
+    """)
+
+    op.create_index('ix_chats_user_empty', 'chats', ['user_id', 'created_at'], unique=False,
+                    sqlite_where=sa.text('message_count = 0'))
+
+
+def downgrade():
+    op.drop_index('ix_chats_user_empty', table_name='chats', sqlite_where=sa.text('message_count = 0'))
+
+    with op.batch_alter_table('chats', schema=None) as batch_op:
+        batch_op.drop_column('last_message_at')
+        batch_op.drop_column('message_count')
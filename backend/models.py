@@ -1,11 +1,38 @@
 """
 SQLAlchemy models for the chat application.
 """
+from flask import current_app
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session
+from contextvars import ContextVar
 from datetime import datetime
+import sqlalchemy as sa
 import uuid
 
-db = SQLAlchemy()
+# Tables partitioned per user when SHARD_COUNT > 0; everything else stays in the global DB
+SHARDED_TABLES = frozenset({
+    'chats', 'messages', 'user_settings', 'chat_archives', 'generation_contexts', 'usage_rollups', 'chat_events'
+})
+
+# Shard index of the user the current request or thread is working for (see database.use_shard)
+current_shard = ContextVar('current_shard', default=None)
+
+
+class ShardRoutingSession(Session):
+    """Session that sends queries on sharded tables to the current user's shard engine."""
+    
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and mapper is not None and current_app.config.get('SHARD_COUNT'):
+            table = sa.inspect(mapper).local_table
+            if table.name in SHARDED_TABLES:
+                shard = current_shard.get()
+                if shard is None:
+                    raise RuntimeError(f"No shard selected for query on '{table.name}'; wrap it in database.use_shard()")
+                return self._db.engines[f'shard{shard}']
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+db = SQLAlchemy(session_options={'class_': ShardRoutingSession})
 
 
 class Chat(db.Model):
@@ -18,19 +45,36 @@ class Chat(db.Model):
     model = db.Column(db.String(100), nullable=False, default='gemma3:1b')
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
+    # Denormalized counters, maintained by database.add_message/delete_message
+    message_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    last_message_at = db.Column(db.DateTime, nullable=True)
+    # Set while the chat's messages live compressed in chat_archives (see archive.py)
+    archived_at = db.Column(db.DateTime, nullable=True)
+    # Last message of the branch being shown and continued; the path to it is the transcript
+    active_leaf_id = db.Column(db.Integer, nullable=True)
+    
+    # Partial index so finding a user's empty chat is an index probe instead of an anti-join
+    __table_args__ = (
+        db.Index('ix_chats_user_empty', 'user_id', 'created_at', sqlite_where=db.text('message_count = 0')),
+    )
     
     # Relationship to messages
     messages = db.relationship('Message', backref='chat', lazy=True, cascade='all, delete-orphan', order_by='Message.sequence_order')
+    archive = db.relationship('ChatArchive', backref='chat', lazy=True, uselist=False, cascade='all, delete-orphan')
+    generation_context = db.relationship('GenerationContext', backref='chat', lazy=True, uselist=False, cascade='all, delete-orphan')
     
-    def to_dict(self):
-        """Convert chat to dictionary."""
+    def to_dict(self, messages=None):
+        """Convert chat to dictionary. Pass messages (dicts) to include those instead of all messages."""
         return {
             'id': self.id,
             'title': self.title,
             'model': self.model,
             'created_at': self.created_at.isoformat() if self.created_at else None,
             'updated_at': self.updated_at.isoformat() if self.updated_at else None,
-            'messages': [msg.to_dict() for msg in self.messages]
+            'message_count': self.message_count,
+            'last_message_at': self.last_message_at.isoformat() if self.last_message_at else None,
+            'active_leaf_id': self.active_leaf_id,
+            'messages': messages if messages is not None else [msg.to_dict() for msg in self.messages]
         }
 
 
@@ -40,26 +84,190 @@ class Message(db.Model):
     
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     chat_id = db.Column(db.String(36), db.ForeignKey('chats.id', ondelete='CASCADE'), nullable=False)
+    # Message this one follows; messages form a tree so edits and regenerations branch off
+    # without copying the shared history. NULL for the first message of a branch at the root
+    parent_id = db.Column(db.Integer, db.ForeignKey('messages.id', ondelete='CASCADE'), nullable=True)
     role = db.Column(db.String(20), nullable=False)  # 'user' or 'assistant'
     content = db.Column(db.Text, nullable=False)
     sequence_order = db.Column(db.Integer, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    # Inference accounting from Ollama's final chunk (assistant messages only; durations in ns)
+    model = db.Column(db.String(100), nullable=True)
+    prompt_eval_count = db.Column(db.Integer, nullable=True)
+    eval_count = db.Column(db.Integer, nullable=True)
+    prompt_eval_duration = db.Column(db.BigInteger, nullable=True)
+    eval_duration = db.Column(db.BigInteger, nullable=True)
+    load_duration = db.Column(db.BigInteger, nullable=True)
+    total_duration = db.Column(db.BigInteger, nullable=True)
+    usage_rolled_up = db.Column(db.Boolean, nullable=False, default=False, server_default=sa.false())
+    # Position in the chat's sequence of message changes: one more than the chat's highest
+    # whenever the message is added or its content changes, so clients can fetch just those
+    update_seq = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     
-    # Unique constraint on chat_id and sequence_order
-    __table_args__ = (db.UniqueConstraint('chat_id', 'sequence_order', name='uq_chat_sequence'),)
+    __table_args__ = (
+        # Unique constraint on chat_id and sequence_order (creation order across all branches)
+        db.UniqueConstraint('chat_id', 'sequence_order', name='uq_chat_sequence'),
+        db.Index('ix_messages_parent', 'parent_id'),
+        # Messages with usage the rollup job hasn't counted yet
+        db.Index('ix_messages_usage_pending', 'chat_id', sqlite_where=db.text('usage_rolled_up = 0 AND eval_count IS NOT NULL')),
+    )
     
     def to_dict(self):
         """Convert message to dictionary."""
         return {
             'id': self.id,
             'chat_id': self.chat_id,
+            'parent_id': self.parent_id,
             'role': self.role,
             'content': self.content,
             'sequence_order': self.sequence_order,
-            'created_at': self.created_at.isoformat() if self.created_at else None
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'model': self.model
         }
 
 
+class ChatArchive(db.Model):
+    """Compressed cold-storage copy of an inactive chat's messages."""
+    __tablename__ = 'chat_archives'
+    
+    chat_id = db.Column(db.String(36), db.ForeignKey('chats.id', ondelete='CASCADE'), primary_key=True)
+    codec = db.Column(db.String(10), nullable=False)  # 'zlib' or 'zstd'
+    data = db.Column(db.LargeBinary, nullable=False)
+    message_count = db.Column(db.Integer, nullable=False)
+    raw_size = db.Column(db.Integer, nullable=False)
+    compressed_size = db.Column(db.Integer, nullable=False)
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+
+class GenerationContext(db.Model):
+    """Ollama evaluation context after a chat's last reply, so the next turn only sends the new message."""
+    __tablename__ = 'generation_contexts'
+    
+    chat_id = db.Column(db.String(36), db.ForeignKey('chats.id', ondelete='CASCADE'), primary_key=True)
+    model = db.Column(db.String(100), nullable=False)
+    system_hash = db.Column(db.String(64), nullable=False)  # sha256 of the system prompt used
+    last_message_id = db.Column(db.Integer, nullable=False)  # assistant message the context ends with
+    message_count = db.Column(db.Integer, nullable=False)  # chat's message_count when saved
+    context = db.Column(db.LargeBinary, nullable=False)  # token ids packed as 32-bit ints
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
+
+
+class UsageRollup(db.Model):
+    """Hourly token and latency totals per user, chat and model, built by the usage.rollup job."""
+    __tablename__ = 'usage_rollups'
+    
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    # No foreign keys: usage stays accounted for after a chat is deleted
+    user_id = db.Column(db.String(36), nullable=False)
+    chat_id = db.Column(db.String(36), nullable=False)
+    model = db.Column(db.String(100), nullable=False)
+    bucket_start = db.Column(db.DateTime, nullable=False)  # Start of the hour
+    message_count = db.Column(db.Integer, nullable=False, default=0)
+    prompt_tokens = db.Column(db.BigInteger, nullable=False, default=0)
+    completion_tokens = db.Column(db.BigInteger, nullable=False, default=0)
+    prompt_eval_ns = db.Column(db.BigInteger, nullable=False, default=0)
+    eval_ns = db.Column(db.BigInteger, nullable=False, default=0)
+    total_ns = db.Column(db.BigInteger, nullable=False, default=0)
+    
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'chat_id', 'model', 'bucket_start', name='uq_usage_rollup'),
+        db.Index('ix_usage_rollups_user_bucket', 'user_id', 'bucket_start'),
+    )
+
+
+class ChatEvent(db.Model):
+    """Change to a user's chat list, streamed to clients by /api/chats/events (see database.record_chat_event)."""
+    __tablename__ = 'chat_events'
+    
+    # The id is the feed's version cursor. AUTOINCREMENT so ids of compacted events are never reused.
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    # No foreign keys: delete events outlive their chat
+    user_id = db.Column(db.String(36), nullable=False)
+    chat_id = db.Column(db.String(36), nullable=False)
+    event_type = db.Column(db.String(20), nullable=False)  # created, updated, title, deleted; reset (marker only)
+    data = db.Column(db.Text, nullable=False, default='{}')  # JSON chat summary (no messages)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    
+    __table_args__ = (
+        db.Index('ix_chat_events_user', 'user_id', 'id'),
+        db.Index('ix_chat_events_chat', 'chat_id'),
+        {'sqlite_autoincrement': True},
+    )
+
+
+class Job(db.Model):
+    """Background job queued for the worker pool (see jobs.py)."""
+    __tablename__ = 'jobs'
+    
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    job_type = db.Column(db.String(100), nullable=False)
+    payload = db.Column(db.Text, nullable=False, default='{}')  # JSON
+    user_id = db.Column(db.String(36), nullable=True)  # Selects the shard the handler runs against
+    priority = db.Column(db.Integer, nullable=False, default=0)  # Higher runs first
+    status = db.Column(db.String(20), nullable=False, default='queued')  # queued, running, done, failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=5)
+    dedupe_key = db.Column(db.String(255), nullable=True)
+    run_after = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    locked_by = db.Column(db.String(255), nullable=True)
+    locked_at = db.Column(db.DateTime, nullable=True)
+    last_error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    
+    __table_args__ = (
+        db.Index('ix_jobs_claim', 'status', 'priority', 'run_after'),
+        # Only one queued job per dedupe key; a running one may have started too early to cover a new enqueue
+        db.Index('uq_jobs_queued_dedupe', 'dedupe_key', unique=True, sqlite_where=db.text("status = 'queued'")),
+    )
+    
+    def to_dict(self):
+        """Convert job to dictionary."""
+        return {
+            'id': self.id,
+            'job_type': self.job_type,
+            'status': self.status,
+            'priority': self.priority,
+            'attempts': self.attempts,
+            'max_attempts': self.max_attempts,
+            'run_after': self.run_after.isoformat() if self.run_after else None,
+            'last_error': self.last_error,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
+        }
+
+
+class Generation(db.Model):
+    """A reply being streamed, registered so any backend process can follow or cancel it (see coordination.py)."""
+    __tablename__ = 'generations'
+    
+    id = db.Column(db.String(36), primary_key=True)
+    # Global like jobs, so a process can find a generation without knowing the user's shard
+    chat_id = db.Column(db.String(36), nullable=False)
+    user_id = db.Column(db.String(36), nullable=False)
+    models = db.Column(db.Text, nullable=False, default='[]')  # JSON list
+    status = db.Column(db.String(20), nullable=False, default='running')  # running, done, error, cancelled
+    worker = db.Column(db.String(255), nullable=False)  # host:pid of the process generating
+    cancel_requested = db.Column(db.Boolean, nullable=False, default=False)
+    event_count = db.Column(db.Integer, nullable=False, default=0)
+    started_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    heartbeat_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    
+    __table_args__ = (
+        db.Index('ix_generations_chat', 'chat_id', 'started_at'),
+    )
+
+
+class GenerationEvent(db.Model):
+    """One Server-Sent Event of a generation, numbered from 1."""
+    __tablename__ = 'generation_events'
+    
+    generation_id = db.Column(db.String(36), db.ForeignKey('generations.id', ondelete='CASCADE'), primary_key=True)
+    seq = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    data = db.Column(db.Text, nullable=False)  # JSON
+
+
 class User(db.Model):
     """User model for authentication."""
     __tablename__ = 'users'
@@ -71,6 +279,8 @@ class User(db.Model):
     picture = db.Column(db.String(500), nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     last_login = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    # Service tier; decides how much load the user's replies take before their limits shrink
+    tier = db.Column(db.String(20), nullable=False, default='standard', server_default='standard')
     
     # Relationship to chats
     chats = db.relationship('Chat', backref='user', lazy=True, cascade='all, delete-orphan')
@@ -82,6 +292,7 @@ class User(db.Model):
             'email': self.email,
             'name': self.name,
             'picture': self.picture,
+            'tier': self.tier,
             'created_at': self.created_at.isoformat() if self.created_at else None,
             'last_login': self.last_login.isoformat() if self.last_login else None
         }
@@ -120,3 +331,11 @@ class UserSettings(db.Model):
             'updated_at': self.updated_at.isoformat() if self.updated_at else None
         }
 
+
+class ShardAssignment(db.Model):
+    """Maps a user to the shard database holding their chats, messages and settings."""
+    __tablename__ = 'shard_map'
+    
+    user_id = db.Column(db.String(36), db.ForeignKey('users.id', ondelete='CASCADE'), primary_key=True)
+    shard = db.Column(db.Integer, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
@@ -0,0 +1,115 @@
+"""
+Fast JSON encoding for chat payloads.
+Chats and messages are read as plain row tuples (see database.py) and turned
+straight into dicts, then encoded with orjson when it is installed. The bytes
+are exactly what jsonify would produce, so clients and caches can't tell
+which encoder ran.
+"""
+import json
+from datetime import datetime
+from importlib.util import find_spec
+from typing import Callable, Dict, List, Optional
+from flask import current_app, jsonify
+
+# orjson is optional; the standard library encoder is always available. It is only looked
+# up at startup and imported by the first response that uses it.
+HAVE_ORJSON = find_spec('orjson') is not None
+
+
+def iso_timestamp(value: Optional[str]) -> Optional[str]:
+    """Turn a DateTime as stored in SQLite ('2025-11-14 21:14:04.708885') into datetime.isoformat() output."""
+    if value is None:
+        return None
+    if len(value) == 26 and value[10] == ' ' and value[19] == '.':
+        # isoformat() leaves out the fraction when there are no microseconds
+        return value[:10] + 'T' + (value[11:19] if value.endswith('.000000') else value[11:])
+    return datetime.fromisoformat(value).isoformat()
+
+
+def message_dict(row) -> Dict:
+    """Same dict as Message.to_dict, from a row of database.MESSAGE_COLUMNS."""
+    message_id, chat_id, parent_id, role, content, sequence_order, created_at, model = row
+    return {
+        'id': message_id,
+        'chat_id': chat_id,
+        'parent_id': parent_id,
+        'role': role,
+        'content': content,
+        'sequence_order': sequence_order,
+        'created_at': iso_timestamp(created_at),
+        'model': model
+    }
+
+
+def chat_summary(row) -> Dict:
+    """Chat.to_dict without messages, from a row of database.CHAT_COLUMNS."""
+    chat_id, title, model, created_at, updated_at, message_count, last_message_at, active_leaf_id, _ = row
+    return {
+        'id': chat_id,
+        'title': title,
+        'model': model,
+        'created_at': iso_timestamp(created_at),
+        'updated_at': iso_timestamp(updated_at),
+        'message_count': message_count,
+        'last_message_at': iso_timestamp(last_message_at),
+        'active_leaf_id': active_leaf_id
+    }
+
+
+def chat_dict(row, messages: List[Dict]) -> Dict:
+    """Same dict as Chat.to_dict(messages), from a row of database.CHAT_COLUMNS."""
+    result = chat_summary(row)
+    result['messages'] = messages
+    return result
+
+
+# Same settings as Flask's default JSON provider outside debug mode
+_stdlib_encoder = json.JSONEncoder(ensure_ascii=True, sort_keys=True, separators=(',', ':'))
+
+
+def encode_stdlib(obj) -> bytes:
+    """Encode with the json module."""
+    return _stdlib_encoder.encode(obj).encode('ascii')
+
+
+def encode_orjson(obj) -> bytes:
+    """Encode with orjson, matching encode_stdlib byte for byte."""
+    import orjson
+    try:
+        body = orjson.dumps(obj, option=orjson.OPT_SORT_KEYS)
+    except orjson.JSONEncodeError:
+        # e.g. lone surrogates or integers beyond 64 bits, which only json.dumps accepts
+        return encode_stdlib(obj)
+    if not body.isascii() or b'\x7f' in body:
+        # orjson writes UTF-8 (and DEL) where json.dumps(ensure_ascii=True) writes \u escapes.
+        # Escaping orjson's output in Python is several times slower than just using json.
+        return encode_stdlib(obj)
+    return body
+
+
+ENCODERS: Dict[str, Callable] = {'json': encode_stdlib}
+if HAVE_ORJSON:
+    ENCODERS['orjson'] = encode_orjson
+
+
+def get_encoder(name: str = 'auto') -> Callable:
+    """Return the encoder called name ('json', 'orjson', or 'auto' for the fastest one installed)."""
+    if name == 'auto':
+        name = 'orjson' if HAVE_ORJSON else 'json'
+    if name not in ENCODERS:
+        raise ValueError(f'Unknown or unavailable JSON encoder: {name}')
+    return ENCODERS[name]
+
+
+def json_response(obj):
+    """
+    Return the same response as jsonify(obj), encoded with the JSON_ENCODER from the config.
+    Only for payloads of strings, integers, booleans, None, lists and dicts.
+    """
+    provider = current_app.json
+    # Pretty-printed (debug) or otherwise customized output is left to Flask
+    if (provider.compact is None and current_app.debug) or provider.compact is False \
+            or not provider.sort_keys or not provider.ensure_ascii:
+        return jsonify(obj)
+    encode = get_encoder(current_app.config.get('JSON_ENCODER', 'auto'))
+    return current_app.response_class(encode(obj) + b'\n', mimetype=provider.mimetype)
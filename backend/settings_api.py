@@ -0,0 +1,43 @@
+"""
+Settings API blueprint: the current user's custom instructions.
+"""
+from flask import Blueprint, request, jsonify
+from flask_login import login_required, current_user
+from database import get_setting, set_setting
+
+bp = Blueprint('settings', __name__)
+
+@bp.route('/api/settings', methods=['GET', 'PUT', 'OPTIONS'])
+@login_required
+def handle_settings():
+    """Handle GET and PUT operations for user settings."""
+    if request.method == 'OPTIONS':
+        response = jsonify({})
+        response.headers.add('Access-Control-Allow-Origin', 'http://localhost:3000')
+        response.headers.add('Access-Control-Allow-Methods', 'GET, PUT, OPTIONS')
+        response.headers.add('Access-Control-Allow-Headers', 'Content-Type')
+        response.headers.add('Access-Control-Allow-Credentials', 'true')
+        return response
+    
+    user_id = current_user.get_id()
+    
+    if request.method == 'GET':
+        try:
+            custom_instructions = get_setting(user_id, 'custom_instructions', '')
+            return jsonify({
+                'custom_instructions': custom_instructions
+            })
+        except Exception as e:
+            return jsonify({'error': str(e)}), 500
+    
+    elif request.method == 'PUT':
+        try:
+            data = request.json
+            custom_instructions = data.get('custom_instructions', '')
+            set_setting(user_id, 'custom_instructions', custom_instructions)
+            return jsonify({
+                'message': 'Settings updated successfully',
+                'custom_instructions': custom_instructions
+            })
+        except Exception as e:
+            return jsonify({'error': str(e)}), 500
@@ -0,0 +1,40 @@
+"""
+Background job handlers.
+Each handler receives the job's JSON payload and runs in an app context on
+the job owner's shard (see jobs.py).
+"""
+from jobs import job_handler
+from models import Chat
+from database import get_chat, update_chat_title, rollup_usage
+
+
+@job_handler('chat.generate_title', concurrency=1, max_attempts=3)
+def generate_chat_title(payload):
+    """Replace a chat's placeholder title with a short model-written one."""
+    import ollama
+    chat = Chat.query.get(payload['chat_id'])
+    # Leave chats alone that were deleted or renamed by the user in the meantime
+    if not chat or chat.title != payload['initial_title']:
+        return
+
+    messages = get_chat(chat.id)['messages'][:2]
+    transcript = '\n\n'.join(f"{msg['role']}: {msg['content'][:2000]}" for msg in messages)
+    response = ollama.generate(
+        model=payload['model'],
+        prompt=(
+            'Write a short title (at most 6 words) for the following conversation. '
+            'Reply with the title only, without quotes.\n\n' + transcript
+        ),
+    )
+    lines = response.get('response', '').strip().splitlines()
+    title = lines[0].strip().strip('"') if lines else ''
+    if title:
+        update_chat_title(chat.id, title[:255])
+
+
+@job_handler('usage.rollup', concurrency=2, max_attempts=10)
+def rollup_user_usage(payload):
+    """Fold a user's new per-message token usage into the hourly rollups."""
+    # Batches are bounded, so keep going until the backlog is drained
+    while rollup_usage(payload['user_id']):
+        pass
@@ -0,0 +1,110 @@
+import json
+import os
+import sys
+
+import pytest
+from flask.testing import FlaskClient
+
+# The backend modules import each other by their top-level names (from models import db)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database  # noqa: E402
+from app import create_app  # noqa: E402
+from database import create_tables  # noqa: E402
+from models import db  # noqa: E402
+
+
+@pytest.fixture
+def app_config():
+    """Settings on top of the test defaults; override this fixture in a module to change them."""
+    return {}
+
+
+@pytest.fixture
+def app(tmp_path, app_config):
+    """An app on a scratch SQLite database, with its tables created and an app context pushed."""
+    config = {
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{tmp_path / "chats.db"}',
+        'SHARD_COUNT': 0,
+        'JOB_WORKERS': 0,
+        'TESTING': True,
+        # Change feed streams end quickly, so a test can read one to the end
+        'CHAT_EVENTS_MAX_SECONDS': 0.3,
+        'CHAT_EVENTS_POLL_SECONDS': 0.05,
+        **app_config
+    }
+    config.setdefault('SQLALCHEMY_BINDS', {
+        f'shard{i}': f'sqlite:///{tmp_path / f"chats_shard{i}.db"}' for i in range(config['SHARD_COUNT'])
+    })
+    app = create_app(config)
+    # Shard assignments are cached per process, but every test has its own shard map
+    database._shard_cache.clear()
+    with app.app_context():
+        create_tables()
+        yield app
+        db.session.remove()
+
+
+@pytest.fixture
+def user(app):
+    """A signed-up user (id 'user-1')."""
+    from models import User
+    db.session.add(User(id='user-1', google_id='google-user-1', email='user-1@example.com', name='User One'))
+    db.session.commit()
+    return 'user-1'
+
+
+class AppTestClient(FlaskClient):
+    """
+    Test client that runs every request in a fresh app context. The app fixture keeps one
+    pushed for the test itself, which requests would otherwise share (and with it g, where
+    Flask-Login caches the signed-in user, and the database session).
+    """
+
+    def open(self, *args, **kwargs):
+        with self.application.app_context():
+            return super().open(*args, **kwargs)
+
+
+def login(app, user_id):
+    """Return a test client with user_id signed in through Flask-Login's session."""
+    client = AppTestClient(app, app.response_class, use_cookies=True)
+    with client.session_transaction() as session:
+        session['_user_id'] = user_id
+        session['_fresh'] = True
+    return client
+
+
+@pytest.fixture
+def client(app, user):
+    return login(app, user)
+
+
+@pytest.fixture
+def replies(monkeypatch):
+    """
+    Stand in for Ollama on the streaming path: every reply is 'Reply N' (N counting from 1).
+    Returns the list of transcripts (message lists) the replies were generated for.
+    """
+    import chat_api
+    transcripts = []
+
+    def stream_reply(model, messages, context=None, reuse_context=True, options=None):
+        transcripts.append(messages)
+        yield 'content', f'Reply {len(transcripts)}'
+        yield 'done', {'done': True, 'eval_count': 2, 'prompt_eval_count': 5}
+
+    monkeypatch.setattr(chat_api, 'stream_reply', stream_reply)
+    return transcripts
+
+
+def read_feed(client, since=None, **headers):
+    """Read /api/chats/events to its end. Returns the (version, event) pairs it sent."""
+    url = '/api/chats/events' if since is None else f'/api/chats/events?since={since}'
+    body = client.get(url, headers=headers).get_data(as_text=True)
+    events = []
+    for block in body.split('\n\n'):
+        fields = dict(line.split(': ', 1) for line in block.splitlines() if not line.startswith(':'))
+        if 'data' in fields:
+            events.append((int(fields['id']), json.loads(fields['data'])))
+    return events
@@ -0,0 +1,67 @@
+import os
+
+from archive import archive_chat, enable_incremental_vacuum, get_archive_stats, incremental_vacuum
+from database import add_message, create_chat
+from models import db, Message
+
+
+def make_chat(user, *contents):
+    chat_id = create_chat(user, 'Archived')
+    for i, content in enumerate(contents):
+        add_message(chat_id, 'user' if i % 2 == 0 else 'assistant', content)
+    return chat_id
+
+
+def test_unchanged_ids_keep_the_etag_across_archiving(client, user):
+    chat_id = make_chat(user, 'Hello', 'Hi there')
+    first = client.get(f'/api/chats/{chat_id}')
+    assert archive_chat(chat_id)
+
+    response = client.get(f'/api/chats/{chat_id}', headers={'If-None-Match': first.headers['ETag']})
+    # Archiving isn't activity, and the restored messages kept their ids
+    assert response.status_code == 304
+    assert Message.query.filter_by(chat_id=chat_id).count() == 2
+
+
+def test_renumbered_messages_change_the_etag(client, user):
+    chat_id = make_chat(user, 'Hello', 'Hi there')
+    first = client.get(f'/api/chats/{chat_id}')
+    old_ids = [msg['id'] for msg in first.get_json()['messages']]
+    assert archive_chat(chat_id)
+    # With the archived rows gone, SQLite hands their ids to the next messages
+    other_id = make_chat(user, 'Another', 'Reply')
+    assert {msg.id for msg in Message.query.filter_by(chat_id=other_id)} == set(old_ids)
+
+    response = client.get(f'/api/chats/{chat_id}', headers={'If-None-Match': first.headers['ETag']})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != first.headers['ETag']
+    messages = response.get_json()['messages']
+    assert [msg['content'] for msg in messages] == ['Hello', 'Hi there']
+    assert not set(msg['id'] for msg in messages) & set(old_ids)
+    assert messages[1]['parent_id'] == messages[0]['id']
+
+    response = client.get(f'/api/chats/{chat_id}/messages', headers={'If-None-Match': first.headers['ETag']})
+    assert response.status_code == 200
+
+
+def test_vacuum_reports_the_bytes_it_reclaimed(app, user):
+    enable_incremental_vacuum()
+    chat_id = make_chat(user, *(os.urandom(2048).hex() for _ in range(40)))
+    assert archive_chat(chat_id)
+    db.session.remove()
+
+    stats = get_archive_stats()
+    assert stats['content_bytes_saved'] == stats['raw_bytes'] - stats['compressed_bytes']
+    assert stats['free_pages'] > 0
+    path = app.config['SQLALCHEMY_DATABASE_URI'][len('sqlite:///'):]
+    size_before = os.path.getsize(path)
+    page_size = stats['free_bytes'] // stats['free_pages']
+
+    reclaimed = incremental_vacuum(pages=10)
+    assert reclaimed == 10 * page_size
+    assert size_before - os.path.getsize(path) == reclaimed
+    assert get_archive_stats()['database_bytes'] == os.path.getsize(path)
+
+
+def test_vacuum_is_skipped_without_incremental_auto_vacuum(app):
+    assert incremental_vacuum() is None
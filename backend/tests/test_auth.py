@@ -0,0 +1,149 @@
+import datetime
+import time
+
+import pytest
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.x509.oid import NameOID
+from google.auth import crypt, jwt
+
+from auth import GoogleTokenVerifier
+from conftest import AppTestClient
+
+CLIENT_ID = 'test-client.apps.googleusercontent.com'
+
+
+def make_key(kid):
+    """Return (signer, PEM certificate) for a fresh RSA key."""
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, kid)])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(days=1))
+        .not_valid_after(now + datetime.timedelta(days=1))
+        .sign(key, hashes.SHA256())
+    )
+    pem = key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption())
+    signer = crypt.RSASigner.from_string(pem, key_id=kid)
+    return signer, cert.public_bytes(serialization.Encoding.PEM).decode()
+
+
+@pytest.fixture(scope='module')
+def key():
+    return make_key('key-1')
+
+
+def make_token(signer, sub='google-user-9', **claims):
+    now = int(time.time())
+    payload = {
+        'iss': 'https://accounts.google.com',
+        'aud': CLIENT_ID,
+        'sub': sub,
+        'email': f'{sub}@example.com',
+        'iat': now,
+        'exp': now + 3600,
+        **claims
+    }
+    return jwt.encode(signer, payload).decode()
+
+
+class Fetcher:
+    """Stands in for Google's certificate endpoint and counts the downloads."""
+
+    def __init__(self, certs, on_fetch=None):
+        self.certs = certs
+        self.on_fetch = on_fetch
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.on_fetch:
+            self.on_fetch()
+        return dict(self.certs), 3600
+
+
+def test_verified_tokens_are_served_from_the_cache(key, monkeypatch):
+    signer, cert = key
+    fetcher = Fetcher({'key-1': cert})
+    verifier = GoogleTokenVerifier(CLIENT_ID, fetch_certs=fetcher)
+    token = make_token(signer)
+
+    assert verifier.verify(token)['sub'] == 'google-user-9'
+    decodes = []
+    monkeypatch.setattr(jwt, 'decode', lambda *args, **kwargs: decodes.append(args))
+    assert verifier.verify(token)['sub'] == 'google-user-9'
+    assert decodes == []
+    assert fetcher.calls == 1
+
+
+def test_unknown_key_ids_force_at_most_one_refresh_per_interval(key):
+    signer, cert = key
+    fetcher = Fetcher({'key-1': cert})
+    verifier = GoogleTokenVerifier(CLIENT_ID, fetch_certs=fetcher, forced_refresh_interval=60)
+    verifier.verify(make_token(signer))
+    assert fetcher.calls == 1
+
+    stranger, _ = make_key('key-unknown')
+    for sub in ('a', 'b', 'c'):
+        with pytest.raises(ValueError):
+            verifier.verify(make_token(stranger, sub=sub))
+    # The first unknown key id refreshed the certificates; the rest were rate-limited
+    assert fetcher.calls == 2
+
+
+def test_a_rotated_key_is_picked_up_by_the_forced_refresh(key):
+    signer, cert = key
+    rotated, rotated_cert = make_key('key-2')
+    fetcher = Fetcher({'key-1': cert})
+    verifier = GoogleTokenVerifier(CLIENT_ID, fetch_certs=fetcher)
+    verifier.verify(make_token(signer))
+
+    fetcher.certs = {'key-1': cert, 'key-2': rotated_cert}
+    assert verifier.verify(make_token(rotated))['sub'] == 'google-user-9'
+    assert fetcher.calls == 2
+
+
+def test_certificates_are_fetched_outside_the_lock(key):
+    signer, cert = key
+    held = []
+
+    def check_lock():
+        # Cached tokens must still be served while a download is in flight
+        acquired = verifier._lock.acquire(timeout=1)
+        held.append(not acquired)
+        if acquired:
+            verifier._lock.release()
+
+    verifier = GoogleTokenVerifier(CLIENT_ID, fetch_certs=Fetcher({'key-1': cert}, on_fetch=check_lock))
+    verifier.verify(make_token(signer))
+    verifier.get_certs(force_refresh=True)
+    assert held == [False, False]
+
+
+def test_wrong_audience_is_rejected(key):
+    signer, cert = key
+    verifier = GoogleTokenVerifier(CLIENT_ID, certs={'key-1': cert})
+    with pytest.raises(ValueError):
+        verifier.verify(make_token(signer, aud='someone-else'))
+
+
+@pytest.fixture
+def app_config(key):
+    return {'GOOGLE_CLIENT_ID': CLIENT_ID, 'GOOGLE_CERTS': {'key-1': key[1]}}
+
+
+def test_login_uses_the_configured_certificates(app, key):
+    client = AppTestClient(app, app.response_class, use_cookies=True)
+    response = client.post('/api/auth/login', json={'token': make_token(key[0])})
+    assert response.status_code == 200
+    assert response.get_json()['user']['email'] == 'google-user-9@example.com'
+
+    stranger, _ = make_key('key-unknown')
+    response = client.post('/api/auth/login', json={'token': make_token(stranger)})
+    assert response.status_code == 401
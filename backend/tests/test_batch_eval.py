@@ -0,0 +1,114 @@
+import importlib.util
+import json
+import os
+import subprocess
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+SCRIPT = os.path.join(REPO_DIR, 'gemma3_stream.py')
+
+
+def load_script():
+    spec = importlib.util.spec_from_file_location('gemma3_stream', SCRIPT)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class FakeOllama(BaseHTTPRequestHandler):
+    """/api/chat that streams 'Answer to <prompt>' in two chunks, or fails for prompts containing FAIL."""
+    requests = []
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        prompt = body['messages'][-1]['content']
+        self.requests.append((self.path, body['model'], prompt))
+        if 'FAIL' in prompt:
+            self.send_response(500)
+            self.send_header('Content-Type', 'application/json')
+            self.end_headers()
+            self.wfile.write(b'{"error": "model crashed"}')
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.end_headers()
+        for chunk in ('Answer to ', prompt):
+            self.wfile.write(json.dumps({'message': {'role': 'assistant', 'content': chunk}, 'done': False}).encode() + b'\n')
+        final = {'message': {'role': 'assistant', 'content': ''}, 'done': True,
+                 'eval_count': 2, 'prompt_eval_count': 4, 'eval_duration': 10**8}
+        self.wfile.write(json.dumps(final).encode() + b'\n')
+
+
+@pytest.fixture
+def ollama_host():
+    FakeOllama.requests = []
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakeOllama)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f'http://127.0.0.1:{server.server_address[1]}'
+    server.shutdown()
+
+
+def run_batch(host, prompts, output):
+    return subprocess.run(
+        [sys.executable, SCRIPT, '--batch', str(prompts), '--output', str(output), '--host', host,
+         '--model', 'fake:1b', '--concurrency', '2'],
+        capture_output=True, text=True, timeout=60
+    )
+
+
+def results(output):
+    with open(output, encoding='utf-8') as f:
+        return [json.loads(line) for line in f]
+
+
+def test_batch_records_errors_and_resumes(ollama_host, tmp_path):
+    prompts = tmp_path / 'prompts.jsonl'
+    output = tmp_path / 'results.jsonl'
+    prompts.write_text('\n'.join(json.dumps(record) for record in [
+        {'id': 'a', 'prompt': 'one'},
+        {'id': 'b', 'prompt': 'FAIL two'},
+        {'id': 'c', 'title': 'Three', 'body': 'three'},
+    ]) + '\n')
+
+    run = run_batch(ollama_host, prompts, output)
+    # A failed prompt is recorded and the others still run; the exit status reports it
+    assert run.returncode == 1, run.stderr
+    by_id = {result['id']: result for result in results(output)}
+    assert set(by_id) == {'a', 'b', 'c'}
+    assert by_id['a']['response'] == 'Answer to one'
+    assert by_id['a']['eval_count'] == 2 and by_id['a']['tokens_per_s'] == 20.0
+    assert by_id['c']['response'] == 'Answer to Three\n\nthree'
+    assert 'model crashed' in by_id['b']['error']
+    # --host and --model reach the server
+    assert {(path, model) for path, model, _ in FakeOllama.requests} == {('/api/chat', 'fake:1b')}
+
+    # Rerunning only retries the failed prompt
+    FakeOllama.requests = []
+    run = run_batch(ollama_host, prompts, output)
+    assert run.returncode == 1
+    assert [prompt for _, _, prompt in FakeOllama.requests] == ['FAIL two']
+    assert '3 prompts, 2 already done, running 1' in run.stdout
+
+
+def test_completed_ids_skip_lines_that_are_not_results(tmp_path):
+    output = tmp_path / 'results.jsonl'
+    output.write_text('\n'.join([
+        json.dumps({'id': 'a', 'response': 'ok'}),
+        json.dumps({'id': 'b', 'error': 'boom'}),
+        json.dumps({'response': 'no id'}),
+        '[]',
+        '"x"',
+        '{"id": "c", "respo',  # Cut off by an interrupted run
+    ]) + '\n')
+    assert load_script().load_completed_ids(str(output)) == {'a'}
+
+
+def test_missing_output_file_means_nothing_done(tmp_path):
+    assert load_script().load_completed_ids(str(tmp_path / 'missing.jsonl')) == set()
@@ -0,0 +1,144 @@
+from conftest import login
+from database import add_message, delete_message, get_chat
+from models import db, Chat, Message, User
+
+
+def send(client, message, chat_id=None):
+    """Post a message and read the whole reply stream. Returns the chat id."""
+    response = client.post('/api/chat', json={'message': message, 'chat_id': chat_id})
+    assert response.status_code == 200
+    response.get_data()
+    return chat_id or Chat.query.filter_by(user_id='user-1').order_by(Chat.created_at.desc()).first().id
+
+
+def branch(client, chat_id, message_id, action, **data):
+    response = client.post(f'/api/chats/{chat_id}/messages/{message_id}/{action}', json=data)
+    response.get_data()
+    return response
+
+
+def shown(client, chat_id):
+    """The chat's active branch as (role, content) pairs, and the chat."""
+    chat = client.get(f'/api/chats/{chat_id}').get_json()
+    return [(msg['role'], msg['content']) for msg in chat['messages']], chat
+
+
+def ids(chat_id):
+    """Message ids by content."""
+    db.session.expire_all()
+    return {msg.content: msg.id for msg in Message.query.filter_by(chat_id=chat_id)}
+
+
+def test_replies_follow_the_active_branch(client, replies):
+    chat_id = send(client, 'First')
+    send(client, 'Second', chat_id)
+
+    messages, chat = shown(client, chat_id)
+    assert messages == [('user', 'First'), ('assistant', 'Reply 1'), ('user', 'Second'), ('assistant', 'Reply 2')]
+    assert chat['active_leaf_id'] == ids(chat_id)['Reply 2']
+    # The second reply only saw its own branch
+    assert [msg['content'] for msg in replies[1]] == ['First', 'Reply 1', 'Second']
+
+
+def test_edit_root_message_starts_a_new_branch(client, replies):
+    chat_id = send(client, 'First')
+    send(client, 'Second', chat_id)
+
+    response = branch(client, chat_id, ids(chat_id)['First'], 'edit', content='First, edited')
+    assert response.status_code == 200
+
+    messages, chat = shown(client, chat_id)
+    assert messages == [('user', 'First, edited'), ('assistant', 'Reply 3')]
+    # The reply to the edit starts from scratch
+    assert [msg['content'] for msg in replies[2]] == ['First, edited']
+    message_ids = ids(chat_id)
+    assert chat['messages'][0]['parent_id'] is None
+    assert chat['messages'][0]['sibling_ids'] == [message_ids['First'], message_ids['First, edited']]
+    # The old branch is kept
+    assert chat['message_count'] == 6
+
+
+def test_edit_assistant_message_does_not_generate(client, replies):
+    chat_id = send(client, 'First')
+    response = branch(client, chat_id, ids(chat_id)['Reply 1'], 'edit', content='Better reply')
+    assert response.status_code == 201
+    assert response.get_json()['parent_id'] == ids(chat_id)['First']
+    assert len(replies) == 1
+    assert shown(client, chat_id)[0] == [('user', 'First'), ('assistant', 'Better reply')]
+
+
+def test_regenerate_user_and_assistant_messages(client, replies):
+    chat_id = send(client, 'First')
+    send(client, 'Second', chat_id)
+    message_ids = ids(chat_id)
+
+    # From the assistant message: another answer to the user message before it
+    assert branch(client, chat_id, message_ids['Reply 2'], 'regenerate').status_code == 200
+    # From the user message: the same
+    assert branch(client, chat_id, message_ids['Second'], 'regenerate').status_code == 200
+
+    assert [msg['content'] for msg in replies[2]] == ['First', 'Reply 1', 'Second']
+    assert [msg['content'] for msg in replies[3]] == ['First', 'Reply 1', 'Second']
+    messages, chat = shown(client, chat_id)
+    assert messages[-1] == ('assistant', 'Reply 4')
+    message_ids = ids(chat_id)
+    assert chat['messages'][-1]['sibling_ids'] == [message_ids['Reply 2'], message_ids['Reply 3'], message_ids['Reply 4']]
+
+
+def test_regenerate_assistant_message_without_parent_is_rejected(client, replies):
+    chat_id = send(client, 'First')
+    orphan_id = add_message(chat_id, 'assistant', 'Orphan', parent_id=None)
+
+    response = branch(client, chat_id, orphan_id, 'regenerate')
+    assert response.status_code == 400
+    assert len(replies) == 1
+
+
+def test_branch_on_missing_message_or_other_users_chat(app, client, replies):
+    chat_id = send(client, 'First')
+    assert branch(client, chat_id, 9999, 'regenerate').status_code == 404
+    assert branch(client, 'no-such-chat', 1, 'regenerate').status_code == 404
+
+    db.session.add(User(id='user-2', google_id='google-user-2', email='user-2@example.com'))
+    db.session.commit()
+    other = login(app, 'user-2')
+    assert branch(other, chat_id, ids(chat_id)['First'], 'regenerate').status_code == 403
+    assert len(replies) == 1
+
+
+def test_switching_branches_continues_to_the_newest_leaf(client, replies):
+    chat_id = send(client, 'First')
+    send(client, 'Second', chat_id)
+    branch(client, chat_id, ids(chat_id)['First'], 'edit', content='Other first')
+    send(client, 'Other second', chat_id)
+    message_ids = ids(chat_id)
+
+    # Picking the first question shows its branch down to that branch's newest message
+    response = client.put(f'/api/chats/{chat_id}', json={'active_message_id': message_ids['First']})
+    assert response.get_json()['active_leaf_id'] == message_ids['Reply 2']
+    assert shown(client, chat_id)[0][-1] == ('assistant', 'Reply 2')
+
+    # New messages continue the branch being shown
+    send(client, 'Third', chat_id)
+    assert [msg['content'] for msg in replies[-1]] == ['First', 'Reply 1', 'Second', 'Reply 2', 'Third']
+
+    response = client.put(f'/api/chats/{chat_id}', json={'active_message_id': message_ids['Other first']})
+    assert response.get_json()['active_leaf_id'] == message_ids['Reply 4']
+    assert client.put(f'/api/chats/{chat_id}', json={'active_message_id': 9999}).status_code == 404
+
+
+def test_delete_message_removes_its_replies(client, replies):
+    chat_id = send(client, 'First')
+    send(client, 'Second', chat_id)
+    branch(client, chat_id, ids(chat_id)['Second'], 'regenerate')
+    message_ids = ids(chat_id)
+
+    assert delete_message(message_ids['Second'])
+
+    assert set(ids(chat_id)) == {'First', 'Reply 1'}
+    chat = get_chat(chat_id)
+    # The active branch went away, so the chat falls back to the deleted message's parent
+    assert chat['active_leaf_id'] == message_ids['Reply 1']
+    assert chat['message_count'] == 2
+    assert [msg['content'] for msg in chat['messages']] == ['First', 'Reply 1']
+    assert not delete_message(message_ids['Second'])
@@ -0,0 +1,97 @@
+from conftest import login, read_feed
+from database import (
+    add_message, create_chat, get_chat_version, update_chat_title, update_message_content, update_messages_content
+)
+from models import db, User
+
+
+def list_version(client):
+    response = client.get('/api/chats')
+    assert response.status_code == 200
+    return int(response.headers['X-Chat-Version'])
+
+
+def test_version_only_moves_on_final_saves(client):
+    chat_id = create_chat('user-1', 'Chat')
+    add_message(chat_id, 'user', 'Hi')
+    reply_id = add_message(chat_id, 'assistant', 'He')
+    version = list_version(client)
+    assert version == get_chat_version('user-1') > 0
+
+    # Saves while a reply streams don't go to the feed
+    update_message_content(reply_id, 'Hell', final=False)
+    update_messages_content({reply_id: 'Hello'}, final=False)
+    assert list_version(client) == version
+    assert read_feed(client, since=version) == []
+
+    update_message_content(reply_id, 'Hello!')
+    assert list_version(client) > version
+    (new_version, event), = read_feed(client, since=version)
+    assert new_version == list_version(client)
+    assert event['type'] == 'updated' and event['chat_id'] == chat_id
+
+
+def test_streamed_reply_sends_creation_and_completion_only(client, replies):
+    version = list_version(client)
+    response = client.post('/api/chat', json={'message': 'x' * 60})
+    response.get_data()
+
+    events = read_feed(client, since=version)
+    # Only the newest event per chat is kept, however many changes there were
+    assert len(events) == 1
+    assert events[0][1]['type'] == 'updated'
+    assert events[0][1]['chat']['message_count'] == 2
+
+
+def test_catching_up_sends_each_changed_chat_once_in_version_order(client):
+    first = create_chat('user-1', 'First')
+    second = create_chat('user-1', 'Second')
+    version = list_version(client)
+    update_chat_title(first, 'First, renamed')
+    update_chat_title(second, 'Second, renamed')
+    update_chat_title(first, 'First, renamed again')
+
+    events = read_feed(client, since=version)
+    assert [(event['chat_id'], event['type']) for _, event in events] == [(second, 'title'), (first, 'title')]
+    assert events[-1][1]['chat']['title'] == 'First, renamed again'
+    versions = [v for v, _ in events]
+    assert versions == sorted(versions) and versions[-1] == list_version(client)
+
+
+def test_compacted_events_are_not_a_stale_cursor(client):
+    chat_id = create_chat('user-1', 'Chat')
+    version = list_version(client)
+    # Replaces the event at version, so the client's cursor is older than every event left
+    update_chat_title(chat_id, 'Renamed')
+
+    events = read_feed(client, since=version)
+    assert [event['type'] for _, event in events] == ['title']
+
+
+def test_unknown_cursor_is_told_to_refetch(client):
+    create_chat('user-1', 'Chat')
+    version = list_version(client)
+
+    (reset_version, event), = read_feed(client, since=version + 100)
+    assert event == {'type': 'reset', 'version': version}
+    assert reset_version == version
+    # Last-Event-ID (EventSource reconnecting) is checked the same way
+    assert read_feed(client, **{'Last-Event-ID': str(version + 100)})[0][1]['type'] == 'reset'
+
+
+def test_feed_only_has_the_users_own_chats(app, client):
+    db.session.add(User(id='user-2', google_id='google-user-2', email='user-2@example.com'))
+    db.session.commit()
+    other = login(app, 'user-2')
+
+    mine = create_chat('user-1', 'Mine')
+    version = list_version(client)
+    other_version = list_version(other)
+    theirs = create_chat('user-2', 'Theirs')
+    update_chat_title(theirs, 'Still theirs')
+
+    # Other users' changes neither show up nor move this user's version
+    assert [(v, event['chat_id']) for v, event in read_feed(client, since=0)] == [(version, mine)]
+    assert list_version(client) == version
+    assert [event['chat_id'] for _, event in read_feed(other, since=other_version)] == [theirs]
+    assert list_version(other) > version
@@ -0,0 +1,54 @@
+from database import add_message, create_chat, update_message_content
+
+
+def fetch(client, chat_id, **params):
+    response = client.get(f'/api/chats/{chat_id}/messages', query_string=params)
+    assert response.status_code == 200
+    return response.get_json()
+
+
+def test_after_seq_returns_the_tail(client, user):
+    chat_id = create_chat(user, 'Tail')
+    add_message(chat_id, 'user', 'Hello')
+    add_message(chat_id, 'assistant', 'Hi')
+    first = fetch(client, chat_id)
+    assert [msg['content'] for msg in first['messages']] == ['Hello', 'Hi']
+
+    add_message(chat_id, 'user', 'More')
+    tail = fetch(client, chat_id, after_seq=first['messages'][-1]['sequence_order'])
+    assert [msg['content'] for msg in tail['messages']] == ['More']
+    assert tail['update_seq'] > first['update_seq']
+
+
+def test_updated_after_includes_messages_changed_in_place(client, user):
+    chat_id = create_chat(user, 'Streaming')
+    add_message(chat_id, 'user', 'Hello')
+    reply_id = add_message(chat_id, 'assistant', '')
+    update_message_content(reply_id, 'Partial', final=False)
+    first = fetch(client, chat_id)
+    after_seq = first['messages'][-1]['sequence_order']
+
+    update_message_content(reply_id, 'Partial reply, finished')
+    # The tail alone misses the change to a message the client already has
+    assert fetch(client, chat_id, after_seq=after_seq)['messages'] == []
+    changed = fetch(client, chat_id, after_seq=after_seq, updated_after=first['update_seq'])
+    assert [(msg['id'], msg['content']) for msg in changed['messages']] == [(reply_id, 'Partial reply, finished')]
+
+    # Nothing changed since this response
+    assert fetch(client, chat_id, after_seq=after_seq, updated_after=changed['update_seq'])['messages'] == []
+
+
+def test_if_none_match_skips_unchanged_chats(client, user):
+    chat_id = create_chat(user, 'Cached')
+    add_message(chat_id, 'user', 'Hello')
+    first = client.get(f'/api/chats/{chat_id}/messages')
+    # Cross-origin clients can only read the ETag if it is exposed
+    assert 'ETag' in first.headers['Access-Control-Expose-Headers']
+
+    response = client.get(f'/api/chats/{chat_id}/messages?after_seq=0', headers={'If-None-Match': first.headers['ETag']})
+    assert response.status_code == 304
+
+    add_message(chat_id, 'assistant', 'Hi')
+    response = client.get(f'/api/chats/{chat_id}/messages?after_seq=0', headers={'If-None-Match': first.headers['ETag']})
+    assert response.status_code == 200
+    assert [msg['content'] for msg in response.get_json()['messages']] == ['Hi']
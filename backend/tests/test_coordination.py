@@ -0,0 +1,36 @@
+import pytest
+
+from coordination import MemoryBroker, SQLiteBroker
+from database import create_chat
+from models import db
+
+
+def journal_mode():
+    with db.engine.connect() as connection:
+        return connection.exec_driver_sql('PRAGMA journal_mode').scalar()
+
+
+@pytest.fixture(autouse=True)
+def no_flusher(monkeypatch):
+    # The flusher thread would outlive the test's database
+    monkeypatch.setattr(SQLiteBroker, '_flush_loop', lambda self: None)
+
+
+def test_memory_broker_keeps_the_journal_mode(app, user):
+    assert isinstance(app.extensions['generation_broker'], MemoryBroker)
+    app.extensions['generation_broker'].start(create_chat(user, 'Chat'), user, ['gemma3:1b'])
+    assert journal_mode() == 'delete'
+
+
+@pytest.mark.parametrize('app_config', [{'GENERATION_BROKER': 'sqlite'}])
+def test_sqlite_broker_switches_to_wal(app, user):
+    broker = app.extensions['generation_broker']
+    assert journal_mode() == 'delete'
+    broker.start(create_chat(user, 'Chat'), user, ['gemma3:1b'])
+    assert journal_mode() == 'wal'
+
+
+@pytest.mark.parametrize('app_config', [{'GENERATION_BROKER': 'sqlite', 'GENERATION_BROKER_WAL': False}])
+def test_sqlite_broker_wal_can_be_turned_off(app, user):
+    app.extensions['generation_broker'].start(create_chat(user, 'Chat'), user, ['gemma3:1b'])
+    assert journal_mode() == 'delete'
@@ -0,0 +1,140 @@
+import ollama
+import pytest
+
+import generation
+from database import (
+    add_message, add_sibling_messages, create_chat, get_generation_context, save_generation_context
+)
+from models import db, GenerationContext, User
+
+MODEL = 'gemma3:1b'
+SYSTEM = 'Be brief.'
+CONTEXT = [101, 102, 103]
+
+
+@pytest.fixture
+def chat(app):
+    """A chat with one exchange and the context saved after its reply: (chat_id, question_id, reply_id)."""
+    db.session.add(User(id='user-1', google_id='google-1', email='user-1@example.com'))
+    db.session.commit()
+    chat_id = create_chat('user-1', 'Test')
+    question_id = add_message(chat_id, 'user', 'Hi')
+    reply_id = add_message(chat_id, 'assistant', 'Hello')
+    save_generation_context(chat_id, MODEL, SYSTEM, reply_id, CONTEXT)
+    return chat_id, question_id, reply_id
+
+
+def saved(chat_id):
+    return db.session.get(GenerationContext, chat_id)
+
+
+def test_context_is_reused_for_the_next_user_message(chat):
+    chat_id, _, _ = chat
+    next_id = add_message(chat_id, 'user', 'And then?')
+    assert get_generation_context(chat_id, MODEL, SYSTEM, next_id) == CONTEXT
+    assert saved(chat_id) is not None
+
+
+def test_user_message_on_another_parent_drops_the_context(chat):
+    chat_id, question_id, _ = chat
+    # Follows the first question instead of the reply the context ends with
+    other_id = add_message(chat_id, 'user', 'Sideways', parent_id=question_id)
+    assert get_generation_context(chat_id, MODEL, SYSTEM, other_id) is None
+    assert saved(chat_id) is None
+
+
+def test_changed_system_prompt_drops_the_context(chat):
+    chat_id, _, _ = chat
+    next_id = add_message(chat_id, 'user', 'And then?')
+    assert get_generation_context(chat_id, MODEL, 'Be verbose.', next_id) is None
+    assert saved(chat_id) is None
+
+
+def test_different_model_drops_the_context(chat):
+    chat_id, _, _ = chat
+    next_id = add_message(chat_id, 'user', 'And then?')
+    assert get_generation_context(chat_id, 'llama3:8b', SYSTEM, next_id) is None
+    assert saved(chat_id) is None
+
+
+def test_edited_user_message_drops_the_context(chat):
+    chat_id, _, _ = chat
+    # What the edit endpoint stores: a sibling of the edited message, at the root here
+    edited_id = add_message(chat_id, 'user', 'Hi there', parent_id=None)
+    assert get_generation_context(chat_id, MODEL, SYSTEM, edited_id) is None
+
+
+def test_edited_reply_drops_the_context(chat):
+    chat_id, question_id, _ = chat
+    add_message(chat_id, 'assistant', 'Hello!', parent_id=question_id)
+    next_id = add_message(chat_id, 'user', 'And then?')
+    assert get_generation_context(chat_id, MODEL, SYSTEM, next_id) is None
+
+
+def test_fan_out_drops_the_context(chat):
+    chat_id, question_id, _ = chat
+    add_sibling_messages(chat_id, 'assistant', [MODEL, 'llama3:8b'], question_id)
+    assert saved(chat_id) is None
+
+
+@pytest.fixture
+def ollama_calls(monkeypatch):
+    """Record which Ollama endpoint stream_reply uses, answering 'ok' with a new context."""
+    calls = []
+
+    def fake_generate(model, prompt, system, context, options=None):
+        calls.append(('generate', prompt, system, context))
+        yield 'content', 'ok'
+        yield 'done', {'done': True, 'context': [1, 2]}
+
+    def fake_chat(model, messages, options=None):
+        calls.append(('chat', messages))
+        yield 'content', 'ok'
+        yield 'done', {'done': True}
+
+    monkeypatch.setattr(generation, '_stream_generate', fake_generate)
+    monkeypatch.setattr(generation, '_stream_chat', fake_chat)
+    return calls
+
+
+TRANSCRIPT = [
+    {'role': 'system', 'content': SYSTEM},
+    {'role': 'user', 'content': 'Hi'},
+    {'role': 'assistant', 'content': 'Hello'},
+    {'role': 'user', 'content': 'And then?'},
+]
+
+
+def test_saved_context_sends_only_the_new_message(ollama_calls):
+    list(generation.stream_reply(MODEL, TRANSCRIPT, context=CONTEXT))
+    assert ollama_calls == [('generate', 'And then?', SYSTEM, CONTEXT)]
+
+
+def test_missing_context_sends_the_transcript_once_and_gets_a_new_one(ollama_calls):
+    chunks = list(generation.stream_reply(MODEL, TRANSCRIPT, context=None))
+    assert chunks[-1] == ('done', {'done': True, 'context': [1, 2]})
+    (endpoint, prompt, system, context), = ollama_calls
+    assert (endpoint, system, context) == ('generate', SYSTEM, None)
+    assert 'User: Hi' in prompt and 'Assistant: Hello' in prompt
+    assert prompt.endswith('And then?')
+
+
+def test_first_turn_prompt_is_the_message_itself(ollama_calls):
+    list(generation.stream_reply(MODEL, [{'role': 'user', 'content': 'Hi'}]))
+    assert ollama_calls == [('generate', 'Hi', None, None)]
+
+
+def test_context_reuse_off_uses_chat(ollama_calls):
+    list(generation.stream_reply(MODEL, TRANSCRIPT, context=CONTEXT, reuse_context=False))
+    assert ollama_calls == [('chat', TRANSCRIPT)]
+
+
+def test_generate_error_before_output_falls_back_to_chat(ollama_calls, monkeypatch):
+    def failing_generate(model, prompt, system, context, options=None):
+        raise ollama.ResponseError('context too long')
+        yield
+
+    monkeypatch.setattr(generation, '_stream_generate', failing_generate)
+    chunks = list(generation.stream_reply(MODEL, TRANSCRIPT, context=CONTEXT))
+    assert chunks == [('content', 'ok'), ('done', {'done': True})]
+    assert ollama_calls == [('chat', TRANSCRIPT)]
@@ -0,0 +1,131 @@
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+
+import jobs
+from jobs import claim_job, enqueue, job_handler, run_job
+from models import db, Job
+
+
+@pytest.fixture(autouse=True)
+def handlers(monkeypatch):
+    """Replace the registered handlers (tasks.py) with test ones for each test."""
+    monkeypatch.setattr(jobs, '_handlers', {})
+    calls = []
+
+    @job_handler('test.noop', concurrency=100)
+    def noop(payload):
+        calls.append(payload)
+
+    @job_handler('test.limited', concurrency=2)
+    def limited(payload):
+        calls.append(payload)
+
+    @job_handler('test.fail', max_attempts=3)
+    def fail(payload):
+        raise RuntimeError('boom')
+
+    return calls
+
+
+def make_due(job_id):
+    """Move a job's run_after into the past, as if its backoff had elapsed."""
+    Job.query.filter_by(id=job_id).update({Job.run_after: datetime.utcnow() - timedelta(seconds=1)})
+    db.session.commit()
+
+
+def test_workers_never_claim_the_same_job(app):
+    job_ids = {enqueue('test.noop', {'n': n}) for n in range(50)}
+    claimed = []
+
+    def worker(name):
+        with app.app_context():
+            while True:
+                job = claim_job(name)
+                if job is None:
+                    break
+                claimed.append(job.id)
+            db.session.remove()
+
+    threads = [threading.Thread(target=worker, args=(f'worker-{i}',)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(claimed) == sorted(job_ids)
+    assert Job.query.filter_by(status='running').count() == len(job_ids)
+
+
+def test_concurrency_limit_is_honoured(app):
+    for n in range(5):
+        enqueue('test.limited', {'n': n})
+
+    first, second = claim_job('worker'), claim_job('worker')
+    assert first and second
+    assert claim_job('worker') is None
+
+    run_job(first)
+    third = claim_job('worker')
+    assert third is not None and third.id not in (first.id, second.id)
+    assert claim_job('worker') is None
+    assert Job.query.filter_by(job_type='test.limited', status='running').count() == 2
+
+
+def test_limit_of_one_type_does_not_block_others(app):
+    for n in range(3):
+        enqueue('test.limited', {'n': n})
+    noop_id = enqueue('test.noop', {})
+
+    claimed = {claim_job('worker').id for _ in range(3)}
+    assert noop_id in claimed
+
+
+def test_dedupe_returns_the_queued_job(app):
+    job_id = enqueue('test.noop', {}, dedupe_key='usage:u1')
+    assert enqueue('test.noop', {}, dedupe_key='usage:u1') == job_id
+    assert enqueue('test.noop', {}, dedupe_key='usage:u2') != job_id
+    assert Job.query.filter_by(dedupe_key='usage:u1').count() == 1
+
+
+def test_dedupe_ignores_running_jobs(app):
+    job_id = enqueue('test.noop', {}, dedupe_key='usage:u1')
+    assert claim_job('worker').id == job_id
+
+    # Whatever this enqueue is for may have happened after the running job read its input
+    second_id = enqueue('test.noop', {}, dedupe_key='usage:u1')
+    assert second_id != job_id
+    assert enqueue('test.noop', {}, dedupe_key='usage:u1') == second_id
+
+
+def test_failing_job_backs_off_and_fails_after_max_attempts(app):
+    job_id = enqueue('test.fail', {})
+
+    delays = []
+    for attempt in (1, 2):
+        job = claim_job('worker')
+        assert job.id == job_id
+        started = datetime.utcnow()
+        run_job(job)
+
+        job = db.session.get(Job, job_id)
+        assert job.status == 'queued'
+        assert job.attempts == attempt
+        assert 'boom' in job.last_error
+        delays.append((job.run_after - started).total_seconds())
+        # Not runnable until the backoff has elapsed
+        assert claim_job('worker') is None
+        make_due(job_id)
+
+    # ~5s then ~10s, with up to 20% jitter
+    assert 4 <= delays[0] <= 6.5
+    assert 8 <= delays[1] <= 12.5
+
+    run_job(claim_job('worker'))
+    job = db.session.get(Job, job_id)
+    assert job.status == 'failed'
+    assert job.attempts == 3
+    assert job.finished_at is not None
+    assert job.locked_by is None
+    assert claim_job('worker') is None
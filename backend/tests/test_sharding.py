@@ -0,0 +1,122 @@
+import sqlite3
+
+import pytest
+
+from conftest import login, read_feed
+from database import (
+    add_message, create_chat, get_all_chats, get_chat, get_generation_context, get_usage, get_user_shard,
+    import_into_shards, record_message_usage, rollup_usage, save_generation_context, set_setting, update_chat_title,
+    use_shard
+)
+from models import db, Chat, ShardAssignment, User
+
+
+@pytest.fixture
+def app_config():
+    return {'SHARD_COUNT': 2}
+
+
+@pytest.fixture
+def users(app):
+    """Two users, pinned to shard 0 and shard 1 through the shard map."""
+    for user_id, shard in (('user-0', 0), ('user-1', 1)):
+        db.session.add(User(id=user_id, google_id=f'google-{user_id}', email=f'{user_id}@example.com'))
+        db.session.add(ShardAssignment(user_id=user_id, shard=shard))
+    db.session.commit()
+    return ['user-0', 'user-1']
+
+
+def chat_ids_in(tmp_path, name):
+    with sqlite3.connect(tmp_path / name) as connection:
+        return {row[0] for row in connection.execute('SELECT id FROM chats')}
+
+
+def test_chats_are_written_to_their_users_shard(app, users, tmp_path):
+    chat_ids = {}
+    for user_id in users:
+        with use_shard(user_id):
+            chat_ids[user_id] = create_chat(user_id, f'Chat of {user_id}')
+
+    assert chat_ids_in(tmp_path, 'chats_shard0.db') == {chat_ids['user-0']}
+    assert chat_ids_in(tmp_path, 'chats_shard1.db') == {chat_ids['user-1']}
+    assert chat_ids_in(tmp_path, 'chats.db') == set()
+
+
+def test_reads_only_see_the_selected_shard(app, users):
+    for user_id in users:
+        with use_shard(user_id):
+            create_chat(user_id, f'Chat of {user_id}')
+            set_setting(user_id, 'custom_instructions', user_id)
+
+    with use_shard('user-0'):
+        assert [chat['title'] for chat in get_all_chats('user-0')] == ['Chat of user-0']
+        # user-1's chat is in the other file, so it can't be found from here
+        assert get_all_chats('user-1') == []
+        assert Chat.query.count() == 1
+
+
+def test_new_users_are_assigned_by_hash_and_remembered(app):
+    shards = {get_user_shard(f'user-{n}') for n in range(20)}
+    assert shards == {0, 1}
+    assignment = db.session.get(ShardAssignment, 'user-7')
+    assert assignment is not None and assignment.shard == get_user_shard('user-7')
+
+
+def test_sharded_query_without_a_shard_is_an_error(app, users):
+    with pytest.raises(RuntimeError, match='No shard selected'):
+        get_chat('missing')
+
+
+def test_import_moves_usage_and_saved_contexts(app, users, tmp_path):
+    # Data written before sharding was enabled lives in chats.db
+    app.config['SHARD_COUNT'] = 0
+    chat_id = create_chat('user-1', 'Before sharding')
+    add_message(chat_id, 'user', 'Hi')
+    reply_id = add_message(chat_id, 'assistant', 'Hello')
+    record_message_usage(reply_id, 'gemma3:1b', {
+        'prompt_eval_count': 10, 'eval_count': 5, 'eval_duration': 10**9, 'total_duration': 2 * 10**9
+    })
+    rollup_usage('user-1')
+    save_generation_context(chat_id, 'gemma3:1b', 'Be brief.', reply_id, [1, 2, 3])
+    question_id = add_message(chat_id, 'user', 'And then?')
+    db.session.remove()
+
+    app.config['SHARD_COUNT'] = 2
+    assert import_into_shards() == 1
+
+    with use_shard('user-1'):
+        usage = get_usage('user-1')
+        assert usage['totals']['messages'] == 1
+        assert usage['totals']['completion_tokens'] == 5
+        assert get_generation_context(chat_id, 'gemma3:1b', 'Be brief.', question_id) == [1, 2, 3]
+        assert [msg['content'] for msg in get_chat(chat_id)['messages']] == ['Hi', 'Hello', 'And then?']
+
+    with sqlite3.connect(tmp_path / 'chats.db') as connection:
+        for table in ('chats', 'messages', 'usage_rollups', 'generation_contexts'):
+            assert connection.execute(f'SELECT COUNT(*) FROM {table}').fetchone() == (0,), table
+
+
+def test_cursor_from_before_shard_import_is_told_to_refetch(app, users):
+    client = login(app, 'user-1')
+    app.config['SHARD_COUNT'] = 0
+    chat_id = create_chat('user-1', 'Before sharding')
+    update_chat_title(chat_id, 'Renamed before sharding')
+    old_version = int(client.get('/api/chats').headers['X-Chat-Version'])
+    db.session.remove()
+
+    app.config['SHARD_COUNT'] = 2
+    import_into_shards()
+    # Other users of the shard push its versions past the old cursor, which must still be rejected
+    with use_shard('user-0'):
+        for n in range(old_version + 5):
+            create_chat('user-0', f'Chat {n}')
+
+    (_, event), = read_feed(client, since=old_version)
+    assert event['type'] == 'reset'
+    # Reloading the list gives a version that resumes normally
+    new_version = int(client.get('/api/chats').headers['X-Chat-Version'])
+    assert new_version > old_version
+    assert read_feed(client, since=new_version) == []
+    with use_shard('user-1'):
+        update_chat_title(chat_id, 'Renamed in the shard')
+    assert [event['type'] for _, event in read_feed(client, since=new_version)] == ['title']
@@ -0,0 +1,44 @@
+import json
+import os
+import subprocess
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Only needed by some code paths, so they must be imported on first use, not at startup
+LAZY_MODULES = (
+    'ollama', 'httpx', 'google.auth', 'google.oauth2', 'requests', 'flask_migrate', 'alembic', 'orjson', 'zstandard'
+)
+
+# Generous, so a slow CI machine passes; benchmarks/import_time.py checks the real budget
+BUDGET_SECONDS = 3.0
+
+PROBE = f'''
+import json, sys, time
+start = time.perf_counter()
+from app import create_app
+create_app()
+elapsed = time.perf_counter() - start
+print(json.dumps({{'seconds': elapsed, 'loaded': [m for m in {LAZY_MODULES!r} if m in sys.modules]}}))
+'''
+
+
+def start_app():
+    """Import app and call create_app() in a new interpreter. Returns (seconds, lazy modules loaded)."""
+    result = subprocess.run(
+        [sys.executable, '-c', PROBE], cwd=BACKEND_DIR, capture_output=True, text=True, check=True
+    )
+    # create_app() prints a line too; the measurement is the last one
+    data = json.loads(result.stdout.strip().splitlines()[-1])
+    return data['seconds'], data['loaded']
+
+
+def test_startup_does_not_import_lazy_modules():
+    _, loaded = start_app()
+    assert loaded == []
+
+
+def test_startup_is_within_budget():
+    # Best of three, so one slow start (cold disk cache) doesn't fail the test
+    best = min(start_app()[0] for _ in range(3))
+    assert best < BUDGET_SECONDS
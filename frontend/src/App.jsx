@@ -12,10 +12,10 @@ function App() {
   );
 }
 
-function ChatRoute({ currentModel, onChatUpdate, chatId: propChatId, onDeleteChat, onNewChat }) {
+function ChatRoute({ currentModel, chatId: propChatId, onDeleteChat, onNewChat }) {
   const { chatId: paramChatId } = useParams();
   const chatId = propChatId !== undefined ? propChatId : (paramChatId || null);
-  return <ChatView chatId={chatId} currentModel={currentModel} onChatUpdate={onChatUpdate} onDeleteChat={onDeleteChat} onNewChat={onNewChat} />;
+  return <ChatView chatId={chatId} currentModel={currentModel} onDeleteChat={onDeleteChat} onNewChat={onNewChat} />;
 }
 
 function AppContent() {
@@ -33,6 +33,10 @@ function AppContent() {
   const [user, setUser] = useState(null);
   const [loading, setLoading] = useState(true);
   const isCreatingChatRef = useRef(false);
+  const chatVersionRef = useRef(0);
+  const refreshTimersRef = useRef({});
+  // Per chat: the ETag, cursors and messages of the last refresh, so the next one only fetches changes
+  const chatCursorsRef = useRef({});
   const location = useLocation();
   const navigate = useNavigate();
 
@@ -44,7 +48,6 @@ function AppContent() {
   // Load chats and settings when authenticated, and create new chat if on base route
   useEffect(() => {
     if (user) {
-      loadChats();
       loadSettings();
       // If on base route, create a new chat after a short delay to ensure state is ready
       if (location.pathname === '/' && !isCreatingChatRef.current) {
@@ -177,6 +180,27 @@ function AppContent() {
     }
   }, [location.pathname, user]);
 
+  // Load the chat list once, then keep it in sync (with other tabs and devices too) from the change feed
+  useEffect(() => {
+    if (!user) return;
+    let events = null;
+    let cancelled = false;
+    const refreshTimers = refreshTimersRef.current;
+    loadChats().then(() => {
+      if (cancelled) return;
+      // EventSource reconnects by itself, resuming after the last event it received
+      events = new EventSource(`http://localhost:5001/api/chats/events?since=${chatVersionRef.current}`, {
+        withCredentials: true,
+      });
+      events.onmessage = (e) => applyChatEvent(JSON.parse(e.data));
+    });
+    return () => {
+      cancelled = true;
+      if (events) events.close();
+      Object.values(refreshTimers).forEach(clearTimeout);
+    };
+  }, [user]);
+
   const loadChats = async () => {
     try {
       const response = await fetch('http://localhost:5001/api/chats', {
@@ -184,6 +208,7 @@ function AppContent() {
       });
       if (response.ok) {
         const chatsData = await response.json();
+        chatVersionRef.current = Number(response.headers.get('X-Chat-Version')) || 0;
         setChats(chatsData);
       } else if (response.status === 401) {
         setUser(null);
@@ -193,6 +218,88 @@ function AppContent() {
     }
   };
 
+  const applyChatEvent = (event) => {
+    if (event.type === 'reset') {
+      chatCursorsRef.current = {};
+      loadChats();
+      return;
+    }
+    if (event.type === 'deleted') {
+      delete chatCursorsRef.current[event.chat_id];
+      setChats(prev => prev.filter(chat => chat.id !== event.chat_id));
+      return;
+    }
+    // created, updated or title: the event has the chat without its messages
+    setChats(prev => {
+      const existing = prev.find(chat => chat.id === event.chat_id);
+      const chat = { ...existing, ...event.chat, messages: existing ? existing.messages : [] };
+      return [chat, ...prev.filter(c => c.id !== event.chat_id)]
+        .sort((a, b) => new Date(b.updated_at) - new Date(a.updated_at));
+    });
+    if (event.chat.message_count > 0) {
+      scheduleChatRefresh(event.chat_id);
+    }
+  };
+
+  // Fetch one chat's messages (for search) once its updates have settled, e.g. after a reply finished streaming
+  const scheduleChatRefresh = (chatId) => {
+    clearTimeout(refreshTimersRef.current[chatId]);
+    refreshTimersRef.current[chatId] = setTimeout(async () => {
+      delete refreshTimersRef.current[chatId];
+      try {
+        await refreshChat(chatId);
+      } catch (error) {
+        console.error('Error refreshing chat:', error);
+      }
+    }, 1000);
+  };
+
+  // The messages from the root down to leafId, or null if some of them haven't been loaded
+  const branchTo = (byId, leafId) => {
+    const branch = [];
+    let id = leafId;
+    while (id != null) {
+      const message = byId[id];
+      if (!message) return null;
+      branch.unshift(message);
+      id = message.parent_id;
+    }
+    return branch;
+  };
+
+  // Fetch only the messages added or changed since the last refresh (a 304 when there are none)
+  const refreshChat = async (chatId) => {
+    const cursor = chatCursorsRef.current[chatId];
+    const query = cursor ? `?after_seq=${cursor.afterSeq}&updated_after=${cursor.updateSeq}` : '';
+    const response = await fetch(`http://localhost:5001/api/chats/${chatId}/messages${query}`, {
+      credentials: 'include',
+      headers: cursor && cursor.etag ? { 'If-None-Match': cursor.etag } : {},
+    });
+    if (response.status === 304 || !response.ok) return;
+    const data = await response.json();
+    const byId = { ...(cursor ? cursor.byId : {}) };
+    data.messages.forEach(msg => { byId[msg.id] = msg; });
+    // Chats from before branching have no active leaf; those are always fetched whole
+    const messages = data.active_leaf_id == null ? data.messages : branchTo(byId, data.active_leaf_id);
+    if (messages === null) {
+      // Switched to a branch the earlier fetches didn't include: start over
+      delete chatCursorsRef.current[chatId];
+      if (cursor) await refreshChat(chatId);
+      return;
+    }
+    if (data.active_leaf_id == null) {
+      delete chatCursorsRef.current[chatId];
+    } else {
+      chatCursorsRef.current[chatId] = {
+        etag: response.headers.get('ETag'),
+        afterSeq: Math.max(-1, ...Object.values(byId).map(msg => msg.sequence_order)),
+        updateSeq: data.update_seq,
+        byId,
+      };
+    }
+    setChats(prev => prev.map(chat => (chat.id === chatId ? { ...chat, messages } : chat)));
+  };
+
   const confirmDeleteChat = (chatId, e) => {
     if (e) {
       e.stopPropagation(); // Prevent navigation when clicking delete
@@ -244,9 +351,7 @@ function AppContent() {
           ? location.pathname.split('/c/')[1] 
           : null;
         
-        // Refresh chat list
-        await loadChats();
-        setChatToDelete(null); // Close modal
+        setChatToDelete(null); // Close modal (the change feed removes the chat from the list)
         
         // If we deleted the current chat, navigate to a new one
         if (currentChatId === chatId) {
@@ -290,7 +395,6 @@ function AppContent() {
           });
 
       if (response.ok) {
-        await loadChats(); // Refresh chat list
         setEditingChatId(null);
         setEditingTitle('');
       } else {
@@ -329,7 +433,6 @@ function AppContent() {
       if (response.ok) {
         const newChat = await response.json();
         navigate(`/c/${newChat.id}`);
-        loadChats(); // Refresh chat list
       }
     } catch (error) {
       console.error('Error creating chat:', error);
@@ -548,7 +651,7 @@ function AppContent() {
 
         {/* Main Chat Area */}
           <Routes>
-            <Route path="/c/:chatId" element={<ChatRoute currentModel={currentModel} onChatUpdate={loadChats} onDeleteChat={confirmDeleteChat} onNewChat={handleNewChat} />} />
+            <Route path="/c/:chatId" element={<ChatRoute currentModel={currentModel} onDeleteChat={confirmDeleteChat} onNewChat={handleNewChat} />} />
             <Route path="/" element={null} />
           </Routes>
       </div>
@@ -7,7 +7,7 @@ import { useNavigate } from 'react-router-dom';
 import { CodeBlock } from './CodeBlock';
 import jsPDF from 'jspdf';
 
-function ChatView({ chatId, currentModel, onChatUpdate, onDeleteChat, onNewChat }) {
+function ChatView({ chatId, currentModel, onDeleteChat, onNewChat }) {
   const navigate = useNavigate();
   const [messages, setMessages] = useState([]);
   const [input, setInput] = useState('');
@@ -17,6 +17,7 @@ function ChatView({ chatId, currentModel, onChatUpdate, onDeleteChat, onNewChat
   const [openHeaderMenu, setOpenHeaderMenu] = useState(false);
   const [editingTitle, setEditingTitle] = useState(false);
   const [tempTitle, setTempTitle] = useState('');
+  const [limitsNotice, setLimitsNotice] = useState(null);
   const messagesEndRef = useRef(null);
   const currentMessageRef = useRef('');
   const textareaRef = useRef(null);
@@ -25,16 +26,11 @@ function ChatView({ chatId, currentModel, onChatUpdate, onDeleteChat, onNewChat
 
   const deleteEmptyChat = async (id) => {
     try {
-      const response = await fetch(`http://localhost:5001/api/chats/${id}`, {
+      // The sidebar drops the chat when the change feed reports the deletion
+      await fetch(`http://localhost:5001/api/chats/${id}`, {
         method: 'DELETE',
         credentials: 'include',
       });
-      if (response.ok) {
-        // Refresh the chat list in the sidebar
-        if (onChatUpdate) {
-          onChatUpdate();
-        }
-      }
     } catch (error) {
       console.error('Error deleting empty chat:', error);
     }
@@ -122,6 +118,8 @@ function ChatView({ chatId, currentModel, onChatUpdate, onDeleteChat, onNewChat
       textareaRef.current.style.height = 'auto';
     }
     setIsStreaming(true);
+    // Replies only carry a notice while the server limits them
+    setLimitsNotice(null);
 
     // Add user message
     const newMessages = [...messages, { role: 'user', content: userMessage }];
@@ -145,15 +143,6 @@ function ChatView({ chatId, currentModel, onChatUpdate, onDeleteChat, onNewChat
         }),
       });
 
-      // If this is the first message, update chat list immediately after request is sent
-      // The backend updates the title synchronously before streaming starts
-      if (messages.length === 0 && onChatUpdate) {
-        // Small delay to ensure backend has processed the title update
-        setTimeout(() => {
-          onChatUpdate();
-        }, 200);
-      }
-
       if (!response.ok) {
         throw new Error('Failed to get response');
       }
@@ -173,6 +162,9 @@ function ChatView({ chatId, currentModel, onChatUpdate, onDeleteChat, onNewChat
           if (line.startsWith('data: ')) {
             try {
               const data = JSON.parse(line.slice(6));
+              if (data.notice) {
+                setLimitsNotice(data.notice);
+              }
               if (data.content) {
                 currentMessageRef.current += data.content;
                 setMessages([
@@ -186,10 +178,6 @@ function ChatView({ chatId, currentModel, onChatUpdate, onDeleteChat, onNewChat
                   // Navigate to the new chat
                   navigate(`/c/${data.chat_id}`);
                 }
-                // Always refresh chat list to update title in sidebar
-                  if (onChatUpdate) {
-                    onChatUpdate();
-                }
                 setIsStreaming(false);
                 return;
               }
@@ -332,9 +320,6 @@ function ChatView({ chatId, currentModel, onChatUpdate, onDeleteChat, onNewChat
       if (response.ok) {
         setChatTitle(tempTitle.trim());
         setEditingTitle(false);
-        if (onChatUpdate) {
-          onChatUpdate();
-        }
       } else {
         alert('Failed to rename chat');
         setTempTitle(chatTitle);
@@ -551,6 +536,7 @@ function ChatView({ chatId, currentModel, onChatUpdate, onDeleteChat, onNewChat
 
         {/* Input Area */}
         <div className="input-area">
+          {limitsNotice && <div className="limits-notice">{limitsNotice}</div>}
           <div className="input-wrapper">
             <textarea
               ref={textareaRef}
@@ -1,10 +1,21 @@
 #!/usr/bin/env python3
 """
 Simple script to run Gemma 3:1b model with Ollama and stream responses.
+
+Single prompt:
+    python gemma3_stream.py "Explain what machine learning is"
+
+Batch mode (JSONL in, JSONL out, resumable):
+    python gemma3_stream.py --batch prompts.jsonl --output results.jsonl --concurrency 4
 """
 
+import argparse
+import json
 import ollama
 import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 def stream_chat(prompt, model="gemma3:1b"):
     """
@@ -37,13 +48,188 @@ def stream_chat(prompt, model="gemma3:1b"):
         sys.exit(1)
 
 
+def load_prompts(path):
+    """
+    Read prompts from a JSONL file.
+    
+    Each line needs an id ('id' or 'request_id', defaults to the line number) and
+    either 'messages', 'prompt' or 'body' (with an optional 'title' prepended).
+    
+    Returns:
+        List of (prompt_id, messages) tuples
+    
+    Raises:
+        ValueError: If a line isn't JSON or has none of those keys
+    """
+    prompts = []
+    with open(path, encoding='utf-8') as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError as e:
+                raise ValueError(f"{path}, line {line_number}: invalid JSON ({e})") from e
+            prompt_id = str(record.get('id', record.get('request_id', line_number)))
+            if 'messages' in record:
+                messages = record['messages']
+            elif 'prompt' in record:
+                messages = [{'role': 'user', 'content': record['prompt']}]
+            elif 'body' in record:
+                content = record['body']
+                if record.get('title'):
+                    content = f"{record['title']}\n\n{content}"
+                messages = [{'role': 'user', 'content': content}]
+            else:
+                raise ValueError(
+                    f"{path}, line {line_number}: expected 'messages', 'prompt' or 'body' (with optional 'title'), "
+                    f"got {', '.join(map(repr, record)) or 'no keys'}"
+                )
+            prompts.append((prompt_id, messages))
+    return prompts
+
+
+def load_completed_ids(path):
+    """Return the ids already answered successfully in an output file, so a rerun can resume."""
+    completed = set()
+    try:
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # Partially written line from an interrupted run
+                # Anything else that isn't a result (e.g. a hand-edited line) doesn't count either
+                if not isinstance(record, dict) or 'id' not in record:
+                    continue
+                if not record.get('error'):
+                    completed.add(str(record['id']))
+    except FileNotFoundError:
+        pass
+    return completed
+
+
+def run_prompt(client, prompt_id, messages, model):
+    """
+    Stream one prompt and measure it.
+    
+    Returns:
+        Result dict with the response, time-to-first-token, tokens/s and token counts
+    """
+    result = {'id': prompt_id, 'model': model}
+    start = time.perf_counter()
+    first_token_at = None
+    parts = []
+    chunks = 0
+    final = {}
+    try:
+        for chunk in client.chat(model=model, messages=messages, stream=True):
+            content = chunk.get('message', {}).get('content', '')
+            if content:
+                if first_token_at is None:
+                    first_token_at = time.perf_counter()
+                parts.append(content)
+                chunks += 1
+            if chunk.get('done'):
+                final = chunk
+    except Exception as e:
+        result['error'] = str(e)
+    end = time.perf_counter()
+    
+    # Prefer Ollama's own counters; fall back to chunk counts and wall-clock time
+    eval_count = final.get('eval_count', chunks)
+    if final.get('eval_duration'):
+        tokens_per_s = eval_count / (final['eval_duration'] / 1e9)
+    elif first_token_at is not None and end > first_token_at:
+        tokens_per_s = eval_count / (end - first_token_at)
+    else:
+        tokens_per_s = None
+    
+    result.update({
+        'response': ''.join(parts),
+        'ttft_s': round(first_token_at - start, 4) if first_token_at is not None else None,
+        'total_s': round(end - start, 4),
+        'prompt_eval_count': final.get('prompt_eval_count'),
+        'eval_count': eval_count,
+        'tokens_per_s': round(tokens_per_s, 2) if tokens_per_s else None,
+    })
+    return result
+
+
+def run_batch(input_path, output_path, model="gemma3:1b", concurrency=4, host=None):
+    """
+    Run every prompt of a JSONL file through the model with bounded concurrency.
+    
+    Results are appended to output_path as they finish; prompts that already have
+    a successful result there are skipped, so an interrupted run can be resumed.
+    
+    Returns:
+        Summary dict with aggregate throughput
+    """
+    client = ollama.Client(host=host)
+    prompts = load_prompts(input_path)
+    completed = load_completed_ids(output_path)
+    pending = [(prompt_id, messages) for prompt_id, messages in prompts if prompt_id not in completed]
+    print(f"{len(prompts)} prompts, {len(prompts) - len(pending)} already done, running {len(pending)} with concurrency {concurrency}")
+    
+    write_lock = threading.Lock()
+    results = []
+    start = time.perf_counter()
+    with open(output_path, 'a', encoding='utf-8') as out, ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = [pool.submit(run_prompt, client, prompt_id, messages, model) for prompt_id, messages in pending]
+        for future in as_completed(futures):
+            result = future.result()
+            results.append(result)
+            # One flushed line per prompt acts as the checkpoint
+            with write_lock:
+                out.write(json.dumps(result, ensure_ascii=False) + '\n')
+                out.flush()
+            if result.get('error'):
+                print(f"[{result['id']}] ERROR: {result['error']}", file=sys.stderr)
+            else:
+                print(f"[{result['id']}] ttft={result['ttft_s']}s tokens/s={result['tokens_per_s']} total={result['total_s']}s")
+    wall_time = time.perf_counter() - start
+    
+    succeeded = [r for r in results if not r.get('error')]
+    total_tokens = sum(r['eval_count'] or 0 for r in succeeded)
+    ttfts = sorted(r['ttft_s'] for r in succeeded if r['ttft_s'] is not None)
+    summary = {
+        'prompts': len(results),
+        'failed': len(results) - len(succeeded),
+        'wall_time_s': round(wall_time, 3),
+        'total_tokens': total_tokens,
+        'aggregate_tokens_per_s': round(total_tokens / wall_time, 2) if wall_time > 0 else None,
+        'mean_ttft_s': round(sum(ttfts) / len(ttfts), 4) if ttfts else None,
+        'p95_ttft_s': ttfts[min(len(ttfts) - 1, int(len(ttfts) * 0.95))] if ttfts else None,
+    }
+    print(json.dumps(summary, indent=2))
+    return summary
+
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('prompt', nargs='*', help='Prompt to run (single-prompt mode)')
+    parser.add_argument('--model', default='gemma3:1b')
+    parser.add_argument('--batch', metavar='JSONL', help='Run every prompt in this JSONL file')
+    parser.add_argument('--output', metavar='JSONL', default='results.jsonl', help='Where batch results are appended')
+    parser.add_argument('--concurrency', type=int, default=4, help='Prompts in flight at once')
+    parser.add_argument('--host', default=None, help='Ollama host, e.g. http://localhost:11434')
+    args = parser.parse_args()
+    
+    if args.batch:
+        try:
+            summary = run_batch(args.batch, args.output, args.model, args.concurrency, args.host)
+        except ValueError as e:
+            print(f"Error: {e}", file=sys.stderr)
+            sys.exit(1)
+        sys.exit(1 if summary['failed'] else 0)
+    
     # Get prompt from command line or use default
-    if len(sys.argv) > 1:
-        prompt = " ".join(sys.argv[1:])
+    if args.prompt:
+        prompt = " ".join(args.prompt)
     else:
         prompt = "Explain what machine learning is in simple terms."
     
     print(f"Prompt: {prompt}\n")
-    stream_chat(prompt)
-
+    stream_chat(prompt, args.model)